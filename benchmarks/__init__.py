@@ -0,0 +1,2 @@
+"""Benchmarks for the SIC/XE assembler. Run them from the repository root, e.g.
+``python -m benchmarks.opcode_dispatch``."""
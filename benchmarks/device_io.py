@@ -0,0 +1,70 @@
+"""
+Benchmark buffered device I/O against one file transfer per byte.
+
+Assembles a program that copies device F1 to device 05 one byte at a time
+with RD/WD, then runs it with file-backed StreamDevices using a 1-byte
+buffer (a system call per RD or WD) and the default block-sized buffer.
+Reports run time, transfers and time spent in device I/O.
+
+    python -m benchmarks.device_io [bytes]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from src.assembler import Assembler
+from src.devices import StreamDevice, BUFFER_SIZE
+from src.emulator import PredecodingMachine
+
+COPY_PROGRAM = [
+    "COPY START 0",
+    "FIRST TD INDEV",
+    " JEQ FIRST",
+    "LOOP RD INDEV",
+    " COMP #0",
+    " JEQ DONE",
+    " WD OUTDEV",
+    " J LOOP",
+    "DONE J DONE",
+    "INDEV BYTE X'F1'",
+    "OUTDEV BYTE X'05'",
+    " END FIRST",
+]
+
+
+def run_copy(htme_records, input_path, output_path, buffer_size):
+    with open(input_path, 'rb') as reader, open(output_path, 'wb') as writer:
+        devices = {0xF1: StreamDevice(reader=reader, buffer_size=buffer_size),
+                   0x05: StreamDevice(writer=writer, buffer_size=buffer_size)}
+        machine = PredecodingMachine(devices=devices)
+        machine.load(htme_records)
+        start = time.perf_counter()
+        machine.run()
+        elapsed = time.perf_counter() - start
+    return elapsed, devices
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    htme_records = Assembler().assemble(COPY_PROGRAM).htme_records
+    data = bytes((i % 255) + 1 for i in range(size))  # no zero bytes: zero ends the copy
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, 'in.bin')
+        output_path = os.path.join(tmp, 'out.bin')
+        with open(input_path, 'wb') as f:
+            f.write(data)
+
+        for label, buffer_size in (("1-byte buffer", 1), (f"{BUFFER_SIZE // 1024} KiB buffer", BUFFER_SIZE)):
+            elapsed, devices = run_copy(htme_records, input_path, output_path, buffer_size)
+            with open(output_path, 'rb') as f:
+                status = "output ok" if f.read() == data else "OUTPUT MISMATCH"
+            transfers = sum(d.transfers for d in devices.values())
+            io_seconds = sum(d.seconds for d in devices.values())
+            print(f"{label:15} {elapsed:.3f}s total, {transfers} transfers, "
+                  f"{io_seconds * 1000:.1f} ms in device I/O ({status})")
+
+
+if __name__ == "__main__":
+    main()
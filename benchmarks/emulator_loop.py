@@ -0,0 +1,65 @@
+"""
+Benchmark the emulator's execution strategies against each other.
+
+Assembles a tight TIXR/JLT counter loop and runs it on Machine (decodes
+every instruction it executes), PredecodingMachine (decodes each address
+once) and TranslatingMachine (compiles hot basic blocks to Python). Checks
+all three end in the same state and reports instructions/sec.
+
+    python -m benchmarks.emulator_loop [iterations]
+"""
+import sys
+import time
+
+from src.assembler import Assembler
+from src.emulator import Machine, PredecodingMachine
+from src.translator import TranslatingMachine
+
+
+def counter_loop(iterations):
+    """Source of a loop that adds X into A iterations times, then halts"""
+    return [
+        "LOOP START 0",
+        "FIRST CLEAR A",
+        " CLEAR X",
+        f" +LDT #{iterations}",
+        "NEXT ADDR X,A",
+        " TIXR T",
+        " JLT NEXT",
+        " STA TOTAL",
+        "HALT J HALT",
+        "TOTAL RESW 1",
+        " END FIRST",
+    ]
+
+
+def run(machine_class, htme_records):
+    machine = machine_class()
+    machine.load(htme_records)
+    start = time.perf_counter()
+    steps = machine.run()
+    return machine, steps, time.perf_counter() - start
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    result = Assembler().assemble(counter_loop(iterations))
+
+    timings = {}
+    states = {}
+    for machine_class in (Machine, PredecodingMachine, TranslatingMachine):
+        machine, steps, seconds = run(machine_class, result.htme_records)
+        timings[machine_class] = seconds
+        states[machine_class] = machine.state()
+        decoded = getattr(machine, 'decoded', steps)
+        print(f"{machine_class.__name__:18} {steps} instructions in {seconds:.3f}s "
+              f"({steps / seconds:12,.0f} instructions/sec, {decoded} decoded)")
+
+    same = all(state == states[Machine] for state in states.values())
+    print(f"speedup over Machine: predecoding {timings[Machine] / timings[PredecodingMachine]:.1f}x, "
+          f"translating {timings[Machine] / timings[TranslatingMachine]:.1f}x "
+          f"({'same final state' if same else 'STATE MISMATCH'})")
+
+
+if __name__ == "__main__":
+    main()
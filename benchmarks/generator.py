@@ -0,0 +1,175 @@
+"""
+Seeded generator of valid SIC/XE programs of any size, for benchmarks.
+
+The program is built from chunks of instructions, each followed by its own
+data words and a literal pool (LTORG), so every format 3 operand stays
+within PC-relative range however long the program gets. An operand names
+data in its own chunk (a forward reference) or in the chunk before
+(a backward one). Programs longer than section_lines are split into
+control sections (CSECT) to stay inside the 1 MiB address space; each is
+assembled from address 0 with symbol names of its own.
+
+The mix weights pick each statement's kind: format1, format2, format3,
+format4, directive (inline WORD, BYTE or RESB) or literal (a format 3
+instruction with a =X'..' operand). The same seed, size and mix always
+give the same program.
+
+    python -m benchmarks.generator LINES [-s SEED] [-o FILE] [--mix format3=50,literal=10,...]
+"""
+import argparse
+import random
+import sys
+
+DEFAULT_MIX = {'format1': 3, 'format2': 12, 'format3': 50, 'format4': 8, 'directive': 12, 'literal': 15}
+DEFAULT_FORWARD = 0.5  # share of references to data defined further down
+CHUNK_STATEMENTS = 48  # statements between data blocks; keeps every target within 2 KB
+SECTION_LINES = 50_000
+
+FORMAT1 = ['FIX', 'FLOAT', 'NORM', 'HIO', 'SIO', 'TIO']
+REGISTERS = ['A', 'X', 'L', 'B', 'S', 'T', 'F']
+FORMAT2 = ['ADDR', 'SUBR', 'MULR', 'COMPR', 'RMO']
+LOADS_STORES = ['LDA', 'LDX', 'LDT', 'LDS', 'LDB', 'STA', 'STX', 'STT', 'STS', 'ADD', 'SUB', 'MUL',
+                'DIV', 'AND', 'OR', 'COMP']
+JUMPS = ['J', 'JEQ', 'JGT', 'JLT']
+
+
+def parse_mix(text):
+    """Mix weights from 'format3=50,literal=10'; kinds not named keep their default weight"""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, text.split(',')):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f"Unknown statement kind '{kind}', expected one of {', '.join(DEFAULT_MIX)}")
+        mix[kind] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise ValueError("The mix needs at least one positive weight")
+    return mix
+
+
+class Chunk:
+    """Names of one chunk's data words and code labels"""
+
+    def __init__(self, prefix, number):
+        name = f"{prefix}{number}"
+        self.start = f"C{name}"  # first instruction of the chunk
+        self.end = f"N{name}"  # first instruction after its data
+        self.words = [f"W{name}_{i}" for i in range(3)]  # WORD
+        self.buffer = f"B{name}"  # RESW, read with ,X
+
+
+def generate(n_lines, seed=0, mix=None, forward=DEFAULT_FORWARD, section_lines=SECTION_LINES):
+    """Yield the lines of a program of about n_lines source lines (at least one chunk)"""
+    rng = random.Random(seed)
+    mix = DEFAULT_MIX if mix is None else mix
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    produced = 0
+    section = 0
+    while True:
+        limit = min(section_lines, n_lines - produced)
+        lines = list(section_source(rng, section, limit, kinds, weights, forward))
+        produced += len(lines)
+        last = limit < section_lines or produced >= n_lines  # no tiny section for the remainder
+        if last:
+            lines.append(" END FIRST" if section == 0 else " END")
+        yield from lines
+        if last:
+            return
+        section += 1
+
+
+def section_source(rng, section, limit, kinds, weights, forward):
+    """Lines of one control section, a little under limit long"""
+    prefix = f"S{section}_"
+    yield "BENCH START 0" if section == 0 else f"SEC{section} CSECT"
+    yield "FIRST LDX #0" if section == 0 else " LDX #0"
+    count = 2
+    previous = None
+    number = 0
+    literal = 0
+    while True:
+        chunk = Chunk(prefix, number)
+        body = []
+        for _ in range(CHUNK_STATEMENTS):
+            kind = rng.choices(kinds, weights)[0]
+            if kind == 'literal':
+                literal += 1
+            body.append(statement(rng, kind, chunk, previous, forward, literal))
+        body[0] = f"{chunk.start} {body[0].lstrip()}"
+        data = [f" J {chunk.end}"]
+        data += [f"{word} WORD {rng.randrange(4096)}" for word in chunk.words]
+        data += [f"{chunk.buffer} RESW {rng.randrange(1, 8)}", " LTORG", f"{chunk.end} CLEAR A"]
+        if count + len(body) + len(data) > limit and number:
+            return
+        yield from body
+        yield from data
+        count += len(body) + len(data)
+        previous = chunk
+        number += 1
+
+
+def statement(rng, kind, chunk, previous, forward, literal):
+    """One statement of the given kind inside chunk"""
+    if kind == 'format1':
+        return f" {rng.choice(FORMAT1)}"
+    if kind == 'format2':
+        if rng.random() < 0.2:
+            return f" {rng.choice(['SHIFTL', 'SHIFTR'])} {rng.choice(REGISTERS)},{rng.randrange(1, 17)}"
+        return f" {rng.choice(FORMAT2)} {rng.choice(REGISTERS)},{rng.choice(REGISTERS)}"
+    if kind == 'directive':
+        choice = rng.randrange(4)
+        if choice == 0:
+            return f" WORD {rng.randrange(-8388608, 8388608)}"
+        if choice == 1:
+            return f" BYTE X'{rng.randrange(256):02X}'"
+        if choice == 2:
+            return f" BYTE C'{rng.choice(['EOF', 'OK', 'SICXE', 'A'])}'"
+        return f" RESB {rng.randrange(1, 16)}"
+    if kind == 'literal':
+        return f" {rng.choice(['LDA', 'ADD', 'COMP', 'SUB'])} =X'{literal:06X}'"
+
+    target = chunk if previous is None or rng.random() < forward else previous
+    if kind == 'format4':
+        if rng.random() < 0.3:
+            return f" +JSUB {target.start}"
+        return f" +{rng.choice(LOADS_STORES)} {rng.choice(target.words)}"
+    choice = rng.randrange(10)
+    if choice == 0:
+        return f" {rng.choice(LOADS_STORES[:5])} #{rng.randrange(4096)}"
+    if choice == 1:
+        return f" {rng.choice(LOADS_STORES)} {target.buffer},X"
+    if choice == 2:
+        return f" {rng.choice(JUMPS)} {target.end if target is chunk else target.start}"
+    if choice == 3:
+        return f" {rng.choice(LOADS_STORES[:5])} @{rng.choice(target.words)}"
+    return f" {rng.choice(LOADS_STORES)} {rng.choice(target.words)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic SIC/XE program.")
+    parser.add_argument('lines', type=int, help="number of source lines (about)")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="write here instead of standard output")
+    parser.add_argument('--mix', default='', help="statement weights, e.g. format3=50,literal=10")
+    parser.add_argument('--forward', type=float, default=DEFAULT_FORWARD,
+                        help=f"share of references to data defined later (default: {DEFAULT_FORWARD})")
+    parser.add_argument('--section-lines', type=int, default=SECTION_LINES,
+                        help=f"start a new control section after this many lines (default: {SECTION_LINES})")
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for line in generate(args.lines, args.seed, mix, args.forward, args.section_lines):
+            out.write(f"{line}\n")
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
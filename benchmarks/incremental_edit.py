@@ -0,0 +1,60 @@
+"""
+Benchmark incremental re-assembly against a full re-assembly.
+
+Builds a program with benchmarks.generator (100k lines by default), then
+edits one line in the middle: first an operand change that keeps every
+address, then an inserted instruction that shifts every later address.
+Reports the time of IncrementalAssembler.update() and of a full
+Assembler().assemble(), and checks the two produce the same output. The
+program has no literals and stays in one control section, since either
+makes every update a full one.
+
+    python -m benchmarks.incremental_edit [lines]
+"""
+import sys
+import time
+
+from benchmarks.generator import generate, parse_mix
+from src.assembler import Assembler
+from src.incremental import IncrementalAssembler
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def same_output(a, b):
+    return (a.object_codes == b.object_codes and a.listing_lines == b.listing_lines
+            and a.htme_records == b.htme_records and a.symbol_table == b.symbol_table)
+
+
+def main():
+    n_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    source = list(generate(n_lines, mix=parse_mix('literal=0'), section_lines=n_lines + 1))
+    middle = len(source) // 2
+    while not source[middle].startswith(' J '):  # a chunk's closing jump, 3 bytes like ADD #7
+        middle += 1
+
+    engine = IncrementalAssembler()
+    _, initial = timed(engine.update, source)
+    print(f"{len(source)} lines, initial assembly {initial * 1000:.1f} ms")
+
+    edits = [
+        ("operand change, addresses unchanged", source[:middle] + [" ADD #7"] + source[middle + 1:]),
+        ("inserted line, later addresses shift", source[:middle] + [" CLEAR A"] + source[middle:]),
+    ]
+    for description, edited in edits:
+        engine = IncrementalAssembler()
+        engine.update(source)
+        incremental, inc_time = timed(engine.update, edited)
+        full, full_time = timed(Assembler().assemble, edited)
+        status = "identical output" if same_output(incremental, full) else "OUTPUT MISMATCH"
+        print(f"{description}:")
+        print(f"  full {full_time * 1000:8.1f} ms   incremental {inc_time * 1000:8.1f} ms   "
+              f"speedup {full_time / inc_time:5.1f}x   re-encoded {engine.reencoded} lines ({status})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark separately assembled control sections against one big source.
+
+Generates a chain of control sections, each calling the next through an
+EXTREF and reading a shared table defined by the first one. Compares:
+re-assembling the whole source after an edit to one section, assembling
+just that section, and linking the object records of every section with
+the one-pass linking loader. The linked program is run to check it.
+
+    python -m benchmarks.link_sections [sections] [lines per section]
+"""
+import sys
+import time
+
+from src.assembler import Assembler
+from src.emulator import PredecodingMachine
+from src.loader import link, parse_programs
+
+
+def section_source(index, count, body_lines):
+    """Source lines of control section index in a chain of count sections"""
+    name = f"SEC{index}"
+    lines = [f"{name} START 0" if index == 0 else f"{name} CSECT"]
+    if index == 0:
+        lines.append(" EXTDEF TABLE")
+    lines.append(f" EXTDEF E{index}")
+    refs = ['TABLE'] + ([f"E{index + 1}"] if index + 1 < count else [])
+    if index:
+        lines.append(f" EXTREF {','.join(refs)}")
+    elif count > 1:
+        lines.append(f" EXTREF E{index + 1}")
+    if index == 0:
+        lines += [" LDA #0", " STL SAVED", f" +JSUB E{index}", " LDL SAVED", "HALT J HALT", "SAVED RESW 1"]
+    lines += [f"E{index} STL RET"]
+    for i in range(body_lines):
+        lines.append(f" +ADD TABLE" if i % 4 == 0 else f" ADD #{i % 7}")
+    if index + 1 < count:
+        lines += [f" +JSUB E{index + 1}"]
+    lines += [" LDL RET", " RSUB", "RET RESW 1"]
+    if index == 0:
+        lines += ["TABLE WORD 1"]
+    return lines
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    body_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    sections = [section_source(i, count, body_lines) for i in range(count)]
+    whole = [line for section in sections for line in section] + [" END SEC0"]
+    sections[-1].append(" END")
+
+    start = time.perf_counter()
+    combined = Assembler().assemble(whole)
+    whole_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    objects = [Assembler().assemble(section).htme_records for section in sections]
+    separate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Assembler().assemble(sections[count // 2])
+    one_seconds = time.perf_counter() - start
+
+    machine = PredecodingMachine()
+    start = time.perf_counter()
+    entry, estab = link(parse_programs(record for records in objects for record in records), machine.memory)
+    link_seconds = time.perf_counter() - start
+
+    machine.pc = entry
+    machine.run(10_000_000)
+    status = "ok" if machine.halted and combined.htme_records == [r for o in objects for r in o] else "MISMATCH"
+
+    print(f"{count} sections, {len(whole)} source lines, {len(estab)} ESTAB entries")
+    print(f"assemble whole source:   {whole_seconds:.3f}s")
+    print(f"assemble every section:  {separate_seconds:.3f}s")
+    print(f"re-assemble one section: {one_seconds * 1000:.2f} ms")
+    print(f"link all sections:       {link_seconds * 1000:.2f} ms ({status}, A={machine.regs[0]:06X})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Load generator for the assembler server (python -m sicxe serve).
+
+Opens several concurrent connections, sends assemble requests as fast as
+the server answers them and reports p50/p99 latency and requests/sec.
+
+    python -m benchmarks.loadgen [--port 8765 | --socket PATH] [-c 16] [-n 2000] [source]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def client(args, payload, counter, latencies, errors):
+    if args.socket:
+        reader, writer = await asyncio.open_unix_connection(args.socket, limit=64 * 1024 * 1024)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port, limit=64 * 1024 * 1024)
+    try:
+        while counter[0] < args.requests:
+            counter[0] += 1
+            start = time.perf_counter()
+            writer.write(payload)
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if 'error' in response:
+                errors.append(response['error'])
+    finally:
+        writer.close()
+
+
+async def run(args):
+    with open(args.source, 'r', encoding='utf-8') as f:
+        source = f.read()
+    payload = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'assemble',
+                          'params': {'source': source}}).encode('utf-8') + b'\n'
+
+    counter = [0]
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args, payload, counter, latencies, errors)
+                           for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{len(latencies)} requests over {args.concurrency} connections in {elapsed:.2f}s "
+          f"({len(errors)} errors)")
+    print(f"Throughput: {len(latencies) / elapsed:.0f} requests/sec")
+    print(f"Latency: p50 {percentile(latencies, 0.50) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms, "
+          f"max {latencies[-1] * 1000 if latencies else 0:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the SIC/XE assembler server.")
+    parser.add_argument('source', nargs='?', default='data/in.txt')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="connect to a Unix socket instead of TCP")
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark one-pass load-and-go assembly against the two-pass pipelines.
+
+Builds a synthetic source with forward references to data defined after
+the code that uses it, then times the classic pass1()/pass2() round trip
+through the intermediate files, the in-memory Assembler, and the
+OnePassAssembler on its own and loading straight into machine memory.
+Checks they all produce the same HTME records. Each time is the best of
+REPEAT runs.
+
+One pass is slower than the in-memory two-pass Assembler, about 1.3x the
+time on this program: the operand analysis and fixup lists it needs for
+forward references cost more than the second scan over the in-memory
+lines that it saves. What it buys is load-and-go, not speed.
+
+    python -m benchmarks.one_pass [lines]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from src.assembler import Assembler
+from src.assembler_pass1 import pass1
+from src.assembler_pass2 import pass2
+from src.memory import MEMORY_SIZE
+from src.onepass import OnePassAssembler
+
+REPEAT = 3
+
+
+def synthetic_source(n_lines):
+    """A program whose blocks reference the next block and words declared after their code"""
+    lines = ["BENCH START 0", "FIRST LDA #0"]
+    n_blocks = max((n_lines - 3) // 10, 1)
+    for block in range(n_blocks):
+        lines += [
+            f"L{block} LDA V{block}",
+            f" ADD =X'{block:06X}'",
+            f" STA W{block}",
+            f" COMP V{block}+3",
+            f" JLT L{block}",
+            f" +JSUB L{(block + 1) % n_blocks}",
+            f" J E{block}",
+            f"V{block} WORD {block % 1000}",
+            f"W{block} RESW 1",
+            f"E{block} TIXR T",
+        ]
+        if block % 50 == 49:
+            lines.append(" LTORG")
+    lines.append(" END FIRST")
+    return lines
+
+
+def classic(source, directory):
+    """pass1() and pass2() through data/*.txt, as the original command-line flow does"""
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        os.makedirs('data', exist_ok=True)
+        with open('data/in.txt', 'w') as f:
+            f.write('\n'.join(source) + '\n')
+        pass1('data/in.txt')
+        pass2('data/intermediate.txt', 'data/out_pass1.txt', 'data/symbTable.txt')
+        with open('data/HTME.txt') as f:
+            return f.read().splitlines()
+    finally:
+        os.chdir(cwd)
+
+
+def timed(func, *args):
+    """func(*args) and its best time in seconds over REPEAT runs"""
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    n_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    source = synthetic_source(n_lines)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        classic_records, classic_seconds = timed(classic, source, tmp)
+    two_pass, two_pass_seconds = timed(Assembler().assemble, source)
+    one_pass_assembler = OnePassAssembler()
+    one_pass, one_pass_seconds = timed(one_pass_assembler.assemble, source)
+    loaded, loaded_seconds = timed(OnePassAssembler(memory=bytearray(MEMORY_SIZE)).assemble, source)
+
+    same = classic_records == two_pass.htme_records == one_pass.htme_records == loaded.htme_records
+    print(f"{len(source)} lines, {one_pass_assembler.patched} statements patched through fixup lists")
+    print(f"two passes through intermediate files: {classic_seconds:.3f}s")
+    print(f"two passes in memory:                  {two_pass_seconds:.3f}s")
+    print(f"one pass:                              {one_pass_seconds:.3f}s")
+    print(f"one pass, loaded into memory:          {loaded_seconds:.3f}s")
+    ratio = one_pass_seconds / two_pass_seconds
+    print(f"one pass is {'slower' if ratio > 1 else 'faster'} than two passes in memory: {ratio:.2f}x the time")
+    print("HTME records match" if same else "HTME RECORDS DIFFER")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Microbenchmark for per-line instruction dispatch and encoding.
+
+Times the pass 1 lookups (validity, size, format), generate_object_code
+(mnemonic string in, object code out) and encode_line (pre-parsed
+SourceLine in) over a mix of format 1/2/3/4 instructions and directives,
+and prints the cost per line.
+
+    python -m benchmarks.opcode_dispatch [repeat] [-o FILE] [--baseline FILE] [--threshold 0.10]
+
+-o saves the results as JSON. --baseline compares them with a file saved
+earlier and exits with status 1 when a measure is slower by more than
+the threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from src.assembler import Assembler
+from src.assembler_pass1 import is_valid_instruction, get_size, get_format
+from src.assembler_pass2 import encode_line, generate_object_code
+
+SOURCE = """\
+BENCH START 1000
+FIRST STL RETADR
+ CLEAR X
+ LDA #3
+ +LDB #LENGTH
+ BASE LENGTH
+ LITAD A,=X'05'
+ +JSUB FIRST
+ LDA @BUFFER
+ LDX LENGTH,X
+ COMP ZERO
+ TIXR X
+ ADDR A,S
+ TIO
+ HIO
+OUTPUT BYTE X'05'
+RETADR RESW 1
+LENGTH WORD 3
+ZERO WORD 0
+BUFFER RESB 16
+ END FIRST
+"""
+
+
+def time_per_line(func, items, repeat):
+    """Return the best seconds-per-item over several runs of func over items"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items)
+
+
+def measure(repeat):
+    """(lines timed, nanoseconds per line of each measure), best of repeat runs"""
+    context = Assembler()
+    lines = context.pass1(SOURCE.splitlines())
+    symbol_table = context.symbol_table
+    lines = lines * 2000
+    base_address = symbol_table['LENGTH']
+
+    lookups = time_per_line(
+        lambda line: (is_valid_instruction(line.mnemonic), get_size(line.mnemonic, line.operand),
+                      get_format(line.mnemonic)),
+        lines, repeat)
+    by_name = time_per_line(
+        lambda line: generate_object_code(line.mnemonic, line.operand, symbol_table, line.address, base_address),
+        lines, repeat)
+    by_record = time_per_line(
+        lambda line: encode_line(line, symbol_table, base_address),
+        lines, repeat)
+
+    return len(lines), {'pass 1 lookups': lookups * 1e9, 'generate_object_code': by_name * 1e9,
+                        'encode_line': by_record * 1e9}
+
+
+def compare(baseline, results, threshold):
+    """Print each measure against the baseline; return the number slower by more than threshold"""
+    regressions = 0
+    for name, after in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        ratio = after / before
+        regressed = ratio > 1 + threshold
+        status = "REGRESSION" if regressed else "faster" if ratio < 1 - threshold else "ok"
+        print(f"{name + ':':<22}{before:8.0f} ns {after:8.0f} ns {ratio:7.2f}x  {status}")
+        regressions += regressed
+    print(f"{regressions} regressions beyond {threshold:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.opcode_dispatch',
+                                     description="Time instruction dispatch and encoding per line.")
+    parser.add_argument('repeat', nargs='?', type=int, default=5, help="keep the best of this many runs")
+    parser.add_argument('-o', '--output', help="save the results as JSON")
+    parser.add_argument('--baseline', help="results saved earlier with -o to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative slowdown that counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    n_lines, results = measure(args.repeat)
+    print(f"{n_lines} lines, best of {args.repeat}")
+    for name, ns in results.items():
+        print(f"{name + ':':<22}{ns:8.0f} ns/line")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'repeat': args.repeat, 'ns_per_line': results},
+                      f, indent=2)
+            f.write("\n")
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline['ns_per_line'], results, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
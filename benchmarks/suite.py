@@ -0,0 +1,208 @@
+"""
+Scaling benchmark: pass 1, pass 2 and HTME generation on synthetic programs
+from a thousand to ten million lines, with results kept as JSON.
+
+Each scale runs in a fresh worker process, so its peak RSS is its own. The
+program comes from benchmarks.generator with a fixed seed and mix. Pass 1,
+pass 2 (encoding) and generate_htme_records are timed separately, section
+by section as Assembler does it, and then Assembler.assemble is timed end to
+end. Every time is the best of --repeat runs, and of as many more as fit in
+MIN_SECONDS, so the small scales are not lost in timer noise. The garbage
+collector is off while timing, as in timeit.
+
+    python -m benchmarks.suite run [--scales 1k,10k,100k,1M] [-o results.json] [--repeat 3]
+                                   [--seed 0] [--mix format3=50,...] [--forward 0.5]
+    python -m benchmarks.suite compare BASELINE RESULTS [--threshold 0.10]
+
+compare lists each phase at each scale the two files share and exits with
+status 1 when one is slower than the baseline by more than the threshold,
+or its peak RSS grew by more than that.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.generator import DEFAULT_FORWARD, generate, parse_mix
+from src.assembler import ASSEMBLER_VERSION, Assembler, split_sections
+from src.assembler_pass2 import encode_program, generate_htme_records
+from src.profiling import peak_rss
+
+DEFAULT_SCALES = '1k,10k,100k,1M'
+MIN_SECONDS = 1.0  # small programs repeat until each measurement has run this long
+PHASES = ('pass1', 'pass2', 'htme', 'end_to_end')
+SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+
+def parse_scale(text):
+    """Line count from '5000', '10k' or '1M'"""
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def time_phases(lines):
+    """Seconds of pass 1, pass 2 and HTME generation over the sections of lines"""
+    seconds = dict.fromkeys(PHASES[:3], 0.0)
+    statements = 0
+    for first_line, section in split_sections(lines):
+        context = Assembler()
+        start = time.perf_counter()
+        parsed = context.pass1(section, first_line)
+        seconds['pass1'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        object_codes, _ = encode_program(parsed, context)
+        seconds['pass2'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        generate_htme_records(parsed, object_codes, context.report, context.symbol_table)
+        seconds['htme'] += time.perf_counter() - start
+        statements += len(parsed)
+    return seconds, statements
+
+
+def run_scale(n_lines, seed, mix, forward, repeat):
+    """Benchmark one program size; runs in a worker process of its own"""
+    start = time.perf_counter()
+    lines = list(generate(n_lines, seed, mix, forward))
+    generate_seconds = time.perf_counter() - start
+    gc.collect()
+    gc.disable()  # as timeit does: a collection landing in one run and not the next is noise
+
+    best = dict.fromkeys(PHASES, float('inf'))
+    runs = 0
+    start = time.perf_counter()
+    while runs < repeat or time.perf_counter() - start < MIN_SECONDS:
+        seconds, statements = time_phases(lines)
+        for phase, value in seconds.items():
+            best[phase] = min(best[phase], value)
+        runs += 1
+    rss_phases = peak_rss()
+
+    runs = 0
+    first = time.perf_counter()
+    while runs < repeat or time.perf_counter() - first < MIN_SECONDS:
+        start = time.perf_counter()
+        result = Assembler().assemble(lines)
+        best['end_to_end'] = min(best['end_to_end'], time.perf_counter() - start)
+        diagnostics = len(result.diagnostics)
+        del result
+        runs += 1
+
+    return {
+        'lines': len(lines),
+        'statements': statements,
+        'sections': len(split_sections(lines)),
+        'diagnostics': diagnostics,
+        'generate_seconds': generate_seconds,
+        'phases': {phase: {'seconds': seconds, 'lines_per_sec': len(lines) / seconds if seconds else 0.0}
+                   for phase, seconds in best.items()},
+        'peak_rss': {'phases': rss_phases, 'end_to_end': peak_rss()},
+    }
+
+
+def run_main(argv):
+    parser = argparse.ArgumentParser(prog='benchmarks.suite run',
+                                     description="Time the assembler on synthetic programs of several sizes.")
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help=f"comma-separated line counts, e.g. 1k,10M (default: {DEFAULT_SCALES})")
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--repeat', type=int, default=3, help="keep the best of this many runs (default: 3)")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--mix', default='', help="statement weights, e.g. format3=50,literal=10")
+    parser.add_argument('--forward', type=float, default=DEFAULT_FORWARD)
+    args = parser.parse_args(argv)
+    try:
+        scales = [parse_scale(text) for text in args.scales.split(',')]
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = []
+    for n_lines in scales:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            scale = pool.submit(run_scale, n_lines, args.seed, mix, args.forward, args.repeat).result()
+        results.append(scale)
+        phases = scale['phases']
+        print(f"{scale['lines']:>10} lines: " + ', '.join(
+            f"{phase} {phases[phase]['seconds']:.3f}s ({phases[phase]['lines_per_sec']:,.0f}/s)" for phase in PHASES)
+            + f", peak RSS {scale['peak_rss']['end_to_end'] / (1024 * 1024):.0f} MB"
+            + (f", {scale['diagnostics']} DIAGNOSTICS" if scale['diagnostics'] else ''))
+
+    data = {
+        'assembler_version': ASSEMBLER_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed, 'mix': mix, 'forward': args.forward, 'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    print(f"Results written to {args.output}")
+    return 0
+
+
+def compare(baseline, current, threshold):
+    """Yield (lines, measure, old, new, ratio, regressed) for everything both result files have"""
+    old_scales = {scale['lines']: scale for scale in baseline['results']}
+    for scale in current['results']:
+        old = old_scales.get(scale['lines'])
+        if old is None:
+            continue
+        for phase in PHASES:
+            if phase in old['phases'] and phase in scale['phases']:
+                before, after = old['phases'][phase]['seconds'], scale['phases'][phase]['seconds']
+                ratio = after / before if before else 1.0
+                yield scale['lines'], phase, before, after, ratio, ratio > 1 + threshold
+        before, after = old['peak_rss']['end_to_end'], scale['peak_rss']['end_to_end']
+        if before and after:
+            ratio = after / before
+            yield scale['lines'], 'peak_rss', before, after, ratio, ratio > 1 + threshold
+
+
+def compare_main(argv):
+    parser = argparse.ArgumentParser(prog='benchmarks.suite compare',
+                                     description="Flag regressions of a results file against a baseline.")
+    parser.add_argument('baseline')
+    parser.add_argument('results')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative slowdown or memory growth that counts as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        current = json.load(f)
+
+    for key in ('seed', 'mix', 'forward'):
+        if baseline.get(key) != current.get(key):
+            print(f"Warning: {key} differs ({baseline.get(key)} vs {current.get(key)}), "
+                  f"so the programs are not the same")
+    regressions = 0
+    for lines, measure, before, after, ratio, regressed in compare(baseline, current, args.threshold):
+        if measure == 'peak_rss':
+            values = f"{before / (1024 * 1024):10.1f} MB {after / (1024 * 1024):10.1f} MB"
+        else:
+            values = f"{before:12.3f}s {after:12.3f}s"
+        status = "REGRESSION" if regressed else "faster" if ratio < 1 - args.threshold else "ok"
+        print(f"{lines:>10} {measure:<11} {values} {ratio:7.2f}x  {status}")
+        regressions += regressed
+    print(f"{regressions} regressions beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    commands = {'run': run_main, 'compare': compare_main}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        return 2
+    return commands[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
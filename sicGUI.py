@@ -1,12 +1,19 @@
+import io
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, messagebox
 
 # Import our assembler modules
 # Assuming the modules are in the src directory and can be imported directly
-from src.instructions import instruction_size
-from src.assembler_pass1 import pass1, symbol_table
-from src.assembler_pass2 import pass2
+from src.assembler import section_tables, write_outputs
+from src.assembler_pass1 import write_symbols
+from src.assembler_pass2 import LISTING_HEADER
+from src.incremental import IncrementalAssembler
+from src.profiling import Cancelled
+
+POLL_MS = 50  # how often the window checks the worker's message queue
 
 class SICXEAssemblerGUI:
     def __init__(self, root):
@@ -15,6 +22,14 @@ class SICXEAssemblerGUI:
         self.root.geometry("900x600")
         self.root.configure(bg="#f0f0f0")
         
+        # Keeps the previous assembly so re-assembling after an edit only redoes what changed
+        self.engine = IncrementalAssembler()
+        
+        # Assembly runs on a worker thread that reports back through this queue
+        self.messages = queue.Queue()
+        self.worker = None
+        self.cancel_event = threading.Event()
+        
         # Create a data directory if it doesn't exist
         if not os.path.exists('data'):
             os.makedirs('data')
@@ -130,6 +145,10 @@ class SICXEAssemblerGUI:
         self.assemble_btn = ttk.Button(self.button_frame, text="Assemble", command=self.assemble)
         self.assemble_btn.pack(side=tk.LEFT, padx=5)
         
+        # Cancel button, enabled while an assembly is running
+        self.cancel_btn = ttk.Button(self.button_frame, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
         # Clear button
         self.clear_btn = ttk.Button(self.button_frame, text="Clear All", command=self.clear_all)
         self.clear_btn.pack(side=tk.LEFT, padx=5)
@@ -137,6 +156,12 @@ class SICXEAssemblerGUI:
         # Exit button
         self.exit_btn = ttk.Button(self.button_frame, text="Exit", command=self.root.quit)
         self.exit_btn.pack(side=tk.RIGHT, padx=5)
+        
+        # Progress of the running assembly
+        self.progress_bar = ttk.Progressbar(self.button_frame, length=200, mode='determinate')
+        self.progress_bar.pack(side=tk.RIGHT, padx=5)
+        self.status_label = ttk.Label(self.button_frame, text="")
+        self.status_label.pack(side=tk.RIGHT, padx=5)
     
     def load_file(self):
         # Open file dialog
@@ -173,96 +198,133 @@ class SICXEAssemblerGUI:
                 messagebox.showerror("Error", f"Failed to save file: {str(e)}")
     
     def assemble(self):
-    # Get the current assembly code from the input text widget
+        # Only one assembly at a time; the engine belongs to the worker while it runs
+        if self.worker is not None:
+            return
+        
+        # Get the current assembly code from the input text widget
         assembly_code = self.input_text.get(1.0, tk.END)
-
+        
+        self.cancel_event.clear()
+        self.assemble_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.status_label.config(text="Assembling...")
+        self.progress_bar.config(value=0)
+        
+        self.worker = threading.Thread(target=self.assemble_job, args=(assembly_code,), daemon=True)
+        self.worker.start()
+        self.root.after(POLL_MS, self.poll_worker)
+    
+    def assemble_job(self, assembly_code):
+        """Runs on the worker thread: assemble, write the output files and post the tab contents"""
+        def progress(phase, done, total):
+            if self.cancel_event.is_set():
+                raise Cancelled()
+            self.messages.put(('progress', phase, done, total))
+        
         try:
-            # Save the current input to data/in.txt temporarily for the assembler to use
+            # Save the current input to data/in.txt so it is reloaded next time
             with open('data/in.txt', 'w') as f:
                 f.write(assembly_code)
-
-            # Run pass 1 of the assembler
-            pass1('data/in.txt')
-
-            # Run pass 2 of the assembler
-            pass2('data/intermediate.txt', 'data/out_pass1.txt', 'data/symbTable.txt')
-
+            
+            # Re-assemble incrementally and write the output files to data/
+            self.engine.progress = progress
+            result = self.engine.update(assembly_code)
+            write_outputs(result, 'data')
+            
+            # Build the tab contents here, so the window only has to insert them
+            symbols = io.StringIO()
+            for name, table in section_tables(result) or [(None, result.symbol_table)]:
+                if name is not None:
+                    symbols.write(f"{name}\n")
+                write_symbols(symbols, table)
+            listing = LISTING_HEADER + ''.join(f"{line}\n" for line in result.listing_lines)
+            htme = ''.join(f"{record}\n" for record in result.htme_records)
+            self.messages.put(('done', symbols.getvalue(), listing, htme, list(result.diagnostics)))
+        except Cancelled:
+            # The engine stopped part way through an update; the next one starts from scratch
+            self.engine = IncrementalAssembler()
+            self.messages.put(('cancelled',))
+        except Exception as e:
+            self.engine = IncrementalAssembler()
+            self.messages.put(('error', str(e)))
+    
+    def cancel(self):
+        if self.worker is not None:
+            self.cancel_event.set()
+            self.status_label.config(text="Cancelling...")
+    
+    def poll_worker(self):
+        # Handle everything the worker posted since the last poll
+        finished = None
+        progress = None
+        try:
+            while True:
+                message = self.messages.get_nowait()
+                if message[0] == 'progress':
+                    progress = message
+                else:
+                    finished = message
+        except queue.Empty:
+            pass
+        
+        if progress is not None and finished is None:
+            _, phase, done, total = progress
+            if total:
+                self.progress_bar.config(value=100 * done / total)
+                self.status_label.config(text=f"{phase.capitalize()}: {done}/{total} lines")
+            else:
+                self.status_label.config(text=f"{phase.capitalize()}: {done} lines")
+        
+        if finished is None:
+            self.root.after(POLL_MS, self.poll_worker)
+            return
+        
+        self.worker = None
+        self.assemble_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.progress_bar.config(value=0)
+        if finished[0] == 'cancelled':
+            self.status_label.config(text="Assembly cancelled")
+        elif finished[0] == 'error':
+            self.status_label.config(text="")
+            messagebox.showerror("Error", f"Assembly failed: {finished[1]}")
+        else:
+            _, symbols, listing, htme, diagnostics = finished
+            for message in diagnostics:
+                print(message)
+            self.status_label.config(text="")
+            
             # Show success message
             messagebox.showinfo("Success", "Assembly completed successfully!")
-
+            
             # Update the tabs with the results
-            self.update_symbol_table()
-            self.update_listing()
-            self.update_htme_records()
-
+            self.update_symbol_table(symbols)
+            self.update_listing(listing)
+            self.update_htme_records(htme)
+            
             # Switch to the listing tab
             self.notebook.select(2)  # Index 2 is the listing tab
-
-        except Exception as e:
-            messagebox.showerror("Error", f"Assembly failed: {str(e)}")
-
     
-    def update_symbol_table(self):
-        # Read the symbol table file and update the symbol table tab
-        try:
-            with open('data/symbTable.txt', 'r') as f:
-                content = f.read()
-                
-                # Enable text widget for editing
-                self.symbol_text.config(state=tk.NORMAL)
-                
-                # Clear previous content
-                self.symbol_text.delete(1.0, tk.END)
-                
-                # Insert new content
-                self.symbol_text.insert(tk.END, "Symbol\tAddress\n")
-                self.symbol_text.insert(tk.END, "-" * 20 + "\n")
-                self.symbol_text.insert(tk.END, content)
-                
-                # Disable text widget for editing
-                self.symbol_text.config(state=tk.DISABLED)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load symbol table: {str(e)}")
+    def show_text(self, widget, content):
+        # Enable text widget for editing
+        widget.config(state=tk.NORMAL)
+        
+        # Replace previous content
+        widget.delete(1.0, tk.END)
+        widget.insert(tk.END, content)
+        
+        # Disable text widget for editing
+        widget.config(state=tk.DISABLED)
     
-    def update_listing(self):
-        # Read the listing file and update the listing tab
-        try:
-            with open('data/listing.txt', 'r') as f:
-                content = f.read()
-                
-                # Enable text widget for editing
-                self.listing_text.config(state=tk.NORMAL)
-                
-                # Clear previous content
-                self.listing_text.delete(1.0, tk.END)
-                
-                # Insert new content
-                self.listing_text.insert(tk.END, content)
-                
-                # Disable text widget for editing
-                self.listing_text.config(state=tk.DISABLED)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load listing: {str(e)}")
+    def update_symbol_table(self, content):
+        self.show_text(self.symbol_text, "Symbol\tAddress\n" + "-" * 20 + "\n" + content)
     
-    def update_htme_records(self):
-        # Read the HTME file and update the HTME tab
-        try:
-            with open('data/HTME.txt', 'r') as f:
-                content = f.read()
-                
-                # Enable text widget for editing
-                self.htme_text.config(state=tk.NORMAL)
-                
-                # Clear previous content
-                self.htme_text.delete(1.0, tk.END)
-                
-                # Insert new content
-                self.htme_text.insert(tk.END, content)
-                
-                # Disable text widget for editing
-                self.htme_text.config(state=tk.DISABLED)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load HTME records: {str(e)}")
+    def update_listing(self, content):
+        self.show_text(self.listing_text, content)
+    
+    def update_htme_records(self, content):
+        self.show_text(self.htme_text, content)
     
     def clear_all(self):
         # Clear all text widgets
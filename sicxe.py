@@ -1,20 +1,269 @@
-
 """
 SIC/XE Assembler Runner
+
+    python sicxe.py [source] [-o DIR] [--stream | --one-pass] [--cache DIR] [--binary] [--relax]
+                    [--profile FILE [--profile-format json|folded] [--profile-memory]]
+    python -m sicxe batch SOURCES... [-j N] [-o DIR] [--stream] [--cache DIR]
+    python -m sicxe serve [--host H] [--port P | --socket PATH] [-j N] [--cache DIR]
+    python -m sicxe run [HTME files... | --go SOURCE] [--load ADDR] [--max-steps N] [--no-predecode | --translate]
+                        [--memory FILE] [--dump FILE] [--restore FILE] [--snapshot FILE]
+                        [--checkpoint-every N [--checkpoint-dir DIR] [--keep-checkpoints K]]
+                        [--device NN=SPEC ...]
+    python -m sicxe test MANIFEST [-j N] [--max-steps N] [--timeout S] [--translate]
+                         [--junit FILE] [--json FILE] [-v]
 """
-from src.assembler_pass1 import pass1
-from src.assembler_pass2 import pass2
+import argparse
+import asyncio
+import sys
+import time
 
-def main():
+from src.assembler import Assembler
+from src.batch import run_batch, print_report
+from src.cache import AssemblyCache
+from src.devices import parse_device_arguments, close_devices, print_device_report
+from src.emulator import Machine, PredecodingMachine, MachineError
+from src.loader import read_programs
+from src.memory import map_memory, dump_memory
+from src.onepass import OnePassAssembler, load_and_go
+from src.profiling import Profiler, print_profile
+from src.regression import (load_manifest, run_suite, print_suite_report, write_junit_report,
+                            write_json_report, PASSED)
+from src.server import serve
+from src.snapshot import load_snapshot, save_snapshot, run_with_checkpoints
+from src.streaming import assemble_streaming
+from src.translator import TranslatingMachine, TRANSLATE_THRESHOLD
 
-    input_file = 'data/in.txt'
-    print(f"Running Pass 1 on {input_file}...")
-    pass1(input_file)
-    
-    print("Running Pass 2...")
-    pass2('data/intermediate.txt', 'data/out_pass1.txt', 'data/symbTable.txt')
+def add_cache_arguments(parser):
+    parser.add_argument('--cache', metavar='DIR', help="reuse results from an on-disk assembly cache")
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                        help="evict least recently used cache entries above this size (default: 256)")
+
+def open_cache(args):
+    if not args.cache:
+        return None
+    return AssemblyCache(args.cache, args.cache_size * 1024 * 1024)
+
+def assemble_main(argv):
+    parser = argparse.ArgumentParser(description="Assemble a SIC/XE source file.")
+    parser.add_argument('input_file', nargs='?', default='data/in.txt')
+    parser.add_argument('-o', '--output-dir', default='data', help="directory for the output files")
+    parser.add_argument('--stream', action='store_true',
+                        help="assemble in constant memory through a binary intermediate file")
+    parser.add_argument('--binary', action='store_true',
+                        help="also write the raw program bytes to image.bin (not with --stream)")
+    parser.add_argument('--one-pass', action='store_true',
+                        help="encode each statement as it is read, patching forward references")
+    parser.add_argument('--relax', action='store_true',
+                        help="use format 4 only where format 3 can't reach the operand (not with --stream)")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="time each assembler phase and write the profile to FILE")
+    parser.add_argument('--profile-format', choices=('json', 'folded'), default='json',
+                        help="json, or folded stacks for flame graph tools (default: json)")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="also trace the peak of Python allocations (slower)")
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.stream and args.relax:
+        parser.error("--relax needs the whole program in memory and can't be used with --stream")
+    if args.one_pass and (args.stream or args.relax):
+        parser.error("--one-pass can't be used with --stream or --relax")
+
+    profiler = Profiler(args.profile_memory) if args.profile else None
+    print(f"Assembling {args.input_file}...")
+    if args.stream:
+        assemble_streaming(args.input_file, args.output_dir, Assembler(echo=True, profiler=profiler))
+    else:
+        if args.one_pass:
+            assembler = OnePassAssembler(echo=True, profiler=profiler)
+        else:
+            assembler = Assembler(echo=True, relax=args.relax, profiler=profiler)
+        with open(args.input_file, 'r', encoding='utf-8') as f, assembler.phase('read source'):
+            source = f.read()
+        cache = open_cache(args)
+        result = assembler.assemble(source, args.output_dir, cache, args.binary)
+        if result.relaxation is not None:
+            stats = result.relaxation
+            print(f"Relaxation: {stats['references']} references, {stats['widened']} widened to format 4, "
+                  f"{stats['bytes_saved']} bytes saved against all format 4 ({stats['passes']} passes, "
+                  f"{stats['rounds']} rounds)")
+        if cache is not None:
+            print("Cache hit." if cache.hits else "Cache miss.")
     
-    print("Assembly complete. Output files written to data directory.")
+    print(f"Assembly complete. Output files written to {args.output_dir} directory.")
+    if profiler is not None:
+        profiler.stop()
+        print_profile(profiler)
+        profiler.write(args.profile, args.profile_format)
+        print(f"Profile written to {args.profile}")
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog='sicxe batch',
+                                     description="Assemble many SIC/XE source files in parallel.")
+    parser.add_argument('sources', nargs='+', help="source files to assemble")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('-o', '--output-dir', default='out',
+                        help="root directory; each source gets its own subdirectory")
+    parser.add_argument('--stream', action='store_true', help="use the streaming assembler for each file")
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results, wall_time = run_batch(args.sources, args.output_dir, args.jobs, args.stream,
+                                   args.cache, args.cache_size * 1024 * 1024)
+    print_report(results, wall_time)
+    return 1 if any(r.error for r in results) else 0
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog='sicxe serve',
+                                     description="Run a persistent JSON-RPC assembler server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="listen on this Unix socket path instead of TCP")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="assembler worker threads (default: Python's thread pool default)")
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket, args.workers, open_cache(args)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_main(argv):
+    parser = argparse.ArgumentParser(prog='sicxe run', description="Run an HTME object program.")
+    parser.add_argument('htme_files', nargs='*', default=['data/HTME.txt'], metavar='htme_file',
+                        help="object files; several, or several control sections, are linked in order")
+    parser.add_argument('--go', metavar='SOURCE',
+                        help="assemble SOURCE in one pass straight into memory and run it (load-and-go)")
+    parser.add_argument('--load', type=lambda text: int(text, 16), default=None, metavar='ADDR',
+                        help="hex load address (default: the assembled start address)")
+    parser.add_argument('--max-steps', type=int, default=1_000_000,
+                        help="stop after this many instructions (default: 1000000)")
+    parser.add_argument('--no-predecode', action='store_true',
+                        help="decode every instruction as it runs instead of caching decoded instructions")
+    parser.add_argument('--translate', action='store_true',
+                        help="compile hot basic blocks into Python functions")
+    parser.add_argument('--threshold', type=int, default=TRANSLATE_THRESHOLD,
+                        help=f"block entries before a block is compiled (default: {TRANSLATE_THRESHOLD})")
+    parser.add_argument('--memory', metavar='FILE',
+                        help="back memory with an mmap of FILE, which holds the final memory afterwards")
+    parser.add_argument('--dump', metavar='FILE', help="write the final 1 MiB memory image to FILE")
+    parser.add_argument('--restore', metavar='FILE', help="resume from a machine snapshot instead of loading HTME")
+    parser.add_argument('--snapshot', metavar='FILE', help="save a machine snapshot to FILE when the run stops")
+    parser.add_argument('--checkpoint-every', type=int, metavar='N',
+                        help="save a snapshot every N instructions")
+    parser.add_argument('--checkpoint-dir', default='checkpoints', metavar='DIR')
+    parser.add_argument('--keep-checkpoints', type=int, default=None, metavar='K',
+                        help="keep only the K most recent checkpoints")
+    parser.add_argument('--device', action='append', default=[], metavar='NN=SPEC',
+                        help="attach device NN (hex): '<FILE' reads FILE, '>FILE' or FILE writes it, "
+                             "'-' is stdin/stdout, 'mem' is an in-memory buffer")
+    args = parser.parse_args(argv)
+    if args.go and (args.load is not None or args.restore):
+        parser.error("--go runs the program where it is assembled; --load and --restore don't apply")
+
+    try:
+        devices = parse_device_arguments(args.device)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    memory = map_memory(args.memory) if args.memory else None
+    if args.translate:
+        machine = TranslatingMachine(memory, devices, threshold=args.threshold)
+    elif args.no_predecode:
+        machine = Machine(memory, devices)
+    else:
+        machine = PredecodingMachine(memory, devices)
+
+    try:
+        if args.restore:
+            load_snapshot(args.restore, machine)
+        elif args.go:
+            with open(args.go, 'r', encoding='utf-8') as f:
+                result = load_and_go(f.read(), machine, echo=True)
+            if result.invalid_instructions:
+                return 1
+        else:
+            programs = machine.load(read_programs(args.htme_files), args.load)
+            if len(programs) > 1:
+                print(f"Linked {len(programs)} control sections")
+        start = time.perf_counter()
+        if args.checkpoint_every:
+            first = machine.steps
+            run_with_checkpoints(machine, args.checkpoint_every, args.checkpoint_dir, args.max_steps,
+                                 args.keep_checkpoints)
+            steps = machine.steps - first
+        else:
+            steps = machine.run(args.max_steps)
+        seconds = time.perf_counter() - start
+    except (OSError, ValueError, MachineError) as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        dump_memory(machine.memory, args.dump)
+        if args.snapshot:
+            save_snapshot(machine, args.snapshot)
+        close_devices(devices)
+
+    status = "halted" if machine.halted else "stopped at the step limit"
+    print(f"Program {status} at PC={machine.pc:06X}")
+    print(' '.join(f"{name}={value:06X}" if isinstance(value, int) else f"{name}={value}"
+                   for name, value in machine.state().items()))
+    ips = steps / seconds if seconds else 0.0
+    print(f"{steps} instructions in {seconds:.3f}s ({ips:,.0f} instructions/sec)")
+    print_device_report(devices)
+    return 0
+
+def test_main(argv):
+    parser = argparse.ArgumentParser(prog='sicxe test',
+                                     description="Assemble, run and check the programs in a regression manifest.")
+    parser.add_argument('manifest', help="JSON manifest of cases")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--max-steps', type=int, default=None,
+                        help="instruction budget for cases that don't set their own")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="seconds per case for cases that don't set their own")
+    parser.add_argument('--translate', action='store_true', help="run every case on the translating machine")
+    parser.add_argument('--junit', metavar='FILE', help="write a JUnit XML report to FILE")
+    parser.add_argument('--json', metavar='FILE', help="write a JSON report to FILE")
+    parser.add_argument('-v', '--verbose', action='store_true', help="list passing cases too")
+    args = parser.parse_args(argv)
+
+    try:
+        cases = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    for case in cases:
+        if args.max_steps is not None:
+            case.setdefault('max_steps', args.max_steps)
+        if args.timeout is not None:
+            case.setdefault('timeout', args.timeout)
+        if args.translate:
+            case['translate'] = True
+
+    results, wall_time = run_suite(cases, args.jobs)
+    print_suite_report(results, wall_time, args.verbose)
+    if args.junit:
+        write_junit_report(results, wall_time, args.junit)
+    if args.json:
+        write_json_report(results, wall_time, args.json)
+    return 0 if all(r.status == PASSED for r in results) else 1
+
+commands = {
+    'batch': batch_main,
+    'serve': serve_main,
+    'run': run_main,
+    'test': test_main,
+}
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
+    return assemble_main(argv)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""
+In-memory SIC/XE assembly pipeline.
+
+Pass 1 hands its SourceLine records (with integer addresses) and symbol table
+straight to pass 2, so nothing is written to or re-read from disk unless an
+output directory is given.
+
+All state for one assembly lives on an Assembler instance, so independent
+instances can run at the same time, e.g. on a thread pool in a long-lived
+service process.
+
+A source split into control sections by CSECT is assembled one section at a
+time, each with its own symbol and literal tables and its own H to E
+records, exactly as if the sections were separate programs; the linking
+loader in src/loader.py joins them up.
+"""
+import os
+from contextlib import nullcontext
+
+from src.assembler_pass1 import parse_lines, report_invalid_instructions, write_pass1_files
+from src.assembler_pass2 import (ObjectImage, encode_program, generate_htme_records, image_from_records,
+                                 write_pass2_files)
+from src.expressions import SymbolTable
+from src.instructions import mnemonic_table
+from src.relaxation import choose_formats
+from src.source_line import SourceLine
+
+# Bump whenever a change alters assembler output, so cached results are not reused
+ASSEMBLER_VERSION = '1.6'
+
+
+class AssemblyResult:
+    """Everything produced by assembling one program"""
+
+    def __init__(self, lines, symbol_table, object_codes, listing_lines, htme_records,
+                 invalid_instructions, diagnostics, image=None, relaxation=None):
+        self.lines = lines  # SourceLine records from pass 1
+        self.symbol_table = symbol_table
+        self.object_codes = object_codes
+        self.listing_lines = listing_lines
+        self.htme_records = htme_records or []
+        self.invalid_instructions = invalid_instructions
+        self.diagnostics = diagnostics  # error and warning messages, in order
+        self.image = image  # ObjectImage of the program bytes that the T records were cut from
+        self.relaxation = relaxation  # format 3/4 selection statistics in relax mode
+        self.sections = None  # AssemblyResult per control section, when there are several
+
+    def object_image(self):
+        """The program bytes as an ObjectImage (None for control sections).
+
+        A result read back from the cache has no image until this builds one from its HTME records.
+        """
+        if self.image is None and self.sections is None:
+            self.image = image_from_records(self.htme_records)
+        return self.image
+
+    def to_dict(self, include_lines=True):
+        """Return a JSON-serialisable dict of the result"""
+        data = {
+            'symbol_table': self.symbol_table,
+            'object_codes': self.object_codes,
+            'listing': self.listing_lines,
+            'htme': self.htme_records,
+            'invalid_instructions': [list(item) for item in self.invalid_instructions],
+            'diagnostics': self.diagnostics,
+        }
+        if self.relaxation is not None:
+            data['relaxation'] = self.relaxation
+        for kind in ('absolute', 'external'):
+            if getattr(self.symbol_table, kind, None):
+                data[kind] = sorted(getattr(self.symbol_table, kind))
+        if self.sections is not None:
+            data['sections'] = [section.to_dict(include_lines) for section in self.sections]
+        elif include_lines:
+            data['lines'] = [[line.label, line.mnemonic, line.operand, line.format, line.address,
+                              line.size, line.line_number] for line in self.lines]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a result from to_dict() output"""
+        if 'sections' in data:
+            return combine_sections([cls.from_dict(section) for section in data['sections']])
+        lines = [SourceLine(*fields) for fields in data.get('lines', [])]
+        symbol_table = SymbolTable(data['symbol_table'])
+        symbol_table.absolute = set(data.get('absolute', ()))
+        symbol_table.external = set(data.get('external', ()))
+        return cls(lines, symbol_table, data['object_codes'], data['listing'], data['htme'],
+                   [tuple(item) for item in data['invalid_instructions']], data['diagnostics'],
+                   relaxation=data.get('relaxation'))
+
+
+class Assembler:
+    """Assembler context owning the symbol and literal tables, location counter, base register and diagnostics"""
+
+    def __init__(self, echo=False, relax=False, profiler=None, progress=None):
+        self.echo = echo  # also print diagnostics as they are reported
+        self.relax = relax  # choose format 3 or 4 for each instruction automatically
+        self.profiler = profiler  # src.profiling.Profiler timing each phase, or None
+        self.progress = progress  # callable(phase, lines done, total) during each pass, or None
+        self.reset()
+
+    def reset(self):
+        self.symbol_table = SymbolTable()
+        self.location_counter = 0
+        self.org_return = None  # location counter to go back to on a bare ORG
+        self.base_address = None
+        self.literal_refs = {}  # literal operand text -> literal bytes
+        self.pending_literals = {}  # literal bytes -> first operand text, for the next pool
+        self.literal_uses = []  # (line number, operand text, bytes) of literals waiting for the next pool
+        self.literal_addresses = {}  # line number -> (operand text, address of its pool's copy)
+        self.wide_lines = set()  # source line numbers pass 1 assembles as format 4 (relax mode)
+        self.image = None  # ObjectImage that pass 2 packs the object code into
+        self.relaxation = None
+        self.invalid_instructions = []
+        self.line_errors = []  # (line number, message) of expression errors found by pass 1
+        self.diagnostics = []
+
+    def report(self, message):
+        self.diagnostics.append(message)
+        if self.echo:
+            print(message)
+
+    def line_error(self, line_num, message):
+        self.line_errors.append((line_num, message))
+        self.report(f"Error at line {line_num}: {message}")
+
+    def phase(self, name):
+        """Context manager timing one phase of the run when there is a profiler"""
+        return nullcontext() if self.profiler is None else self.profiler.phase(name)
+
+    def pass1(self, lines, first_line=1):
+        """Parse source lines, define symbols and return the SourceLine records"""
+        with self.phase('pass 1'):
+            parsed = list(parse_lines(lines, self, first_line))
+        report_invalid_instructions(self.invalid_instructions, self.report)
+        return parsed
+
+    def relax_formats(self, lines, parsed, first_line=1):
+        """Re-run pass 1 with format 4 wherever format 3 can't reach, until every reference fits.
+
+        Widened lines only accumulate, so this stops after a few passes; the
+        statistics are left in self.relaxation.
+        """
+        echo = self.echo
+        wide = set()
+        passes = 1
+        rounds = 0
+        while True:
+            with self.phase('relax'):
+                widen, stats = choose_formats(parsed, self)
+            rounds += stats['rounds']
+            if not widen:
+                break
+            wide |= widen
+            self.reset()
+            self.wide_lines = wide
+            self.echo = False  # the first pass already printed the pass 1 messages
+            parsed = self.pass1(lines, first_line)
+            passes += 1
+        self.echo = echo
+        references = stats['short'] + len(wide)
+        self.relaxation = {'references': references, 'widened': len(wide), 'bytes_saved': stats['short'],
+                           'passes': passes, 'rounds': rounds}
+        return parsed
+
+    def pass2(self, parsed):
+        """Return (object_codes, listing_lines, htme_records) for parsed lines"""
+        self.base_address = None
+        self.image = ObjectImage()
+        with self.phase('pass 2'):
+            object_codes, listing_lines = encode_program(parsed, self)
+        with self.phase('htme'):
+            htme_records = generate_htme_records(parsed, object_codes, self.report, self.symbol_table,
+                                                 self.image)
+        return object_codes, listing_lines, htme_records
+
+    def assemble(self, source, output_dir=None, cache=None, binary=False):
+        """Assemble source text (or a list of lines) from a clean state.
+
+        With an AssemblyCache, a hit returns the stored result without running
+        either pass, and a miss stores the new result. In relax mode, format 3
+        instructions that can't reach their operand become format 4.
+        """
+        self.reset()
+        lines = source.splitlines() if isinstance(source, str) else list(source)
+
+        if cache is not None:
+            with self.phase('cache lookup'):
+                key = cache.key(lines, 'relax' if self.relax else '')
+                result = cache.get(lines, key)
+            if result is not None:
+                self.symbol_table = result.symbol_table
+                self.invalid_instructions = result.invalid_instructions
+                for message in result.diagnostics:
+                    self.report(message)
+                if output_dir is not None:
+                    with self.phase('write files'):
+                        write_outputs(result, output_dir, binary)
+                return result
+
+        sections = split_sections(lines)
+        if len(sections) > 1:
+            result = self.assemble_sections(sections)
+        else:
+            result = self.assemble_lines(lines)
+        if cache is not None:
+            with self.phase('cache store'):
+                cache.put(lines, result, key)
+        if output_dir is not None:
+            with self.phase('write files'):
+                write_outputs(result, output_dir, binary)
+        return result
+
+    def assemble_lines(self, lines, first_line=1):
+        """Run both passes over the lines of one program or control section"""
+        parsed = self.pass1(lines, first_line)
+        if self.profiler is not None:
+            self.profiler.count('source lines', len(lines))
+            self.profiler.count('statements', len(parsed))
+        if self.relax:
+            parsed = self.relax_formats(lines, parsed, first_line)
+        object_codes, listing_lines, htme_records = self.pass2(parsed)
+        return AssemblyResult(parsed, self.symbol_table, object_codes, listing_lines,
+                              htme_records, self.invalid_instructions, self.diagnostics, self.image,
+                              self.relaxation)
+
+    def assemble_sections(self, sections):
+        """Assemble each (first line number, lines) control section with an Assembler of its own"""
+        results = [type(self)(self.echo, self.relax, profiler=self.profiler, progress=self.progress)
+                   .assemble_lines(lines, first_line) for first_line, lines in sections]
+        result = combine_sections(results)
+        self.symbol_table = result.symbol_table
+        self.invalid_instructions = result.invalid_instructions
+        self.diagnostics = result.diagnostics
+        return result
+
+
+def statement_mnemonic(text):
+    """The upper-cased mnemonic of a source line as pass 1 would read it, or ''"""
+    tokens = text.split(';')[0].split()
+    if tokens and tokens[0].isdigit():
+        tokens = tokens[1:]
+    if not tokens:
+        return ''
+    if len(tokens) == 1 or (len(tokens) == 2 and tokens[0].upper() in mnemonic_table):
+        return tokens[0].upper()
+    return tokens[1].upper()
+
+
+def split_sections(lines):
+    """Split source lines before each CSECT; return (first line number, lines) per control section"""
+    sections = []
+    first = 0
+    for i, text in enumerate(lines):
+        if i > first and 'CSECT' in text.upper() and statement_mnemonic(text) == 'CSECT':
+            sections.append((first + 1, lines[first:i]))
+            first = i
+    sections.append((first + 1, lines[first:]))
+    return sections
+
+
+def combine_sections(results):
+    """One AssemblyResult for a program of several control sections, keeping each in result.sections.
+
+    Its symbol table is the first section's, and it has no ObjectImage since
+    the sections only get their addresses when they are linked.
+    """
+    relaxation = None
+    if results[0].relaxation is not None:
+        relaxation = {key: sum(r.relaxation[key] for r in results) for key in results[0].relaxation}
+    result = AssemblyResult([line for r in results for line in r.lines], results[0].symbol_table,
+                            [code for r in results for code in r.object_codes],
+                            [line for r in results for line in r.listing_lines],
+                            [record for r in results for record in r.htme_records],
+                            [item for r in results for item in r.invalid_instructions],
+                            [message for r in results for message in r.diagnostics], None, relaxation)
+    result.sections = results
+    return result
+
+
+def section_tables(result):
+    """(section name, symbol table) per control section of a result, or None for a single program"""
+    if result.sections is None:
+        return None
+    return [(section.lines[0].label if section.lines else '', section.symbol_table)
+            for section in result.sections]
+
+
+def write_outputs(result, directory='data', binary=False):
+    """Write the classic pass 1 / pass 2 text files for a result, and image.bin if binary"""
+    os.makedirs(directory, exist_ok=True)
+    write_pass1_files(result.lines, result.symbol_table, directory, section_tables(result))
+    write_pass2_files(result.object_codes, result.listing_lines, result.htme_records, directory,
+                      result.object_image() if binary else None)
+
+
+def assemble(source, output_dir=None, echo=True, cache=None, binary=False, relax=False, profiler=None):
+    """Assemble source text (or a list of lines) and return an AssemblyResult"""
+    return Assembler(echo, relax, profiler).assemble(source, output_dir, cache, binary)
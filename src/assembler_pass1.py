@@ -1,148 +1,349 @@
-from src.instructions import instruction_size, op_codes
+import os
 
+from src.expressions import ExpressionError, absolute_value, evaluate
+from src.instructions import instruction_size, mnemonic_table, FORMAT_DIRECTIVE
+from src.profiling import track
+from src.source_line import SourceLine
 
-symbol_table = {}
 
 def get_size(instruction, operand):
-    instruction = instruction.upper()
-
-    if instruction.startswith('+'):
-        base_instruction = instruction[1:].upper()
-        if base_instruction in instruction_size:
-            return 4
+    entry = mnemonic_table.get(instruction.upper())
+    if entry is None:
         return 3
-    
-    if instruction in ['LITLD', 'LITAD', 'LITSB', 'LITCMP']:
-        return 4
+    if entry.size is not None:
+        return entry.size
+    return get_directive_size(entry.name, operand)
 
-    if instruction == 'RESW':
-        try:
-            return int(operand) * 3
-        except:
-            return 0
-    elif instruction == 'RESB':
+
+def get_directive_size(instruction, operand, symbols=None, loc=0):
+    """Size of RESW/RESB/BYTE, which depends on the operand (0 for a bad RESW/RESB count)"""
+    if instruction == 'RESW' or instruction == 'RESB':
         try:
-            return int(operand)
-        except:
+            count = reserve_count(operand, symbols, loc)
+        except ExpressionError:
             return 0
-    elif instruction == 'BYTE':
-        if operand.startswith("C'") and operand.endswith("'"):
-            return len(operand[2:-1])
-        elif operand.startswith("X'") and operand.endswith("'"):
-            return len(operand[2:-1]) // 2
-        else:
-            return 1
-    elif instruction == 'WORD':
-        return 3
+        return count * 3 if instruction == 'RESW' else count
+    elif operand.startswith("C'") and operand.endswith("'"):
+        return len(operand[2:-1])
+    elif operand.startswith("X'") and operand.endswith("'"):
+        return len(operand[2:-1]) // 2
+    return 1
 
-    return instruction_size.get(instruction, 3)
+
+def reserve_count(operand, symbols=None, loc=0):
+    """Number of words or bytes a RESW/RESB reserves: an absolute expression of earlier symbols"""
+    count = absolute_value(operand, symbols, loc)
+    if count < 0:
+        raise ExpressionError(f"Negative reservation '{operand}'")
+    return count
 
 
 def is_valid_instruction(instruction):
-    """Check if the instruction is valid"""
-    instruction = instruction.upper()
-    
-    # Check if it's a format 4 instruction (starts with +)
-    if instruction.startswith('+'):
-        base_instruction = instruction[1:]
-        return base_instruction in instruction_size
-    
-    # Check for format 4L instructions
-    format4L_instructions = ['LITLD', 'LITAD', 'LITSB', 'LITCMP']
-    if instruction in format4L_instructions:
-        return True
-
-    return instruction in instruction_size
+    """Check if the instruction is valid (including '+' format 4 forms)"""
+    return instruction.upper() in mnemonic_table
 
 
-def pass1(input_file):
+def get_format(instruction):
+    """Return the format of an upper-cased instruction (FORMAT_DIRECTIVE for directives)"""
+    entry = mnemonic_table.get(instruction)
+    if entry is not None:
+        return entry.format
+    return 4 if instruction.startswith('+') else FORMAT_DIRECTIVE
+
+
+def literal_value(text):
+    """Bytes of a literal operand (=C'..', =X'..' or a one-word decimal =N), None if malformed"""
+    body = text[1:]
+    kind, quoted = body[:1], body[1:]
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"Error: Input file '{input_file}' not found.")
+        if kind in ('C', 'X') and len(quoted) > 2 and quoted[0] == "'" and quoted[-1] == "'":
+            if kind == 'C':
+                return quoted[1:-1].encode('latin-1')
+            return bytes.fromhex(quoted[1:-1])
+        return (int(body) & 0xFFFFFF).to_bytes(3, 'big')
+    except ValueError:
+        return None
+
+
+def add_literal(text, context, line_num):
+    """Enter a literal operand for the next pool; literals with the same bytes share one entry in a pool.
+
+    Each pool holds its own copy of every literal used since the pool before
+    it, so a reference is always to a copy placed after it. Malformed
+    literals are left out, and pass 2 reports them.
+    """
+    value = context.literal_refs.get(text)
+    if value is None:
+        value = literal_value(text)
+        if value is None:
+            return
+        context.literal_refs[text] = value
+    context.pending_literals.setdefault(value, text)
+    context.literal_uses.append((line_num, text, value))
+
+
+def place_literals(context, loc, line_num):
+    """Yield a '*' BYTE/WORD line for each pending literal from loc on; return the next free address"""
+    pool = list(context.pending_literals.items())
+    addresses = {}
+    for value, text in pool:
+        addresses[value] = loc
+        loc += len(value)
+    literal_addresses = context.literal_addresses
+    for use_line, text, value in context.literal_uses:
+        literal_addresses[use_line] = (text, addresses[value])
+    context.pending_literals.clear()
+    context.literal_uses.clear()
+    for value, text in pool:
+        mnemonic = 'BYTE' if text[1] in ('C', 'X') else 'WORD'
+        yield SourceLine('*', mnemonic, text[1:], FORMAT_DIRECTIVE, addresses[value], len(value), line_num)
+    return loc
+
+
+def literal_symbols(context):
+    """The symbol table for pass 2: a copy when there are literals, as each statement enters its literal's address"""
+    if not context.literal_addresses:
+        return context.symbol_table
+    return context.symbol_table.copy()
+
+
+def define_equate(label, operand, context, loc, line_num):
+    """Define label as the value of an EQU expression; '*' is the current location"""
+    symbol_table = context.symbol_table
+    if label in symbol_table:
+        context.report(f"Error: Duplicate symbol '{label}'")
         return
+    try:
+        value, relative = evaluate(operand, symbol_table, loc)
+    except ExpressionError as e:
+        context.line_error(line_num, str(e))
+        return
+    symbol_table[label] = value
+    if not relative and hasattr(symbol_table, 'absolute'):
+        symbol_table.absolute.add(label)
+
 
-    intermediate = []
-    location_counter = []
-    loc = 0
-    invalid_instructions = []  # Track invalid instructions for reporting
+def define_label(label, instruction, operand, context, location, line_num):
+    """Enter a statement's label in the symbol table: its address, or the value of an EQU"""
+    if label.upper() in instruction_size:
+        return
+    symbol_table = context.symbol_table
+    if instruction == 'EQU':
+        define_equate(label, operand, context, location, line_num)
+    elif instruction == 'START' or instruction == 'CSECT':
+        symbol_table[label] = location
+    elif label in symbol_table:
+        context.report(f"Error: Duplicate symbol '{label}'")
+    else:
+        symbol_table[label] = location
 
-    for line_num, line in enumerate(lines, 1):
-        original_line = line.strip()  # Keep original line for error reporting
-        line = line.strip()
 
-        if ';' in line:
-            line = line.split(';')[0].strip()  # Remove comments
-        if not line:
+def define_external(operand, context):
+    """Enter the EXTREF names as external symbols with value 0, for the linking loader to fill in"""
+    symbol_table = context.symbol_table
+    for name in operand.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name in symbol_table:
+            context.report(f"Error: Duplicate symbol '{name}'")
             continue
+        symbol_table[name] = 0
+        if hasattr(symbol_table, 'external'):
+            symbol_table.external.add(name)
 
-        tokens = line.split()
 
-        # Skip line numbers if present
-        if tokens and tokens[0].isdigit():
-            tokens = tokens[1:]  # Remove line number if present
+def set_origin(operand, context, loc, line_num):
+    """Location counter after an ORG: the operand's value, or with no operand the value before the last ORG"""
+    if not operand:
+        if context.org_return is None:
+            return loc
+        loc, context.org_return = context.org_return, None
+        return loc
+    try:
+        value = evaluate(operand, context.symbol_table, loc)[0]
+    except ExpressionError as e:
+        context.line_error(line_num, str(e))
+        return loc
+    context.org_return = loc
+    return value
 
-        # Parse the line into label, instruction, and operand
-        label, instruction, operand = '', '', ''
-        if len(tokens) == 3:
-            label, instruction, operand = tokens
-        elif len(tokens) == 2:
-            # Check if the first token is likely an instruction
-            if is_valid_instruction(tokens[0]):
-                instruction, operand = tokens
-            else:
-                label, instruction = tokens
-        elif len(tokens) == 1:
-            instruction = tokens[0]
 
-        instruction = instruction.upper()
+def split_statement(text):
+    """Split a source line into (label, instruction, operand), or None for a blank or comment line"""
+    line = text.strip()
+    if ';' in line:
+        line = line.split(';')[0].strip()  # Remove comments
+    if not line:
+        return None
+
+    tokens = line.split()
+
+    # Skip line numbers if present
+    if tokens and tokens[0].isdigit():
+        tokens = tokens[1:]  # Remove line number if present
+
+    # Parse the line into label, instruction, and operand
+    label, instruction, operand = '', '', ''
+    if len(tokens) == 3:
+        label, instruction, operand = tokens
+    elif len(tokens) == 2:
+        # Check if the first token is likely an instruction
+        if tokens[0].upper() in mnemonic_table:
+            instruction, operand = tokens
+        else:
+            label, instruction = tokens
+    elif len(tokens) == 1:
+        instruction = tokens[0]
+
+    return label, instruction.upper(), operand
+
+
+def parse_lines(lines, context, first_line=1):
+    """Generator form of pass 1: yield a SourceLine per statement.
+
+    context is the Assembler that owns this run; its symbol table, location
+    counter, invalid instruction list and diagnostics are updated in place.
+    first_line is the source line number of the first line given.
+
+    Literal operands of format 3/4 instructions are entered for the next
+    pool, and a pool of '*' lines holding them is yielded after each LTORG,
+    before END and at the end of the input; context.literal_addresses then
+    maps each statement using a literal to its copy in that pool. EQU, ORG and RESW/RESB operands are expressions of
+    symbols defined on earlier lines. Lines listed in context.wide_lines are
+    read as format 4 (relax mode). A progress callable on context is told
+    how many lines have been read.
+    """
+    symbol_table = context.symbol_table
+    invalid_instructions = context.invalid_instructions
+    report = context.report
+    wide_lines = context.wide_lines
+    loc = context.location_counter
+    line_num = first_line - 1
+
+    split = split_statement
+    define = define_label
+    profiler = getattr(context, 'profiler', None)
+    if profiler is not None:
+        split = profiler.wrap('tokenize', split_statement)
+        define = profiler.wrap('symbols', define_label)
+    progress = getattr(context, 'progress', None)
+    if progress is not None:
+        lines = track(lines, progress, 'pass 1')
+
+    for line_num, line in enumerate(lines, first_line):
+        statement = split(line)
+        if statement is None:
+            continue
+        label, instruction, operand = statement
+
+        if wide_lines and line_num in wide_lines:
+            instruction = '+' + instruction
+        entry = mnemonic_table.get(instruction)
 
         # Check if the instruction is valid
-        if not is_valid_instruction(instruction) and instruction not in ['START', 'END']:
-            invalid_instructions.append((line_num, original_line, instruction))
-            print(f"Error at line {line_num}: Invalid instruction '{instruction}'")
+        if entry is None:
+            invalid_instructions.append((line_num, line.strip(), instruction))
+            report(f"Error at line {line_num}: Invalid instruction '{instruction}'")
             continue  # Skip this line and don't include it in intermediate file
 
+        if operand[:1] == '=' and entry.format in (3, 4):
+            add_literal(operand.split(',')[0], context, line_num)
+        elif instruction == 'END' and context.pending_literals:
+            loc = yield from place_literals(context, loc, line_num)
+
         if instruction == 'START':
             try:
                 loc = int(operand, 16)
             except:
                 loc = 0
             location = loc
-            if label and label.upper() not in instruction_size:
-                symbol_table[label] = f'{location:04X}'
+        elif instruction == 'CSECT':
+            # A control section is assembled from address 0, like a program of its own
+            loc = location = 0
         else:
             location = loc
-            if label and label.upper() not in instruction_size:
-                if label in symbol_table:
-                    print(f"Error: Duplicate symbol '{label}'")
-                else:
-                    symbol_table[label] = f'{location:04X}'
+        if label:
+            define(label, instruction, operand, context, location, line_num)
+        if instruction == 'EXTREF':
+            define_external(operand, context)
+
+        size = entry.size
+        if size is None:
+            if instruction == 'RESW' or instruction == 'RESB':
+                try:
+                    size = reserve_count(operand, symbol_table, loc) * (3 if instruction == 'RESW' else 1)
+                except ExpressionError as e:
+                    context.line_error(line_num, str(e))
+                    size = 0
+            else:
+                size = get_directive_size(instruction, operand)
+        yield SourceLine(label, instruction, operand, entry.format, location, size, line_num)
+
+        loc += size
+        if instruction == 'LTORG':
+            loc = yield from place_literals(context, loc, line_num)
+        elif instruction == 'ORG':
+            loc = set_origin(operand, context, loc, line_num)
+        context.location_counter = loc
 
-        # Save intermediate representation and LC
-        intermediate.append(f'{label}\t{instruction}\t{operand}'.strip())
-        location_counter.append(f'{location:04X}')
+    # Literals still waiting at the end of the input (a control section ends with no END)
+    if context.pending_literals:
+        loc = yield from place_literals(context, loc, line_num)
+        context.location_counter = loc
 
-        loc += get_size(instruction, operand)
 
-    # Report summary of invalid instructions
+def report_invalid_instructions(invalid_instructions, report=print):
+    """Report the summary of invalid instructions found by pass 1"""
     if invalid_instructions:
-        print(f"\nFound {len(invalid_instructions)} invalid instructions:")
+        report(f"\nFound {len(invalid_instructions)} invalid instructions:")
         for line_num, line, instruction in invalid_instructions:
-            print(f"Line {line_num}: '{instruction}' in '{line}'")
+            report(f"Line {line_num}: '{instruction}' in '{line}'")
 
-    with open('data/intermediate.txt', 'w', encoding='utf-8') as f:
-        for line in intermediate:
-            f.write(line + '\n')
 
-    with open('data/out_pass1.txt', 'w', encoding='utf-8') as f:
-        for lc in location_counter:
-            f.write(lc + '\n')
+def write_pass1_files(lines, symbol_table, directory='data', sections=None):
+    """Write the intermediate, location counter and symbol table files.
+
+    sections, a list of (name, symbol table) for a program of several control
+    sections, writes each section's symbols under a line holding its name.
+    """
+    with open(os.path.join(directory, 'intermediate.txt'), 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line.text() + '\n')
+
+    with open(os.path.join(directory, 'out_pass1.txt'), 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(f'{line.address:04X}\n')
+
+    with open(os.path.join(directory, 'symbTable.txt'), 'w', encoding='utf-8') as f:
+        if sections is None:
+            write_symbols(f, symbol_table)
+        for name, table in sections or ():
+            f.write(f'{name}\n')
+            write_symbols(f, table)
+
+
+def write_symbols(f, symbol_table):
+    """Write one 'SYMBOL<tab>ADDR' line per symbol, leaving out EXTREF names (they have no address here)"""
+    external = getattr(symbol_table, 'external', ())
+    for symbol, addr in symbol_table.items():
+        if symbol not in external:
+            f.write(f'{symbol}\t{addr:04X}\n')
+
+
+def pass1(input_file):
+    try:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        print(f"Error: Input file '{input_file}' not found.")
+        return
+
+    from src.assembler import Assembler
 
-    with open('data/symbTable.txt', 'w', encoding='utf-8') as f:
-        for symbol, addr in symbol_table.items():
-            f.write(f'{symbol}\t{addr}\n')
+    context = Assembler(echo=True)
+    parsed = context.pass1(lines)
+    write_pass1_files(parsed, context.symbol_table)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,20 @@
-from src.instructions import op_codes, registers, instruction_size
+import os
+
+from src.expressions import ExpressionError, SymbolTable, evaluate, compile_expression, external_terms
+from src.instructions import registers, instruction_size, mnemonic_table, FORMAT_DIRECTIVE, FORMAT_4L
+from src.assembler_pass1 import get_format, get_size, literal_symbols, literal_value
+from src.profiling import track
+from src.source_line import SourceLine
 
 def load_symbol_table(file_path):
-    symbol_table = {}
+    symbol_table = SymbolTable()
     try:
         with open(file_path, 'r') as f:
             for line in f:
                 if line.strip(): # if line is not empty
                     parts = line.strip().split()
                     if len(parts) >= 2:
-                        symbol_table[parts[0]] = parts[1] # store parts[0] (label) as the key and parts[1] (address) as the value in the dictionary
+                        symbol_table[parts[0]] = int(parts[1], 16) # store parts[0] (label) as the key and the address as an integer value
     except FileNotFoundError:
         print(f"Error: Symbol table file '{file_path}' not found.")
     return symbol_table
@@ -19,14 +25,14 @@ def load_location_counter(file_path):
         with open(file_path, 'r') as f:
             for line in f:
                 if line.strip():
-                    location_counter.append(line.strip())
+                    location_counter.append(int(line.strip(), 16))
     except FileNotFoundError:
         print(f"Error: Location counter file '{file_path}' not found.")
     return location_counter
 
 def format1_object_code(op_code):
     """Generate object code for Format 1 instructions"""
-    return f"{int(op_code, 0):02X}"
+    return f"{op_code:02X}"
 
 def format2_object_code(op_code, operand):
     """Generate object code for Format 2 instructions"""
@@ -38,9 +44,9 @@ def format2_object_code(op_code, operand):
     else:
         r1 = registers.get(operand.strip(), 0)
     
-    return f"{int(op_code, 0):02X}{r1}{r2}"
+    return f"{op_code:02X}{r1}{r2}"
 
-def format3_object_code(op_code, operand, symbol_table, current_address, base_address):
+def format3_object_code(op_code, operand, symbol_table, current_address, base_address, report=print):
     """Generate object code for Format 3 instructions"""
     # Default flags
     n, i, x, b, p, e = 1, 1, 0, 0, 0, 0
@@ -64,9 +70,44 @@ def format3_object_code(op_code, operand, symbol_table, current_address, base_ad
     
     # Calculate displacement
     disp = 0
-    if operand in symbol_table:
-        target_address = int(symbol_table[operand], 16)  # convert the string from hexadecimal (base 16) to an integer (base 10).
-        next_instruction = int(current_address, 16) + 3  # PC points to next instruction
+    target_address = None
+    if (operand in symbol_table and operand not in getattr(symbol_table, 'absolute', ())
+            and operand not in getattr(symbol_table, 'external', ())):
+        # A plain relative symbol, the usual case: no expression to look at
+        target_address = symbol_table[operand]
+    elif external_terms(operand, symbol_table):
+        # Only format 4 and WORD have room for an address the loader fills in
+        report(f"Warning: External reference {operand} needs format 4")
+    elif operand == '':
+        # For instructions like RSUB that don't have operands
+        disp = 0
+    elif operand.isdigit():
+        # For immediate values
+        disp = int(operand) & 0xFFF
+    elif operand and '=' in operand:
+        # Placed literals are in symbol_table, so this one is malformed or has no pool
+        if literal_value(operand) is None:
+            report(f"Warning: Invalid literal {operand}")
+        else:
+            report(f"Warning: Literal {operand} has no address (no LTORG or END after it)")
+        disp = 0
+    else:
+        # Expression or absolute symbol: a relative value is addressed like a label
+        try:
+            value, relative = evaluate(operand, symbol_table, current_address)
+        except ExpressionError as error:
+            report(f"Warning: {error}")
+            value, relative = 0, False
+        if relative:
+            target_address = value
+        elif 0 <= value <= 4095:
+            disp = value
+        else:
+            report(f"Warning: Value of {operand} does not fit in 12 bits, use format 4")
+            disp = value & 0xFFF
+
+    if target_address is not None:
+        next_instruction = current_address + 3  # PC points to next instruction
         
         # Try PC-relative first
         pc_disp = target_address - next_instruction
@@ -82,23 +123,14 @@ def format3_object_code(op_code, operand, symbol_table, current_address, base_ad
                 p = 0
                 disp = base_disp
             else:
-                print(f"Warning: Address displacement out of range for {operand}")
+                report(f"Warning: Address displacement out of range for {operand}")
                 disp = 0
         else:
-            print(f"Warning: Address displacement out of range for {operand}")
+            report(f"Warning: Address displacement out of range for {operand}")
             disp = 0
-    elif operand == '':
-        # For instructions like RSUB that don't have operands
-        disp = 0
-    elif operand.isdigit():
-        # For immediate values
-        disp = int(operand) & 0xFFF
-    elif operand and '=' in operand:
-        # For literal values in format =X'05'
-        disp = 0  # Will be resolved in a more complete implementation
     
     # Calculate object code
-    opcode_bits = int(op_code, 0) >> 2  # Discard last 2 bits
+    opcode_bits = op_code >> 2  # Discard last 2 bits
     flags = (n << 5) | (i << 4) | (x << 3) | (b << 2) | (p << 1) | e
     
     first_byte = (opcode_bits << 2) | (flags >> 4)
@@ -107,7 +139,7 @@ def format3_object_code(op_code, operand, symbol_table, current_address, base_ad
     
     return f"{first_byte:02X}{second_byte:02X}{third_byte:02X}"
 
-def format4_object_code(op_code, operand, symbol_table):
+def format4_object_code(op_code, operand, symbol_table, report=print, current_address=0):
     """Generate object code for Format 4 instructions"""
     # Default flags for format 4
     n, i, x, b, p, e = 1, 1, 0, 0, 0, 1  # e=1 for format 4
@@ -132,18 +164,24 @@ def format4_object_code(op_code, operand, symbol_table):
     # Get address
     address = 0
     if operand in symbol_table:
-        address = int(symbol_table[operand], 16)
+        address = symbol_table[operand]
     elif operand.isdigit():
         address = int(operand) & 0xFFFFF
     elif operand == '':
         # For instructions like +RSUB that don't have operands
         address = 0
-    else:
-        print(f"Warning: Operand '{operand}' not found in symbol table.")
+    elif operand.isidentifier():
+        report(f"Warning: Operand '{operand}' not found in symbol table.")
         address = 0
+    else:
+        try:
+            address = evaluate(operand, symbol_table, current_address)[0] & 0xFFFFF
+        except ExpressionError as error:
+            report(f"Warning: {error}")
+            address = 0
     
     # Calculate object code
-    opcode_bits = int(op_code, 0) >> 2  # Discard last 2 bits
+    opcode_bits = op_code >> 2  # Discard last 2 bits
     flags = (n << 5) | (i << 4) | (x << 3) | (b << 2) | (p << 1) | e
     
     first_byte = (opcode_bits << 2) | (flags >> 4)
@@ -167,7 +205,7 @@ def format4L_object_code(op_code, operand):
             
     
     reg_code = registers.get(register, 0)
-    return f"{int(op_code, 0):02X}{reg_code:01X}0{value:04X}"
+    return f"{op_code:02X}{reg_code:01X}0{value:04X}"
 
 def process_byte_directive(operand):
     """Process BYTE directive and return the object code"""
@@ -181,52 +219,199 @@ def process_byte_directive(operand):
         return operand[2:-1]
     return ""
 
-def process_word_directive(operand):
+def process_word_directive(operand, symbol_table=None, current_address=0, report=print):
     """Process WORD directive and return the object code"""
     try:
         value = int(operand)
         return f"{value & 0xFFFFFF:06X}"
     except ValueError:
+        pass
+    if symbol_table is None:
+        return "000000"
+    try:
+        value = evaluate(operand, symbol_table, current_address)[0]
+    except ExpressionError as e:
+        report(f"Warning: {e}")
         return "000000"
+    return f"{value & 0xFFFFFF:06X}"
+
+def encode_format1(entry, operand, address, symbol_table, base_address, report):
+    return format1_object_code(entry.opcode)
+
+def encode_format2(entry, operand, address, symbol_table, base_address, report):
+    return format2_object_code(entry.opcode, operand)
+
+def encode_format3(entry, operand, address, symbol_table, base_address, report):
+    return format3_object_code(entry.opcode, operand, symbol_table, address, base_address, report)
+
+def encode_format4(entry, operand, address, symbol_table, base_address, report):
+    if entry.opcode is None: # '+' applied to a directive
+        return "ERROR"
+    return format4_object_code(entry.opcode, operand, symbol_table, report, address)
+
+def encode_format4L(entry, operand, address, symbol_table, base_address, report):
+    return format4L_object_code(entry.opcode, operand)
+
+def encode_byte(entry, operand, address, symbol_table, base_address, report):
+    return process_byte_directive(operand)
+
+def encode_word(entry, operand, address, symbol_table, base_address, report):
+    return process_word_directive(operand, symbol_table, address, report)
 
-def generate_object_code(instruction, operand, symbol_table, current_address, base_address=None):
+def encode_nothing(entry, operand, address, symbol_table, base_address, report):
+    return ""
+
+format_encoders = {
+    1: encode_format1, 2: encode_format2, 3: encode_format3, 4: encode_format4,
+    FORMAT_4L: encode_format4L, FORMAT_DIRECTIVE: encode_nothing,
+}
+directive_encoders = {'BYTE': encode_byte, 'WORD': encode_word}
+
+# Attach an encoder to every mnemonic once, so encoding a line is a single table lookup
+for _entry in mnemonic_table.values():
+    _entry.encoder = directive_encoders.get(_entry.name, format_encoders[_entry.format])
+
+def generate_object_code(instruction, operand, symbol_table, current_address, base_address=None, report=print):
     """Generate object code for an instruction"""
     instruction = instruction.upper()
-    
-    # Check if it's a format 4 instruction (starts with +)
-    if instruction.startswith('+'):
-        base_instruction = instruction[1:]
-        if base_instruction in op_codes:
-            return format4_object_code(op_codes[base_instruction], operand, symbol_table)
-        return "ERROR"
-    
-    # Check for Format 4L instructions
-    if instruction in ['LITLD', 'LITAD', 'LITSB', 'LITCMP']:
-        if instruction in op_codes:
-            return format4L_object_code(op_codes[instruction], operand)
-        return "ERROR"
-    
-    # Directives
-    if instruction == 'BYTE':
-        return process_byte_directive(operand)
-    elif instruction == 'WORD':
-        return process_word_directive(operand)
-    elif instruction in ['START', 'END', 'BASE', 'RESW', 'RESB']:
-        return ""
-    
-    # Regular instructions
-    if instruction in op_codes:
-        if instruction in ['FIX', 'FLOAT', 'HIO', 'NORM', 'SIO', 'TIO']:
-            # Format 1
-            return format1_object_code(op_codes[instruction])
-        elif instruction in ['ADDR', 'CLEAR', 'COMPR', 'DIVR', 'MULR', 'RMO', 'SHIFTL', 'SHIFTR', 'SUBR', 'SVC', 'TIXR']:
-            # Format 2
-            return format2_object_code(op_codes[instruction], operand)
+    entry = mnemonic_table.get(instruction)
+    if entry is None:
+        return "ERROR" if instruction.startswith('+') else ""
+    return entry.encoder(entry, operand, current_address, symbol_table, base_address, report)
+
+def encode_line(line, symbol_table, base_address=None, report=print):
+    """Generate object code for a parsed SourceLine"""
+    entry = mnemonic_table.get(line.mnemonic)
+    if entry is None:
+        return "ERROR" if line.format == 4 else ""
+    return entry.encoder(entry, line.operand, line.address, symbol_table, base_address, report)
+
+def parse_intermediate_line(line, address, line_number):
+    """Turn an intermediate file line back into a SourceLine"""
+    tokens = line.split() # Split line into tokens ex ["COPY", "START", "1000"]
+
+    if len(tokens) == 3:
+        label, instruction, operand = tokens
+    elif len(tokens) == 2:
+        if tokens[0].upper() in instruction_size or tokens[0].startswith('+'):
+            label = "" # assume no label
+            instruction, operand = tokens
         else:
-            # Format 3
-            return format3_object_code(op_codes[instruction], operand, symbol_table, current_address, base_address)
-    
-    return ""
+            label, instruction = tokens
+            operand = ""
+    elif len(tokens) == 1: # Example RSUB
+        label = ""
+        instruction = tokens[0]
+        operand = ""
+    else:
+        return None # Skip invalid lines
+
+    instruction = instruction.upper()
+    return SourceLine(label, instruction, operand, get_format(instruction), address,
+                      get_size(instruction, operand), line_number)
+
+def iter_encoded(lines, context):
+    """Yield (line, object_code) for each SourceLine.
+
+    context is the Assembler that owns this run; pass 2 reads its symbol
+    table and literal addresses, keeps its base register up to date and reports through it.
+    With a profiler on the context, each encoder call is timed by format,
+    and with a progress callable it hears how many lines are done.
+    """
+    symbol_table = literal_symbols(context)
+    report = context.report
+    encode = encode_line
+    profiler = getattr(context, 'profiler', None)
+    if profiler is not None:
+        encode = profiler.encoder(encode_line)
+    progress = getattr(context, 'progress', None)
+    if progress is not None:
+        lines = track(lines, progress, 'pass 2')
+
+    literal_addresses = context.literal_addresses
+    for line in lines:
+        # Update BASE register if needed
+        if line.mnemonic == 'BASE' and line.operand in symbol_table:
+            context.base_address = symbol_table[line.operand]
+        # A literal operand names the copy in the pool after this statement;
+        # its entry is dropped once used, so a streaming run holds none for long
+        if literal_addresses and line.line_number in literal_addresses:
+            text, address = literal_addresses.pop(line.line_number)
+            symbol_table[text] = address
+            code = encode(line, symbol_table, context.base_address, report)
+            del symbol_table[text]
+            yield line, code
+            continue
+
+        yield line, encode(line, symbol_table, context.base_address, report)
+
+def format_listing_line(line, object_code):
+    return f"{line.address:04X}\t{line.label}\t{line.mnemonic}\t{line.operand}\t{object_code}"
+
+def encode_program(lines, context):
+    """Generate object codes and listing lines for a list of SourceLine records"""
+    object_codes = []
+    listing_lines = []
+
+    for line, object_code in iter_encoded(lines, context):
+        object_codes.append(object_code)
+        listing_lines.append(format_listing_line(line, object_code))
+
+    return object_codes, listing_lines
+
+LISTING_HEADER = "Address\tLabel\tInstruction\tOperand\tObject Code\n" + "-" * 60 + "\n"
+
+def write_pass2_files(object_codes, listing_lines, htme_records, directory='data', image=None):
+    """Write the object code, listing and HTME files, plus image.bin when an ObjectImage is given"""
+    # Write object codes to output file
+    with open(os.path.join(directory, 'out_pass2.txt'), 'w') as f:
+        for code in object_codes:
+            f.write(f"{code}\n")
+
+    # Write listing lines to listing.txt
+    with open(os.path.join(directory, 'listing.txt'), 'w') as f:
+        f.write(LISTING_HEADER)
+        for line in listing_lines:
+            f.write(f"{line}\n")
+
+    # Write HTME records to output file
+    if htme_records:
+        with open(os.path.join(directory, 'HTME.txt'), 'w') as f:
+            for record in htme_records:
+                f.write(f"{record}\n")
+
+    # Raw program bytes, from the load address up to the program length
+    if image is not None and image.origin is not None:
+        with open(os.path.join(directory, 'image.bin'), 'wb') as f:
+            f.write(image.data)
+
+def collect_literals(lines, context):
+    """Rebuild the literal addresses of a program read back from intermediate.txt from its '*' pool lines.
+
+    Each statement using a literal gets the first pool line with its bytes after it.
+    """
+    waiting = {}  # literal bytes -> (line number, operand text) of statements before their pool
+    for line in lines:
+        if line.label == '*':
+            value = literal_value('=' + line.operand)
+            for line_number, text in waiting.pop(value, ()):
+                context.literal_addresses[line_number] = (text, line.address)
+        elif line.format in (3, 4) and line.operand.startswith('='):
+            text = line.operand.split(',')[0]
+            value = literal_value(text)
+            if value is not None:
+                waiting.setdefault(value, []).append((line.line_number, text))
+                context.literal_refs[text] = value
+
+def mark_absolute_symbols(lines, symbol_table):
+    """Recover which EQU symbols are absolute in a symbol table read back from symbTable.txt"""
+    for line in lines:
+        if line.mnemonic == 'EQU' and line.label in symbol_table:
+            try:
+                if not compile_expression(line.operand).is_relative(symbol_table):
+                    symbol_table.absolute.add(line.label)
+            except ExpressionError:
+                pass
 
 def pass2(intermediate_file, location_counter_file, symbol_table_file):
     """Perform pass 2 of the SIC/XE assembler"""
@@ -241,215 +426,330 @@ def pass2(intermediate_file, location_counter_file, symbol_table_file):
     except FileNotFoundError:
         print(f"Error: Intermediate file '{intermediate_file}' not found.")
         return
-    
-    # Prepare output
-    object_codes = []
-    listing_lines = []
-    # Track BASE register value
-    base_address = None
-    
-    # Process each line
-    for i, line in enumerate(intermediate_lines):
-        tokens = line.split() # Split line into tokens ex ["COPY", "START", "1000"]
-        
-        if len(tokens) == 3:
-            label, instruction, operand = tokens
-        elif len(tokens) == 2:
-            if tokens[0].upper() in instruction_size or tokens[0].startswith('+'):
-                label = "" # assume no label
-                instruction, operand = tokens
-            else:
-                label, instruction = tokens
-                operand = ""
-        elif len(tokens) == 1: # Example RSUB
-            label = ""
-            instruction = tokens[0]
-            operand = ""
-        else:
-            continue  # Skip invalid lines
-        
-        instruction = instruction.upper()
-        
-        # Update BASE register if needed
-        if instruction == 'BASE' and operand in symbol_table:
-            base_address = int(symbol_table[operand], 16)
-        
-        # Generate object code
-        current_address = location_counter[i] if i < len(location_counter) else "0000"
-        object_code = generate_object_code(instruction, operand, symbol_table, current_address, base_address)
-        object_codes.append(object_code)
 
-        # Create listing line
-        listing_line = f"{current_address}\t{label}\t{instruction}\t{operand}\t{object_code}"
-        listing_lines.append(listing_line)
+    lines = []
+    for i, text in enumerate(intermediate_lines):
+        address = location_counter[i] if i < len(location_counter) else 0
+        parsed = parse_intermediate_line(text, address, i + 1)
+        if parsed is not None:
+            lines.append(parsed)
 
-    # Write object codes to output file
-    with open('data/out_pass2.txt', 'w') as f:
-        for code in object_codes:
-            f.write(f"{code}\n")
+    from src.assembler import Assembler
 
-    # Write listing lines to listing.txt
-    with open('data/listing.txt', 'w') as f:
-        f.write("Address\tLabel\tInstruction\tOperand\tObject Code\n")
-        f.write("-" * 60 + "\n")
-        for line in listing_lines:
-            f.write(f"{line}\n")
+    context = Assembler(echo=True)
+    mark_absolute_symbols(lines, symbol_table)
+    context.symbol_table = symbol_table
+    collect_literals(lines, context)
+    object_codes, listing_lines = encode_program(lines, context)
 
     # Generate HTME records
-    generate_htme_records(intermediate_lines, location_counter, object_codes)
+    htme_records = generate_htme_records(lines, object_codes, symbols=symbol_table)
+    write_pass2_files(object_codes, listing_lines, htme_records)
 
-def generate_htme_records(intermediate_lines, location_counter, object_codes):
-    """Generate HTME records for the SIC/XE program"""
-    if not intermediate_lines or not location_counter or not object_codes:
-        print("Error: Missing data for HTME record generation")
-        return
-    
-    # Initialize variables
-    program_name = ""
-    starting_address = ""
-    ending_address = ""
-    text_records = []
-    modification_records = []  # New list to store modification records
-    current_text_record = {"address": "", "length": 0, "codes": []}
-    
-    # Find program name and starting address
-    first_line = intermediate_lines[0].split()
-    if len(first_line) >= 3 and first_line[1].upper() == 'START':
-        program_name = first_line[0]
-        starting_address = location_counter[0]
-    
-    # Process each line to generate text records and identify modification records
-    for i, (line, lc, obj_code) in enumerate(zip(intermediate_lines, location_counter, object_codes)):
-        tokens = line.split()
-        
-        if len(tokens) == 3:
-            label, instruction, operand = tokens
-        elif len(tokens) == 2:
-            if tokens[0].upper() in instruction_size or tokens[0].startswith('+'):
-                label = ""
-                instruction, operand = tokens
+class ProgramInfo:
+    """Facts for the H and E records, gathered one line at a time"""
+
+    __slots__ = ('name', 'start', 'end', 'last', 'high', 'first_executable', 'section', 'definitions',
+                 'references')
+
+    def __init__(self):
+        self.name = ""
+        self.start = None
+        self.end = None
+        self.last = None
+        self.high = 0  # highest address used, which ORG can put past END
+        self.first_executable = None
+        self.section = False  # a CSECT after the first control section (its E record has no address)
+        self.definitions = []  # EXTDEF names
+        self.references = []  # EXTREF names
+
+    def update(self, line):
+        if self.start is None:
+            self.start = line.address
+            # Program name comes from a "NAME START addr" or "NAME CSECT" first line
+            if line.label and line.operand and line.mnemonic == 'START':
+                self.name = line.label
+            elif line.mnemonic == 'CSECT':
+                self.name = line.label
+                self.section = True
+        if line.mnemonic == 'END':
+            self.end = line.address
+        elif line.mnemonic in ('EXTDEF', 'EXTREF'):
+            names = [name.strip() for name in line.operand.split(',') if name.strip()]
+            (self.definitions if line.mnemonic == 'EXTDEF' else self.references).extend(names)
+        elif self.first_executable is None and line.mnemonic not in ['START', 'BASE', 'LTORG', 'EQU', 'ORG', 'RESW', 'RESB', 'BYTE', 'WORD', 'CSECT']:
+            self.first_executable = line.address
+        self.last = line.address
+        self.high = max(self.high, line.address + line.size)
+
+    def length(self):
+        end = self.high if self.end is None else max(self.end, self.high)
+        return end - self.start
+
+def relocatable(operand, symbols):
+    """Whether an operand's value is an address that moves with the program"""
+    operand = operand.split(',')[0].strip()
+    if operand[:1] in ('#', '@'):
+        operand = operand[1:]
+    if operand.startswith('='):
+        return True  # literal pool address
+    if operand in symbols:
+        return operand not in getattr(symbols, 'absolute', ()) and operand not in getattr(symbols, 'external', ())
+    try:
+        return compile_expression(operand).is_relative(symbols)
+    except ExpressionError:
+        return True  # unknown operands keep their M record
+
+def modification_record(line, symbols=None):
+    """Return the M record for a format 4 or WORD line, or None if it needs no relocation.
+
+    Without symbols, every format 4 operand but a numeric immediate is relocated.
+    """
+    operand = line.operand
+    if line.mnemonic == 'WORD':
+        if symbols is None or not operand or operand.lstrip('-').isdigit():
+            return None
+        return f"M^{line.address:06X}^06" if relocatable(operand, symbols) else None
+    if line.format != 4 or not operand:
+        return None
+    if symbols is not None and not relocatable(operand, symbols):
+        return None
+
+    # Check if it's immediate addressing with a numeric value
+    if operand.startswith('#'):
+        stripped_operand = operand[1:]  # Remove the # character
+
+        # Only create M record if operand is not numeric
+        if stripped_operand.isdigit() or (stripped_operand.startswith('-') and stripped_operand[1:].isdigit()):
+            return None
+        elif stripped_operand.startswith('0x') or stripped_operand.startswith('0X'):
+            try:
+                int(stripped_operand, 16)
+                return None
+            except ValueError:
+                pass
+
+    # Modify the address field (instruction address + 1), 5 half-bytes (20 bits) long
+    return f"M^{line.address + 1:06X}^05"
+
+def external_modifications(line, symbols):
+    """Signed M records adding or subtracting each external symbol in a format 4 or WORD operand"""
+    if line.mnemonic == 'WORD':
+        address, half_bytes = line.address, 6
+    elif line.format == 4 and line.operand:
+        address, half_bytes = line.address + 1, 5
+    else:
+        return []
+    operand = line.operand.split(',')[0].strip()
+    if operand[:1] in ('#', '@'):
+        operand = operand[1:]
+    records = []
+    for symbol, n in external_terms(operand, symbols):
+        sign = '+' if n > 0 else '-'
+        records.extend([f"M^{address:06X}^{half_bytes:02X}^{sign}{symbol}"] * abs(n))
+    return records
+
+def definition_records(info, symbols):
+    """D and R records for the EXTDEF and EXTREF names of a control section"""
+    definitions = [f"{name}^{symbols[name]:06X}" for name in info.definitions if name in symbols]
+    if definitions:
+        yield "D^" + "^".join(definitions)
+    if info.references:
+        yield "R^" + "^".join(info.references)
+
+NO_CODE_DIRECTIVES = frozenset(['START', 'END', 'BASE', 'LTORG', 'EQU', 'ORG', 'CSECT', 'EXTDEF', 'EXTREF'])
+RESERVE_DIRECTIVES = frozenset(['RESW', 'RESB'])
+RUN_RECORDS = 64  # T records packed at a time, so a long run of code is never held as one list
+
+class ObjectImage:
+    """Object program bytes in one bytearray indexed by address - origin"""
+
+    __slots__ = ('origin', 'data')
+
+    def __init__(self, origin=None):
+        self.origin = origin
+        self.data = bytearray()
+
+    def reserve(self, origin, size):
+        """Cover at least [origin, origin + size) with zero bytes"""
+        if self.origin is None:
+            self.origin = origin
+        self.write(origin, bytes(max(size, 0)))
+
+    def clear(self, origin):
+        self.origin = origin
+        self.data.clear()
+
+    def write(self, address, code):
+        """Copy code bytes to address, growing the image as needed"""
+        if self.origin is None:
+            self.origin = address
+        offset = address - self.origin
+        if offset < 0:
+            self.data[0:0] = bytes(-offset)
+            self.origin = address
+            offset = 0
+        elif offset > len(self.data):
+            self.data.extend(bytes(offset - len(self.data)))
+        self.data[offset:offset + len(code)] = code
+
+    def to_bytes(self):
+        return bytes(self.data)
+
+def image_from_records(htme_records):
+    """ObjectImage of a program's bytes: zeros over its H record's length, then each T record's bytes"""
+    image = ObjectImage()
+    for record in htme_records:
+        fields = record.split('^')
+        if fields[0] == 'H':
+            image.reserve(int(fields[2], 16), int(fields[3], 16))
+        elif fields[0] == 'T':
+            try:
+                image.write(int(fields[1], 16), bytes.fromhex(fields[3]))
+            except ValueError:
+                pass  # an ERROR marker has no bytes to load
+    return image
+
+def iter_htme_records(info, encoded, modification_spill=None, symbols=None, image=None):
+    """Yield HTME records from (line, object_code) pairs in a single forward scan.
+
+    info is a ProgramInfo already filled from every line. Each run of
+    contiguous object code is packed into an ObjectImage, and the T records
+    are cut from its bytes, up to 30 at a time. A given image is left
+    holding the whole program; without one, each run is dropped once its
+    records are out. Modification records are held in a list until the T
+    records are done, or written to the modification_spill text file when
+    one is given.
+    With the symbol table, M records are only written for relative operands,
+    EXTDEF/EXTREF names get D and R records, and every external symbol in
+    an operand gets a signed M record naming it.
+    """
+    yield f"H^{info.name}^{info.start:06X}^{info.length():06X}"
+    if symbols is not None:
+        yield from definition_records(info, symbols)
+
+    keep = image is not None
+    if keep:
+        image.reserve(info.start, info.length())
+    else:
+        image = ObjectImage()
+    modification_records = []
+    run_codes = []  # object code of the run of contiguous code being packed
+    spans = []  # (address, length, index of first code) of each finished T record in the run
+    record_address = None
+    record_length = 0
+    record_first = 0
+
+    def text_records():
+        """The run's T records, after copying its bytes into the image"""
+        start = spans[0][0]
+        try:
+            data = bytes.fromhex(''.join(run_codes))
+        except ValueError:
+            data = None  # an ERROR marker or a malformed BYTE operand: keep the text as it is
+        if not keep:
+            image.clear(start)
+        if data is not None:
+            image.write(start, data)
+        records = []
+        for n, (address, length, first) in enumerate(spans):
+            if data is None:
+                last = spans[n + 1][2] if n + 1 < len(spans) else len(run_codes)
+                codes = ''.join(run_codes[first:last])
             else:
-                label, instruction = tokens
-                operand = ""
-        elif len(tokens) == 1:
-            label = ""
-            instruction = tokens[0]
-            operand = ""
-        else:
-            continue  # Skip invalid lines
-        
-        instruction = instruction.upper()
-        
-        # Check for format 4 instructions (starting with +)
-        if instruction.startswith('+'):
-            # Process format 4 instruction for modification records
-            if operand:
-                # Check if it's immediate addressing with a numeric value
-                if operand.startswith('#'):
-                    stripped_operand = operand[1:]  # Remove the # character
-                    
-                    # Check if it's a numeric value
-                    is_numeric = False
-                    if stripped_operand.isdigit() or (stripped_operand.startswith('-') and stripped_operand[1:].isdigit()):
-                        is_numeric = True
-                    elif stripped_operand.startswith('0x') or stripped_operand.startswith('0X'):
-                        try:
-                            int(stripped_operand, 16)
-                            is_numeric = True
-                        except ValueError:
-                            is_numeric = False
-                    
-                    # Only create M record if operand is not numeric
-                    if not is_numeric:
-                        # Calculate address for modification (instruction address + 1)
-                        mod_address = int(lc, 16) + 1
-                        # Standard length for modification is 5 half-bytes (20 bits)
-                        mod_length = "05"
-                        modification_records.append(f"M^{mod_address:06X}^{mod_length}")
+                offset = address - image.origin
+                codes = image.data[offset:offset + length].hex().upper()
+            records.append(f"T^{address:06X}^{length:02X}^{codes}")
+        run_codes.clear()
+        spans.clear()
+        return records
+
+    external = getattr(symbols, 'external', None)
+    for line, obj_code in encoded:
+        mod = modification_record(line, symbols)
+        if mod is not None:
+            if modification_spill is not None:
+                modification_spill.write(mod + "\n")
+            else:
+                modification_records.append(mod)
+        if external:
+            for mod in external_modifications(line, symbols):
+                if modification_spill is not None:
+                    modification_spill.write(mod + "\n")
                 else:
-                    # For non-immediate format 4 instructions, always create M record
-                    mod_address = int(lc, 16) + 1
-                    mod_length = "05"
-                    modification_records.append(f"M^{mod_address:06X}^{mod_length}")
-        
+                    modification_records.append(mod)
+
+        instruction = line.mnemonic
+
         # Skip directives that don't generate code
-        if instruction.upper() in ['START', 'END', 'BASE']:
-            if instruction.upper() == 'END':
-                ending_address = lc
+        if instruction in NO_CODE_DIRECTIVES:
             continue
-        
-        # Skip RESx directives (they create a new text record)
-        if instruction.upper() in ['RESW', 'RESB'] and obj_code == "":
-            if current_text_record["codes"]:
-                # Save current text record
-                text_records.append(current_text_record)
-                # Start a new text record after this RESW/RESB
-                current_text_record = {"address": "", "length": 0, "codes": []}
+
+        # RESW/RESB end the current text record
+        if instruction in RESERVE_DIRECTIVES and obj_code == "":
+            if record_address is not None:
+                spans.append((record_address, record_length, record_first))
+                record_address = None
+                yield from text_records()
             continue
-        
+
         # Skip empty object codes
         if not obj_code:
             continue
-        
-        # If this is the first code or we need to start a new record
-        if not current_text_record["codes"]:
-            current_text_record["address"] = lc
-        
-        # Check if adding this code would exceed maximum text record length (60 bytes)
+
+        # Start a new text record if adding this code would exceed 30 bytes,
+        # and a new run if it doesn't follow on from the last (after an ORG)
         code_length = len(obj_code) // 2  # Convert hex string length to bytes
-        if current_text_record["length"] + code_length > 30:
-            # Save current text record and start a new one
-            text_records.append(current_text_record)
-            current_text_record = {"address": lc, "length": 0, "codes": []}
-        
-        # Add code to current text record
-        current_text_record["codes"].append(obj_code)
-        current_text_record["length"] += code_length
-    
-    # Add the last text record if not empty
-    if current_text_record["codes"]:
-        text_records.append(current_text_record)
-    
-    # Get program length
-    program_length = int(ending_address or location_counter[-1], 16) - int(starting_address, 16)
-    
-    # Generate HTME records
-    htme_records = []
-    
-    # Header record (H)
-    # Convert starting_address from string to int for formatting
-    start_addr_int = int(starting_address, 16)
-    htme_records.append(f"H^{program_name}^{start_addr_int:06X}^{program_length:06X}")
-    
-    # Text records (T)
-    for record in text_records:
-        if record["codes"]:
-            # Convert address to integer and format with 6 hex digits
-            address = int(record["address"], 16)
-            length = record["length"]
-            object_code = ''.join(record["codes"])
-            htme_records.append(f"T^{address:06X}^{length:02X}^{object_code}")
-    
+        if record_address is not None:
+            follows = line.address == record_address + record_length
+            if not follows or record_length + code_length > 30:
+                spans.append((record_address, record_length, record_first))
+                record_address = None
+                if not follows or len(spans) >= RUN_RECORDS:
+                    yield from text_records()
+        if record_address is None:
+            record_address = line.address
+            record_length = 0
+            record_first = len(run_codes)
+        run_codes.append(obj_code)
+        record_length += code_length
+
+    # Add the last text records
+    if record_address is not None:
+        spans.append((record_address, record_length, record_first))
+        yield from text_records()
+
     # Modification records (M)
-    htme_records.extend(modification_records)
-    
-    # End record (E)
-    first_executable = starting_address
-    for i, line in enumerate(intermediate_lines):
-        tokens = line.split()
-        if len(tokens) > 1 and tokens[1].upper() not in ['START', 'BASE', 'RESW', 'RESB', 'BYTE', 'WORD']:
-            first_executable = location_counter[i]
-            break
-    
-    # Convert to integer and format as 6 hex digits
-    first_exec_addr = int(first_executable, 16)
-    htme_records.append(f"E^{first_exec_addr:06X}")
-    
-    # Write HTME records to output file
-    with open('data/HTME.txt', 'w') as f:
-        for record in htme_records:
-            f.write(f"{record}\n")
-            
+    if modification_spill is not None:
+        modification_spill.seek(0)
+        for mod in modification_spill:
+            yield mod.rstrip("\n")
+    else:
+        yield from modification_records
+
+    # End record (E); only the first control section names the entry point
+    if info.section:
+        yield "E"
+        return
+    first_executable = info.start if info.first_executable is None else info.first_executable
+    yield f"E^{first_executable:06X}"
+
+def generate_htme_records(lines, object_codes, report=print, symbols=None, image=None):
+    """Generate HTME records for the SIC/XE program, filling image (an ObjectImage) when one is given"""
+    if not lines or not object_codes:
+        report("Error: Missing data for HTME record generation")
+        return
+
+    info = ProgramInfo()
+    for line in lines:
+        info.update(line)
+    if symbols is not None:
+        for name in info.definitions:
+            if name not in symbols or name in getattr(symbols, 'external', ()):
+                report(f"Warning: External definition '{name}' is not defined in {info.name or 'the program'}")
+
+    return list(iter_htme_records(info, zip(lines, object_codes), symbols=symbols, image=image))
+
 if __name__ == "__main__":
     # Run pass 2
     pass2('intermediate.txt', 'out_pass1.txt', 'symbTable.txt')
\ No newline at end of file
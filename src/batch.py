@@ -0,0 +1,110 @@
+"""
+Batch assembly of many independent source files on a process pool.
+
+Each job gets its own output directory and its own symbol table, so jobs
+share no state and can run on every core at once.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.assembler import Assembler
+from src.cache import AssemblyCache
+from src.streaming import assemble_streaming
+
+
+class JobResult:
+    """Outcome of assembling one source file"""
+
+    def __init__(self, source_file, output_dir, lines, invalid, elapsed, error=None, cached=False):
+        self.source_file = source_file
+        self.output_dir = output_dir
+        self.lines = lines  # parsed source statements
+        self.invalid = invalid  # number of invalid instructions
+        self.elapsed = elapsed
+        self.error = error
+        self.cached = cached  # served from the assembly cache
+
+
+def assemble_job(source_file, output_dir, stream=False, cache_dir=None, cache_bytes=None):
+    """Assemble one file into output_dir; diagnostics go to output_dir/assembler.log"""
+    start = time.perf_counter()
+    context = Assembler()
+    cache = None
+    if cache_dir is not None and not stream:
+        cache = AssemblyCache(cache_dir, cache_bytes) if cache_bytes else AssemblyCache(cache_dir)
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        if stream:
+            _, lines = assemble_streaming(source_file, output_dir, context)
+        else:
+            with open(source_file, 'r', encoding='utf-8') as f:
+                lines = len(context.assemble(f.read(), output_dir=output_dir, cache=cache).lines)
+        error = None
+    except Exception as e:
+        lines, error = 0, str(e)
+
+    if os.path.isdir(output_dir):
+        with open(os.path.join(output_dir, 'assembler.log'), 'w') as f:
+            for message in context.diagnostics:
+                f.write(f"{message}\n")
+    return JobResult(source_file, output_dir, lines, len(context.invalid_instructions),
+                     time.perf_counter() - start, error, cached=bool(cache and cache.hits))
+
+
+def job_output_dirs(source_files, output_root):
+    """Pick one output directory per source file, named after the file"""
+    used = set()
+    dirs = []
+    for path in source_files:
+        name = os.path.splitext(os.path.basename(path))[0] or 'job'
+        candidate, n = name, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{name}_{n}"
+        used.add(candidate)
+        dirs.append(os.path.join(output_root, candidate))
+    return dirs
+
+
+def run_batch(source_files, output_root='out', jobs=None, stream=False, cache_dir=None, cache_bytes=None):
+    """Assemble source_files in parallel and return (job results, wall time)"""
+    start = time.perf_counter()
+    output_dirs = job_output_dirs(source_files, output_root)
+    n = len(source_files)
+
+    if jobs == 1:
+        results = [assemble_job(path, out, stream, cache_dir, cache_bytes)
+                   for path, out in zip(source_files, output_dirs)]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(assemble_job, source_files, output_dirs,
+                                    [stream] * n, [cache_dir] * n, [cache_bytes] * n))
+
+    return results, time.perf_counter() - start
+
+
+def print_report(results, wall_time):
+    """Print per-job status and the aggregate throughput"""
+    total_lines = 0
+    failed = 0
+    for r in results:
+        total_lines += r.lines
+        if r.error:
+            failed += 1
+            status = f"FAILED: {r.error}"
+        elif r.invalid:
+            status = f"{r.invalid} invalid instructions"
+        else:
+            status = "ok"
+        if r.cached:
+            status += ", cached"
+        print(f"{r.source_file}: {r.lines} lines in {r.elapsed:.3f}s -> {r.output_dir} ({status})")
+
+    files_per_sec = len(results) / wall_time if wall_time else 0.0
+    lines_per_sec = total_lines / wall_time if wall_time else 0.0
+    print(f"\n{len(results)} files ({failed} failed), {total_lines} lines in {wall_time:.3f}s")
+    print(f"Throughput: {files_per_sec:.1f} files/sec, {lines_per_sec:.0f} lines/sec")
+    hits = sum(1 for r in results if r.cached)
+    if hits:
+        print(f"Cache: {hits} hits, {len(results) - hits} misses")
@@ -0,0 +1,137 @@
+"""
+Content-addressed on-disk cache of assembly results.
+
+Entries are keyed by a SHA-256 of the source text, the opcode tables in
+src/instructions.py and the assembler version, so editing either the
+program or the instruction set invalidates them. A hit returns the full
+AssemblyResult without running either pass. The cache directory is kept
+under a size cap by evicting the least recently used entries. One cache
+can be shared by threads, as the server's executor does; its counters and
+size are updated under a lock.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from src.assembler import AssemblyResult, ASSEMBLER_VERSION
+from src.instructions import op_codes, instruction_size, registers
+
+
+def opcode_table_fingerprint():
+    """Hash of the instruction tables the assembler output depends on"""
+    tables = json.dumps([op_codes, instruction_size, registers], sort_keys=True)
+    return hashlib.sha256(tables.encode('utf-8')).hexdigest()
+
+
+OPCODE_FINGERPRINT = opcode_table_fingerprint()
+
+
+class AssemblyCache:
+    """LRU-evicted directory of JSON-encoded AssemblyResults"""
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = None  # total bytes on disk, measured on first put
+        self.lock = threading.Lock()  # guards the counters and size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, options=''):
+        """Hash of the source, the assembler version and opcode tables, and any options that change the output"""
+        if not isinstance(source, str):
+            source = '\n'.join(line.rstrip('\n') for line in source)
+        digest = hashlib.sha256()
+        digest.update(ASSEMBLER_VERSION.encode('utf-8') + b'\0')
+        digest.update(OPCODE_FINGERPRINT.encode('utf-8') + b'\0')
+        if options:
+            digest.update(options.encode('utf-8') + b'\0')
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, source, key=None):
+        """Return the cached AssemblyResult for source, or None on a miss"""
+        path = self._path(key or self.key(source))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return AssemblyResult.from_dict(data)
+
+    def put(self, source, result, key=None):
+        """Store result for source, evicting old entries if over the size cap"""
+        path = self._path(key or self.key(source))
+        data = json.dumps(result.to_dict()).encode('utf-8')
+        # Write to a temporary file and rename, so concurrent readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            try:
+                replaced = os.path.getsize(path)  # an entry being overwritten no longer counts
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self.size is None:
+                self.size = sum(size for _, _, size in self._entries())
+            else:
+                self.size += len(data) - replaced
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """Yield (path, mtime, size) for every cache entry"""
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, st.st_mtime, st.st_size
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits under max_bytes"""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self.size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            hits, misses, evictions, size = self.hits, self.misses, self.evictions, self.size
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': evictions,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'bytes': size,
+        }
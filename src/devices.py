@@ -0,0 +1,186 @@
+"""
+Devices for the emulator's TD, RD and WD instructions.
+
+A machine maps device numbers to Device objects. MemoryDevice keeps its
+input and output in memory; StreamDevice moves bytes to and from a file or
+pipe in large blocks, so a program doing byte-at-a-time RD/WD makes one
+system call per buffer rather than one per byte. Output is flushed when
+the buffer fills, when the program halts, or on flush().
+
+Every device counts the bytes it moved, the transfers to its file and the
+time spent in them.
+"""
+import struct
+import sys
+import time
+
+BUFFER_SIZE = 64 * 1024
+
+
+class Device:
+    """Base device: always ready, reads zeros, discards writes, keeps statistics"""
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.transfers = 0  # reads from or writes to the underlying file
+        self.seconds = 0.0  # time spent in those transfers
+
+    def test(self):
+        return True
+
+    def read(self):
+        self.bytes_read += 1
+        return 0
+
+    def write(self, byte):
+        self.bytes_written += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return {'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'transfers': self.transfers, 'seconds': self.seconds}
+
+
+class MemoryDevice(Device):
+    """In-memory device: reads come from input (zeros once it runs out), writes collect in output"""
+
+    def __init__(self, input=b''):
+        super().__init__()
+        self.input = bytes(input)
+        self.position = 0
+        self.output = bytearray()
+
+    def read(self):
+        position = self.position
+        if position >= len(self.input):
+            return 0
+        self.position = position + 1
+        self.bytes_read += 1
+        return self.input[position]
+
+    def write(self, byte):
+        self.output.append(byte)
+        self.bytes_written += 1
+
+    def get_state(self):
+        """Unread input and unflushed output as bytes, for machine snapshots"""
+        return struct.pack('<II', self.position, len(self.input)) + self.input + self.output
+
+    def set_state(self, data):
+        self.position, input_length = struct.unpack_from('<II', data)
+        self.input = bytes(data[8:8 + input_length])
+        self.output = bytearray(data[8 + input_length:])
+
+
+class StreamDevice(MemoryDevice):
+    """Device reading from and/or writing to binary file objects through block-sized buffers.
+
+    A snapshot holds the buffered input and flushes the output first; the
+    position of the file itself is not part of it.
+    """
+
+    def __init__(self, reader=None, writer=None, buffer_size=BUFFER_SIZE, owns_files=False):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+        self.buffer_size = buffer_size
+        self.owns_files = owns_files
+        self.at_eof = reader is None
+
+    def fill(self):
+        """Read the next block of input; return False at end of input"""
+        if self.at_eof:
+            return False
+        read = getattr(self.reader, 'read1', self.reader.read)  # don't wait for a full block on pipes
+        start = time.perf_counter()
+        block = read(self.buffer_size)
+        self.seconds += time.perf_counter() - start
+        self.transfers += 1
+        if not block:
+            self.at_eof = True
+            return False
+        self.input = block
+        self.position = 0
+        return True
+
+    def read(self):
+        position = self.position
+        if position >= len(self.input):
+            if not self.fill():
+                return 0
+            position = 0
+        self.position = position + 1
+        self.bytes_read += 1
+        return self.input[position]
+
+    def write(self, byte):
+        output = self.output
+        output.append(byte)
+        self.bytes_written += 1
+        if len(output) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.output or self.writer is None:
+            return
+        start = time.perf_counter()
+        self.writer.write(self.output)
+        self.writer.flush()
+        self.seconds += time.perf_counter() - start
+        self.transfers += 1
+        self.output.clear()
+
+    def close(self):
+        self.flush()
+        if self.owns_files:
+            for f in (self.reader, self.writer):
+                if f is not None:
+                    f.close()
+
+    def get_state(self):
+        self.flush()
+        return super().get_state()
+
+
+def open_device(spec, buffer_size=BUFFER_SIZE):
+    """Device for a command line spec: 'mem', '<FILE' to read, '>FILE' or FILE to write, '-' for stdin/stdout"""
+    if spec == 'mem':
+        return MemoryDevice()
+    if spec.startswith('<'):
+        path = spec[1:]
+        if path == '-':
+            return StreamDevice(reader=sys.stdin.buffer, buffer_size=buffer_size)
+        return StreamDevice(reader=open(path, 'rb'), buffer_size=buffer_size, owns_files=True)
+    path = spec[1:] if spec.startswith('>') else spec
+    if path == '-':
+        return StreamDevice(writer=sys.stdout.buffer, buffer_size=buffer_size)
+    return StreamDevice(writer=open(path, 'wb'), buffer_size=buffer_size, owns_files=True)
+
+
+def parse_device_arguments(specs):
+    """Map 'NN=SPEC' strings (NN in hex) to devices"""
+    devices = {}
+    for spec in specs:
+        number, sep, target = spec.partition('=')
+        if not sep:
+            raise ValueError(f"Device '{spec}' should look like NN=FILE")
+        devices[int(number, 16)] = open_device(target)
+    return devices
+
+
+def close_devices(devices):
+    for device in devices.values():
+        device.close()
+
+
+def print_device_report(devices):
+    for number, device in sorted(devices.items()):
+        s = device.stats()
+        print(f"Device {number:02X}: {s['bytes_read']} bytes read, {s['bytes_written']} bytes written, "
+              f"{s['transfers']} transfers in {s['seconds'] * 1000:.2f} ms")
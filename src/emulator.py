@@ -0,0 +1,606 @@
+"""
+SIC/XE emulator for the object programs written to HTME.txt.
+
+The loader (src/loader.py) places an object program in a 1 MiB memory
+image (a bytearray, or an mmap from src/memory.py); Machine then runs the fetch-decode-execute loop over formats 1, 2,
+3 and 4 (with n/i/x/b/p/e addressing) and the 4L literal instructions.
+Decoding an instruction is a separate step from executing it, and every
+memory write goes through Machine.write(), so decoded instructions can be
+reused as long as nobody writes over them.
+
+A run stops when control returns to HALT_ADDRESS (the initial L register,
+so a top-level RSUB ends the program), when an instruction jumps to itself
+(the usual "J *" halt), on SVC, or when the step budget runs out.
+"""
+import math
+import time
+
+from src.instructions import mnemonic_table, registers, FORMAT_4L
+from src.loader import as_programs, link
+from src.memory import new_memory, MEMORY_SIZE
+
+ADDRESS_MASK = MEMORY_SIZE - 1
+WORD_MASK = 0xFFFFFF
+HALT_ADDRESS = WORD_MASK  # outside memory, so no instruction lives there
+
+A, X, L, B, S, T, F = (registers[name] for name in ('A', 'X', 'L', 'B', 'S', 'T', 'F'))
+
+# n/i addressing modes
+SIC, IMMEDIATE, INDIRECT, SIMPLE = 0, 1, 2, 3
+
+
+class MachineError(Exception):
+    """An object program did something the machine cannot execute"""
+
+
+def signed(value):
+    """Interpret a 24-bit word as a signed integer"""
+    return value - 0x1000000 if value & 0x800000 else value
+
+
+def compare(a, b):
+    return (a > b) - (a < b)
+
+
+def float_from_bits(bits):
+    """Value of a 48-bit SIC/XE float: sign, 11-bit exponent (excess 1024), 36-bit fraction"""
+    fraction = bits & 0xFFFFFFFFF
+    if not fraction:
+        return 0.0
+    value = math.ldexp(fraction, ((bits >> 36) & 0x7FF) - 1024 - 36)
+    return -value if bits >> 47 else value
+
+
+def float_to_bits(value):
+    """Encode value as a 48-bit SIC/XE float"""
+    if not value:
+        return 0
+    mantissa, exponent = math.frexp(abs(value))  # 0.5 <= mantissa < 1
+    fraction = int(mantissa * (1 << 36)) & 0xFFFFFFFFF
+    exponent = min(max(exponent + 1024, 0), 0x7FF)
+    return ((value < 0) << 47) | (exponent << 36) | fraction
+
+
+class Instruction:
+    """One decoded instruction.
+
+    For formats 3 and 4, target is the part of the target address known at
+    decode time (the absolute PC-relative target, or the displacement or
+    address); base and indexed say whether B and X are added when it runs.
+    """
+
+    __slots__ = ('address', 'size', 'name', 'format', 'operation', 'mode', 'target', 'base', 'indexed',
+                 'r1', 'r2')
+
+    def __init__(self, address, size, name, format, operation):
+        self.address = address
+        self.size = size
+        self.name = name
+        self.format = format
+        self.operation = operation
+        self.mode = SIMPLE
+        self.target = 0
+        self.base = False
+        self.indexed = False
+        self.r1 = 0
+        self.r2 = 0
+
+    def __repr__(self):
+        return f"Instruction({self.address:06X}, {self.name}, format {self.format})"
+
+
+# Opcode byte -> Mnemonic. Formats 1, 2 and 4L use the whole byte; formats
+# 3 and 4 keep the n and i flags in its low two bits.
+byte_opcodes = {}
+opcodes_34 = {}
+for _entry in mnemonic_table.values():
+    if _entry.opcode is None or _entry.name.startswith('+'):
+        continue
+    if _entry.format in (1, 2, FORMAT_4L):
+        byte_opcodes[_entry.opcode] = _entry
+    else:
+        opcodes_34[_entry.opcode] = _entry
+
+
+def decode(memory, address):
+    """Decode the instruction at address"""
+    try:
+        byte = memory[address]
+    except IndexError:
+        raise MachineError(f"Instruction fetch outside memory at {address:06X}") from None
+    entry = byte_opcodes.get(byte)
+    if entry is not None:
+        fmt = entry.format
+        if fmt == 1:
+            return Instruction(address, 1, entry.name, 1, operations[entry.name])
+        if fmt == 2:
+            inst = Instruction(address, 2, entry.name, 2, operations[entry.name])
+            regs = memory[address + 1]
+            inst.r1, inst.r2 = regs >> 4, regs & 0xF
+            return inst
+        # 4L: register nibble, a zero nibble, then a 16-bit literal
+        inst = Instruction(address, 4, entry.name, FORMAT_4L, operations[entry.name])
+        inst.r1 = memory[address + 1] >> 4
+        inst.target = (memory[address + 2] << 8) | memory[address + 3]
+        return inst
+
+    entry = opcodes_34.get(byte & 0xFC)
+    if entry is None:
+        raise MachineError(f"Invalid opcode {byte:02X} at {address:06X}")
+    flags = memory[address + 1]
+    mode = byte & 3
+    if mode == SIC:
+        # Standard SIC instruction: x flag and a 15-bit address
+        inst = Instruction(address, 3, entry.name, 3, operations[entry.name])
+        inst.mode = SIMPLE
+        inst.indexed = bool(flags & 0x80)
+        inst.target = ((flags & 0x7F) << 8) | memory[address + 2]
+        return inst
+
+    if flags & 0x10:  # e: format 4, 20-bit address
+        inst = Instruction(address, 4, entry.name, 4, operations[entry.name])
+        inst.target = ((flags & 0xF) << 16) | (memory[address + 2] << 8) | memory[address + 3]
+    else:
+        inst = Instruction(address, 3, entry.name, 3, operations[entry.name])
+        disp = ((flags & 0xF) << 8) | memory[address + 2]
+        if flags & 0x20:  # p: PC-relative, signed displacement
+            if disp & 0x800:
+                disp -= 0x1000
+            disp += address + 3
+        elif flags & 0x40:  # b: base-relative
+            inst.base = True
+        inst.target = disp
+    inst.mode = mode
+    inst.indexed = bool(flags & 0x80)
+    return inst
+
+
+class Machine:
+    """SIC/XE registers, condition code, memory and devices"""
+
+    def __init__(self, memory=None, devices=None):
+        self.memory = new_memory() if memory is None else memory  # bytearray or mmap
+        self.devices = {} if devices is None else devices  # device number -> src.devices.Device
+        self.regs = [0] * 10  # A X L B S T, F (unused, see self.f), -, PC, SW as in instructions.registers
+        self.f = 0.0  # F register
+        self.cc = 0  # condition code: -1 '<', 0 '=', 1 '>'
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+        self.regs[L] = HALT_ADDRESS
+
+    def load(self, program, load_address=None):
+        """Load an ObjectProgram, HTME record lines or an HTME file path and point PC at its entry.
+
+        Several control sections (or a list of ObjectPrograms) are linked one
+        after another; the loaded sections are returned.
+        """
+        programs = as_programs(program)
+        self.pc = link(programs, self.memory, load_address)[0]
+        self.halted = False
+        return programs
+
+    # Memory access. All writes go through write() so subclasses can track them.
+
+    def write(self, address, data):
+        if address + len(data) > MEMORY_SIZE:
+            raise MachineError(f"Write outside memory at {address:06X}")
+        self.memory[address:address + len(data)] = data
+
+    def read_word(self, address):
+        memory = self.memory
+        return (memory[address] << 16) | (memory[address + 1] << 8) | memory[address + 2]
+
+    def write_word(self, address, value):
+        self.write(address, (value & WORD_MASK).to_bytes(3, 'big'))
+
+    def read_float(self, address):
+        return float_from_bits(int.from_bytes(self.memory[address:address + 6], 'big'))
+
+    def write_float(self, address, value):
+        self.write(address, float_to_bits(value).to_bytes(6, 'big'))
+
+    def target_address(self, inst):
+        """Target address of a format 3/4 instruction, after base, index and indirection"""
+        ta = inst.target
+        if inst.base:
+            ta += self.regs[B]
+        if inst.indexed:
+            ta += self.regs[X]
+        ta &= ADDRESS_MASK
+        if inst.mode == INDIRECT:
+            ta = self.read_word(ta) & ADDRESS_MASK
+        return ta
+
+    def word_operand(self, ta, mode):
+        return ta if mode == IMMEDIATE else self.read_word(ta)
+
+    def byte_operand(self, ta, mode):
+        return ta & 0xFF if mode == IMMEDIATE else self.memory[ta]
+
+    def device(self, number):
+        device = self.devices.get(number)
+        if device is None:
+            raise MachineError(f"No device {number:02X}")
+        return device
+
+    def step(self):
+        """Decode and execute one instruction"""
+        self.execute(decode(self.memory, self.pc))
+
+    def execute(self, inst):
+        address = inst.address
+        self.pc = address + inst.size
+        fmt = inst.format
+        try:
+            if fmt == 3 or fmt == 4:
+                inst.operation(self, self.target_address(inst), inst.mode)
+            elif fmt == FORMAT_4L:
+                inst.operation(self, inst.r1, inst.target)
+            else:
+                inst.operation(self, inst.r1, inst.r2)
+        except IndexError:
+            raise MachineError(f"Memory access outside memory by {inst.name} at {address:06X}") from None
+        self.steps += 1
+        if self.pc == address or self.pc == HALT_ADDRESS:
+            self.halted = True
+
+    def run(self, max_steps=None):
+        """Run until the program halts or max_steps more instructions have run; return the count"""
+        first = self.steps
+        limit = math.inf if max_steps is None else first + max_steps
+        memory = self.memory
+        execute = self.execute
+        while not self.halted and self.steps < limit:
+            execute(decode(memory, self.pc))
+        if self.halted:
+            self.flush_devices()
+        return self.steps - first
+
+    def flush_devices(self):
+        """Write out any buffered device output"""
+        for device in self.devices.values():
+            device.flush()
+
+    def state(self):
+        """Register values by name, plus PC and CC"""
+        names = {number: name for name, number in registers.items()}
+        state = {names[number]: self.regs[number] for number in (A, X, L, B, S, T)}
+        state.update(F=self.f, PC=self.pc, CC='<=>'[self.cc + 1])
+        return state
+
+
+def resolved(inst):
+    """Operation of a format 3/4 instruction whose target address depends on registers or memory"""
+    operation = inst.operation
+    mode = inst.mode
+
+    def run(m, a, b):
+        operation(m, m.target_address(inst), mode)
+    return run
+
+
+class PredecodingMachine(Machine):
+    """Machine that decodes each instruction address only once.
+
+    icache maps an address to (operation, next PC, a, b), so running a cached
+    instruction is a dict lookup and one call. When the target address is
+    fixed at decode time (no base, index or indirection) it is stored as a.
+    A write over a cached instruction drops its entry, so self-modifying
+    code sees its own changes.
+    """
+
+    def __init__(self, memory=None, devices=None):
+        super().__init__(memory, devices)
+        self.icache = {}
+        self.code_pages = set()  # 256-byte pages holding cached instruction addresses
+        self.decoded = 0  # instructions decoded, including re-decodes after invalidation
+
+    def load(self, program, load_address=None):
+        self.invalidate()
+        return super().load(program, load_address)
+
+    def invalidate(self):
+        """Forget every decoded instruction, e.g. after changing memory directly"""
+        self.icache.clear()
+        self.code_pages.clear()
+
+    def predecode(self, address):
+        return self.cache_instruction(decode(self.memory, address))
+
+    def cache_instruction(self, inst):
+        """Enter a decoded instruction in the icache and return its entry"""
+        address = inst.address
+        fmt = inst.format
+        if fmt == 3 or fmt == 4:
+            if inst.base or inst.indexed or inst.mode == INDIRECT:
+                entry = (resolved(inst), address + inst.size, 0, 0)
+            else:
+                entry = (inst.operation, address + inst.size, inst.target & ADDRESS_MASK, inst.mode)
+        elif fmt == FORMAT_4L:
+            entry = (inst.operation, address + inst.size, inst.r1, inst.target)
+        else:
+            entry = (inst.operation, address + inst.size, inst.r1, inst.r2)
+        self.icache[address] = entry
+        self.code_pages.add(address >> 8)
+        self.decoded += 1
+        return entry
+
+    def write(self, address, data):
+        super().write(address, data)
+        # Any instruction starting up to 3 bytes before the write can overlap it
+        first = address - 3
+        last = address + len(data) - 1
+        pages = self.code_pages
+        if first >> 8 in pages or last >> 8 in pages:
+            icache = self.icache
+            for a in range(first, last + 1):
+                icache.pop(a, None)
+
+    def run(self, max_steps=None):
+        first = steps = self.steps
+        limit = math.inf if max_steps is None else first + max_steps
+        icache = self.icache
+        predecode = self.predecode
+        address = self.pc
+        try:
+            while not self.halted and steps < limit:
+                address = self.pc
+                entry = icache.get(address)
+                if entry is None:
+                    entry = predecode(address)
+                operation, self.pc, a, b = entry
+                operation(self, a, b)
+                steps += 1
+                pc = self.pc
+                if pc == address or pc == HALT_ADDRESS:
+                    self.halted = True
+        except IndexError:
+            raise MachineError(f"Memory access outside memory at {address:06X}") from None
+        finally:
+            self.steps = steps
+        if self.halted:
+            self.flush_devices()
+        return steps - first
+
+
+def run_program(program, max_steps=None, load_address=None, machine=None):
+    """Load and run a program on machine (a new PredecodingMachine by default); return (machine, steps, seconds)"""
+    if machine is None:
+        machine = PredecodingMachine()
+    machine.load(program, load_address)
+    start = time.perf_counter()
+    steps = machine.run(max_steps)
+    return machine, steps, time.perf_counter() - start
+
+
+# Operations, one function per mnemonic. Each takes (machine, a, b):
+#   format 1:     a, b unused
+#   format 2:     a = r1, b = r2
+#   format 3/4:   a = target address, b = n/i addressing mode
+#   format 4L:    a = register, b = 16-bit literal
+
+def arithmetic(apply):
+    def operation(m, ta, mode):
+        m.regs[A] = apply(m.regs[A], m.word_operand(ta, mode)) & WORD_MASK
+    return operation
+
+
+def divide(a, b):
+    a, b = signed(a), signed(b)
+    if b == 0:
+        raise MachineError("Division by zero")
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def load_register(register):
+    def operation(m, ta, mode):
+        m.regs[register] = ta if mode == IMMEDIATE else m.read_word(ta)
+    return operation
+
+
+def store_register(register):
+    def operation(m, ta, mode):
+        m.write_word(ta, m.regs[register])
+    return operation
+
+
+def jump_if(condition):
+    def operation(m, ta, mode):
+        if condition(m.cc):
+            m.pc = ta
+    return operation
+
+
+def op_j(m, ta, mode):
+    m.pc = ta
+
+
+def op_comp(m, ta, mode):
+    m.cc = compare(signed(m.regs[A]), signed(m.word_operand(ta, mode)))
+
+
+def op_tix(m, ta, mode):
+    x = m.regs[X] = (m.regs[X] + 1) & WORD_MASK
+    m.cc = compare(signed(x), signed(m.word_operand(ta, mode)))
+
+
+def op_ldch(m, ta, mode):
+    m.regs[A] = (m.regs[A] & 0xFFFF00) | m.byte_operand(ta, mode)
+
+
+def op_stch(m, ta, mode):
+    m.write(ta, bytes((m.regs[A] & 0xFF,)))
+
+
+def op_jsub(m, ta, mode):
+    m.regs[L] = m.pc
+    m.pc = ta
+
+
+def op_rsub(m, ta, mode):
+    m.pc = m.regs[L]
+
+
+def op_td(m, ta, mode):
+    device = m.devices.get(m.byte_operand(ta, mode))
+    m.cc = -1 if device is not None and device.test() else 0  # '<' means ready
+
+
+def op_rd(m, ta, mode):
+    device = m.device(m.byte_operand(ta, mode))
+    m.regs[A] = (m.regs[A] & 0xFFFF00) | device.read()
+
+
+def op_wd(m, ta, mode):
+    device = m.device(m.byte_operand(ta, mode))
+    device.write(m.regs[A] & 0xFF)
+
+
+def float_operand(m, ta, mode):
+    return float(ta) if mode == IMMEDIATE else m.read_float(ta)
+
+
+def float_arithmetic(apply):
+    def operation(m, ta, mode):
+        m.f = apply(m.f, float_operand(m, ta, mode))
+    return operation
+
+
+def float_divide(a, b):
+    if b == 0:
+        raise MachineError("Division by zero")
+    return a / b
+
+
+def op_ldf(m, ta, mode):
+    m.f = float_operand(m, ta, mode)
+
+
+def op_compf(m, ta, mode):
+    m.cc = compare(m.f, float_operand(m, ta, mode))
+
+
+def op_stf(m, ta, mode):
+    m.write_float(ta, m.f)
+
+
+def op_stsw(m, ta, mode):
+    m.write_word(ta, (m.cc + 1) << 6)  # CC in bits 6-7, as in SW
+
+
+def op_nothing(m, a, b):
+    """Privileged and I/O channel instructions have no effect here"""
+
+
+def op_fix(m, a, b):
+    m.regs[A] = int(m.f) & WORD_MASK
+
+
+def op_float(m, a, b):
+    m.f = float(signed(m.regs[A]))
+
+
+def register_operation(apply):
+    """Format 2 r2 <- apply(r2, r1)"""
+    def operation(m, r1, r2):
+        regs = m.regs
+        regs[r2] = apply(regs[r2], regs[r1]) & WORD_MASK
+    return operation
+
+
+def op_addr(m, r1, r2):
+    regs = m.regs
+    regs[r2] = (regs[r2] + regs[r1]) & WORD_MASK
+
+
+def op_compr(m, r1, r2):
+    m.cc = compare(signed(m.regs[r1]), signed(m.regs[r2]))
+
+
+def op_clear(m, r1, r2):
+    m.regs[r1] = 0
+
+
+def op_rmo(m, r1, r2):
+    m.regs[r2] = m.regs[r1]
+
+
+def op_shiftl(m, r1, r2):
+    n = (r2 + 1) % 24  # r2 holds n - 1; bits leaving on the left come back on the right
+    value = m.regs[r1]
+    m.regs[r1] = ((value << n) | (value >> (24 - n))) & WORD_MASK
+
+
+def op_shiftr(m, r1, r2):
+    m.regs[r1] = (signed(m.regs[r1]) >> (r2 + 1)) & WORD_MASK
+
+
+def op_tixr(m, r1, r2):
+    regs = m.regs
+    x = regs[X] = (regs[X] + 1) & WORD_MASK
+    m.cc = compare(signed(x), signed(regs[r1]))
+
+
+def op_svc(m, a, b):
+    m.halted = True
+
+
+def literal_operation(apply):
+    """4L: register <- apply(register, 16-bit literal)"""
+    def operation(m, register, value):
+        m.regs[register] = apply(m.regs[register], value) & WORD_MASK
+    return operation
+
+
+def op_litcmp(m, register, value):
+    m.cc = compare(signed(m.regs[register]), value)
+
+
+operations = {
+    # Format 1
+    'FIX': op_fix, 'FLOAT': op_float, 'NORM': op_nothing,
+    'HIO': op_nothing, 'SIO': op_nothing, 'TIO': op_nothing,
+
+    # Format 2
+    'ADDR': op_addr,
+    'SUBR': register_operation(lambda r2, r1: r2 - r1),
+    'MULR': register_operation(lambda r2, r1: signed(r2) * signed(r1)),
+    'DIVR': register_operation(lambda r2, r1: divide(r2, r1)),
+    'COMPR': op_compr, 'CLEAR': op_clear, 'RMO': op_rmo,
+    'SHIFTL': op_shiftl, 'SHIFTR': op_shiftr, 'TIXR': op_tixr, 'SVC': op_svc,
+
+    # Format 3/4
+    'ADD': arithmetic(lambda a, v: a + v),
+    'SUB': arithmetic(lambda a, v: a - v),
+    'MUL': arithmetic(lambda a, v: signed(a) * signed(v)),
+    'DIV': arithmetic(divide),
+    'AND': arithmetic(lambda a, v: a & v),
+    'OR': arithmetic(lambda a, v: a | v),
+    'COMP': op_comp, 'TIX': op_tix,
+    'LDA': load_register(A), 'LDB': load_register(B), 'LDL': load_register(L),
+    'LDS': load_register(S), 'LDT': load_register(T), 'LDX': load_register(X),
+    'LDCH': op_ldch,
+    'STA': store_register(A), 'STB': store_register(B), 'STL': store_register(L),
+    'STS': store_register(S), 'STT': store_register(T), 'STX': store_register(X),
+    'STCH': op_stch, 'STSW': op_stsw,
+    'J': op_j,
+    'JEQ': jump_if(lambda cc: cc == 0),
+    'JGT': jump_if(lambda cc: cc > 0),
+    'JLT': jump_if(lambda cc: cc < 0),
+    'JSUB': op_jsub, 'RSUB': op_rsub,
+    'TD': op_td, 'RD': op_rd, 'WD': op_wd,
+    'LDF': op_ldf, 'STF': op_stf, 'COMPF': op_compf,
+    'ADDF': float_arithmetic(lambda a, b: a + b),
+    'SUBF': float_arithmetic(lambda a, b: a - b),
+    'MULF': float_arithmetic(lambda a, b: a * b),
+    'DIVF': float_arithmetic(float_divide),
+    'LPS': op_nothing, 'SSK': op_nothing, 'STI': op_nothing,
+
+    # Format 4L
+    'LITLD': literal_operation(lambda r, v: v),
+    'LITAD': literal_operation(lambda r, v: r + v),
+    'LITSB': literal_operation(lambda r, v: r - v),
+    'LITCMP': op_litcmp,
+}
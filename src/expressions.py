@@ -0,0 +1,211 @@
+"""
+Operand expressions: symbols, decimal numbers and * (the location counter)
+joined by + - * / and parentheses, such as BUFEND-BUFFER or TABLE+3*SIZE.
+
+Each distinct expression string is parsed once into a Python function,
+cached by its text, and that function is re-run against the symbol table
+every time the expression is used. The value of an expression is relative
+(an address that moves when the program is relocated) when its relative
+terms add up to one, as in BUFFER+3, and absolute when they cancel out, as
+in BUFEND-BUFFER. Anything else, or a relative term inside * or /, is an
+error. External symbols (EXTREF) count as 0 here and are left out of that
+tally; the linking loader adds or subtracts them through signed M records.
+"""
+import re
+
+CACHE_LIMIT = 100_000  # compiled expressions kept before the cache starts over
+
+TOKEN = re.compile(r"\s*(?:(\d+)|([A-Za-z_][A-Za-z0-9_]*)|(\S))")
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+class SymbolTable(dict):
+    """Symbol name -> value, remembering which symbols are absolute (EQU of an absolute expression)
+    and which are external (EXTREF names, valued 0 until the linking loader fills them in)"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.absolute = set()
+        self.external = set()
+
+    def copy(self):
+        table = SymbolTable(self)
+        table.absolute = set(self.absolute)
+        table.external = set(self.external)
+        return table
+
+
+def divide(a, b):
+    """Integer division truncating toward zero"""
+    quotient = abs(a) // abs(b)
+    return -quotient if (a < 0) != (b < 0) else quotient
+
+
+class Expression:
+    """A compiled expression.
+
+    terms maps each symbol added or subtracted at the top level (through
+    parentheses) to its net coefficient, location is the coefficient of *,
+    and scaled holds the symbols used inside a multiplication or division.
+    """
+
+    __slots__ = ('text', 'function', 'terms', 'location', 'scaled')
+
+    def __init__(self, text, function, terms, location, scaled):
+        self.text = text
+        self.function = function  # function(symbols, loc) -> value
+        self.terms = terms
+        self.location = location
+        self.scaled = scaled
+
+    def evaluate(self, symbols, loc=0):
+        try:
+            return self.function(symbols, loc)
+        except KeyError as e:
+            raise ExpressionError(f"Undefined symbol '{e.args[0]}' in '{self.text}'") from None
+        except ZeroDivisionError:
+            raise ExpressionError(f"Division by zero in '{self.text}'") from None
+
+    def is_relative(self, symbols):
+        """Whether the value moves with this control section; external terms are left to the loader"""
+        absolute = getattr(symbols, 'absolute', ())
+        external = getattr(symbols, 'external', ())
+        if any(symbol not in absolute for symbol in self.scaled):
+            raise ExpressionError(f"Relative term multiplied or divided in '{self.text}'")
+        count = self.location + sum(n for symbol, n in self.terms.items()
+                                    if symbol not in absolute and symbol not in external)
+        if count not in (0, 1):
+            raise ExpressionError(f"'{self.text}' is neither absolute nor relative")
+        return count == 1
+
+
+class Parser:
+    """Recursive descent parser producing (code, terms, location, scaled) for each node"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        for number, name, other in TOKEN.findall(text):
+            self.tokens.append(('number', number) if number else ('name', name) if name else ('op', other))
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def error(self, message):
+        return ExpressionError(f"{message} in '{self.text}'")
+
+    def parse(self):
+        if not self.tokens:
+            raise self.error("Empty expression")
+        code, terms, location, scaled = self.expression()
+        if self.position != len(self.tokens):
+            raise self.error(f"Unexpected '{self.peek()[1]}'")
+        function = eval(f"lambda s, loc: {code}", {'divide': divide})
+        return Expression(self.text, function, terms, location, frozenset(scaled))
+
+    def expression(self):
+        code, terms, location, scaled = self.term()
+        terms = dict(terms)
+        while self.peek() in (('op', '+'), ('op', '-')):
+            sign = 1 if self.take()[1] == '+' else -1
+            right_code, right_terms, right_location, right_scaled = self.term()
+            code = f"({code} {'+' if sign > 0 else '-'} {right_code})"
+            for symbol, n in right_terms.items():
+                terms[symbol] = terms.get(symbol, 0) + sign * n
+            location += sign * right_location
+            scaled = scaled | right_scaled
+        return code, terms, location, scaled
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            operator = self.take()[1]
+            right = self.factor()
+            code = f"({node[0]} * {right[0]})" if operator == '*' else f"divide({node[0]}, {right[0]})"
+            # Everything under * or / must be absolute; '*' (the location) never is
+            scaled = node[3] | right[3] | set(node[1]) | set(right[1])
+            if node[2] or right[2]:
+                scaled.add('*')
+            node = (code, {}, 0, scaled)
+        return node
+
+    def factor(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return str(int(value)), {}, 0, set()  # 010 is ten, but not valid Python
+        if kind == 'name':
+            return f"s[{value!r}]", {value: 1}, 0, set()
+        if value == '*':
+            return "loc", {}, 1, set()
+        if value in ('-', '+'):
+            code, terms, location, scaled = self.factor()
+            if value == '+':
+                return code, terms, location, scaled
+            return f"(-{code})", {symbol: -n for symbol, n in terms.items()}, -location, scaled
+        if value == '(':
+            node = self.expression()
+            if self.take() != ('op', ')'):
+                raise self.error("Missing ')'")
+            return node
+        raise self.error("Expected a symbol, number or *" if value is None else f"Unexpected '{value}'")
+
+
+compiled = {}  # expression text -> Expression, or the ExpressionError it raised
+
+
+def compile_expression(text):
+    """Return the compiled Expression for text, parsing it only the first time"""
+    expression = compiled.get(text)
+    if expression is None:
+        if len(compiled) >= CACHE_LIMIT:
+            compiled.clear()
+        try:
+            expression = Parser(text).parse()
+        except ExpressionError as e:
+            expression = e
+        except SyntaxError:  # generated code Python rejects; the source line gets an error, not a traceback
+            expression = ExpressionError(f"Invalid expression '{text}'")
+        compiled[text] = expression
+    if isinstance(expression, ExpressionError):
+        raise ExpressionError(str(expression))
+    return expression
+
+
+def evaluate(text, symbols, loc=0):
+    """Return (value, is_relative) for an expression, raising ExpressionError if it has no value"""
+    expression = compile_expression(text)
+    value = expression.evaluate(symbols, loc)
+    return value, expression.is_relative(symbols)
+
+
+def external_terms(text, symbols):
+    """(symbol, coefficient) of each external symbol an expression adds or subtracts"""
+    external = getattr(symbols, 'external', None)
+    if not external:
+        return []
+    try:
+        terms = compile_expression(text).terms
+    except ExpressionError:
+        return []
+    return [(symbol, n) for symbol, n in terms.items() if n and symbol in external]
+
+
+def absolute_value(text, symbols=None, loc=0):
+    """Value of an expression that must be absolute, such as a RESW count"""
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    value, relative = evaluate(text, {} if symbols is None else symbols, loc)
+    if relative:
+        raise ExpressionError(f"'{text}' must be absolute")
+    return value
@@ -0,0 +1,314 @@
+"""
+Incremental re-assembly for editors such as the GUI.
+
+IncrementalAssembler keeps the previous parse, addresses, symbol table and
+object codes. After an edit it:
+
+  * keeps every line before the first changed source line as it was,
+  * re-parses only the changed block,
+  * shifts the addresses of the unchanged lines after the block, and
+  * re-encodes an instruction only if its own text changed, or if the
+    symbol it references moved relative to its PC or base displacement.
+
+An instruction that moved together with its PC-relative target keeps its
+object code. HTME records are rebuilt from the updated object codes.
+Instructions with expression operands are always re-encoded. Programs with
+literals, EQU, ORG, EXTDEF/EXTREF or computed RESW/RESB sizes are
+re-assembled in full, since an edit anywhere can move the pools or symbols
+defined further down, and programs with control sections are handed to a
+plain Assembler, which assembles each section separately.
+"""
+from bisect import bisect_right
+
+from src.assembler import Assembler, AssemblyResult
+from src.assembler_pass1 import parse_lines, literal_symbols
+from src.assembler_pass2 import encode_line, format_listing_line, generate_htme_records
+from src.expressions import SymbolTable
+from src.instructions import instruction_size
+from src.profiling import track
+
+EXPRESSION = '<expression>'  # refs entry of a line whose operand is an expression of several symbols
+
+
+def referenced_symbol(line):
+    """Return the symbol a format 3/4 or WORD operand refers to, EXPRESSION, or None"""
+    if line.mnemonic == 'WORD':
+        operand = line.operand.lstrip('-')
+        return None if not operand or operand.isdigit() else EXPRESSION
+    if line.format not in (3, 4) or not line.operand:
+        return None
+    operand = line.operand.split(',')[0].strip()
+    if operand[:1] in ('#', '@'):
+        operand = operand[1:]
+    if not operand or operand.isdigit():
+        return None
+    if not operand.isidentifier() and operand[0] != '=':
+        return EXPRESSION
+    return operand
+
+
+def needs_whole_program(line):
+    """Whether a line can change addresses or symbols past itself in ways shifting can't follow"""
+    if line.mnemonic in ('EQU', 'ORG', 'EXTDEF', 'EXTREF', 'CSECT'):
+        return True
+    return line.mnemonic in ('RESW', 'RESB') and not line.operand.isdigit()
+
+
+def defines_symbol(line):
+    return line.label and line.label != '*' and line.label.upper() not in instruction_size
+
+
+class IncrementalAssembler:
+    """Re-assembles a changing source, redoing only the work an edit affects.
+
+    The AssemblyResult returned by update() shares its lists and SourceLine
+    records with the engine, so it is only valid until the next update().
+    An update stopped part way, e.g. by a progress callable raising
+    Cancelled, leaves the engine half updated; start a new one after it.
+    """
+
+    def __init__(self, progress=None):
+        self.progress = progress  # callable(phase, lines done, total), as on Assembler
+        self.source = []  # raw source lines
+        self.lines = []  # SourceLine records
+        self.refs = []  # referenced symbol per record
+        self.object_codes = []
+        self.listing_lines = []
+        self.warnings = []  # pass 2 messages per record, None when there are none
+        self.symbol_table = SymbolTable()
+        self.literal_refs = {}  # as on Assembler
+        self.literal_addresses = {}
+        self.symbol_lines = {}  # symbol -> source line number that defined it
+        self.duplicates = []  # (line number, label) of duplicate definitions
+        self.invalid_instructions = []
+        self.line_errors = []  # as on Assembler
+        self.reencoded = 0  # records re-encoded by the last update
+        self.late_start = False  # a START after the first statement (it can redefine symbols)
+        self.whole_program = False  # literals, EQU, ORG or computed sizes: every edit redoes everything
+        self.sections_result = None  # AssemblyResult of a program with control sections
+
+    def update(self, source):
+        """Re-assemble after the source changed and return an AssemblyResult"""
+        new_source = source.splitlines() if isinstance(source, str) else list(source)
+        old_source = self.source
+
+        # Unchanged prefix and suffix of the raw source
+        limit = min(len(old_source), len(new_source))
+        prefix = 0
+        while prefix < limit and old_source[prefix] == new_source[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old_source[-1 - suffix] == new_source[-1 - suffix]:
+            suffix += 1
+        old_end = len(old_source) - suffix
+        new_end = len(new_source) - suffix
+        line_shift = new_end - old_end
+
+        if prefix == len(old_source) == len(new_source) and (self.lines or self.sections_result):
+            return self.result()
+        if self.late_start or self.whole_program:
+            return self.rebuild(new_source)
+
+        # Split the records into kept prefix, replaced block and shifted suffix
+        first = bisect_right(self.lines, prefix, key=lambda line: line.line_number)
+        last = bisect_right(self.lines, old_end, key=lambda line: line.line_number)
+        old_lines = self.lines
+        old_symbols = self.symbol_table
+        old_block = old_lines[first:last]
+        suffix_lines = old_lines[last:]
+
+        # Symbols defined before the edit stay; later ones are redefined below
+        symbol_table = SymbolTable()
+        symbol_lines = {}
+        for symbol, line_number in self.symbol_lines.items():
+            if line_number > prefix:
+                continue
+            symbol_table[symbol] = old_symbols[symbol]
+            symbol_lines[symbol] = line_number
+        duplicates = [d for d in self.duplicates if d[0] <= prefix]
+
+        # Re-parse the changed block from the location counter at its start
+        context = Assembler(progress=self.progress)
+        context.symbol_table = symbol_table
+        if first:
+            context.location_counter = old_lines[first - 1].address + old_lines[first - 1].size
+        block = list(parse_lines(new_source[prefix:new_end], context, prefix + 1))
+        if any(line.mnemonic == 'CSECT' for line in block):
+            return self.assemble_sections(new_source)
+        late_start = False
+        whole_program = bool(context.literal_refs)
+        failed = {n for n, _ in context.line_errors}  # an EQU that failed defines nothing
+        for i, line in enumerate(block, first):
+            if needs_whole_program(line):
+                whole_program = True
+            if line.mnemonic == 'EQU' and line.line_number in failed:
+                continue
+            if line.mnemonic == 'START' and i:
+                late_start = True
+            if defines_symbol(line):
+                if line.label not in symbol_lines or line.mnemonic == 'START':
+                    symbol_lines[line.label] = line.line_number
+                else:
+                    duplicates.append((line.line_number, line.label))
+
+        # Shift the unchanged lines after the block
+        loc = context.location_counter
+        address_deltas = []
+        for line in suffix_lines:
+            line.line_number += line_shift
+            if line.mnemonic == 'START':
+                late_start = True
+                address_deltas.append(0)
+                loc = line.address
+            else:
+                address_deltas.append(loc - line.address)
+                line.address = loc
+            loc += line.size
+            if defines_symbol(line):
+                if line.label in symbol_lines and line.mnemonic != 'START':
+                    duplicates.append((line.line_number, line.label))
+                else:
+                    symbol_table[line.label] = line.address
+                    symbol_lines[line.label] = line.line_number
+
+        # A START past the first line resets the location counter and can
+        # overwrite symbols out of order, and literals, EQU and ORG move pools
+        # and symbols further down, so redo the whole program instead
+        if (late_start or whole_program) and old_lines:
+            return self.rebuild(new_source)
+
+        self.late_start = late_start
+        self.whole_program = whole_program
+        # Only EQU, ORG and computed sizes have line errors, and those lines make every update a rebuild
+        self.line_errors = context.line_errors
+        self.invalid_instructions = (
+            [item for item in self.invalid_instructions if item[0] <= prefix]
+            + context.invalid_instructions
+            + [(n + line_shift, text, name) for n, text, name in self.invalid_instructions if n > old_end])
+
+        self.source = new_source
+        self.lines = old_lines[:first] + block + suffix_lines
+        self.refs = self.refs[:first] + [referenced_symbol(line) for line in block] + self.refs[last:]
+        self.symbol_table = symbol_table
+        self.literal_refs = context.literal_refs
+        self.literal_addresses = context.literal_addresses
+        self.symbol_lines = symbol_lines
+        self.duplicates = duplicates
+        self._reencode(first, len(block), old_block, old_symbols, address_deltas)
+        return self.result()
+
+    def assemble_sections(self, source):
+        """Assemble a program with control sections in full and keep only its result"""
+        self.__init__(self.progress)
+        self.source = source
+        self.whole_program = True
+        self.sections_result = Assembler(progress=self.progress).assemble(source)
+        return self.sections_result
+
+    def rebuild(self, source):
+        """Forget the previous state and assemble source from scratch"""
+        self.__init__(self.progress)
+        return self.update(source)
+
+    def _reencode(self, first, block_len, old_block, old_symbols, address_deltas):
+        """Bring object codes and listing lines up to date after the records changed"""
+        n_old_block = len(old_block)
+        self.object_codes[first:first + n_old_block] = [None] * block_len
+        self.listing_lines[first:first + n_old_block] = [None] * block_len
+        self.warnings[first:first + n_old_block] = [None] * block_len
+
+        symbols = literal_symbols(self)
+        literal_addresses = self.literal_addresses
+        lines = self.lines
+        refs = self.refs
+        codes = self.object_codes
+        listing = self.listing_lines
+        warnings = self.warnings
+        block_end = first + block_len
+        new_base = old_base = None
+        reencoded = 0
+
+        for i, line in enumerate(lines if self.progress is None else track(lines, self.progress, 'pass 2')):
+            if i == first:
+                # The old BASE value at the end of the replaced block
+                for old_line in old_block:
+                    if old_line.mnemonic == 'BASE':
+                        old_base = old_symbols.get(old_line.operand, old_base)
+            if line.mnemonic == 'BASE':
+                new_base = symbols.get(line.operand, new_base)
+                if i < first or i >= block_end:
+                    old_base = old_symbols.get(line.operand, old_base)
+
+            delta = address_deltas[i - block_end] if i >= block_end else 0
+            ref = refs[i]
+            if first <= i < block_end or ref is EXPRESSION:
+                stale = True
+            elif ref is None:
+                stale = False
+            elif delta == 0 and old_base == new_base and old_symbols.get(ref) == symbols.get(ref):
+                stale = False
+            else:
+                stale = self._needs_encoding(line, ref, codes[i], delta, old_symbols, old_base, new_base)
+
+            if stale:
+                if line.line_number in literal_addresses:
+                    text, address = literal_addresses[line.line_number]
+                    symbols[text] = address  # the copy in this statement's pool
+                messages = []
+                code = encode_line(line, symbols, new_base, messages.append)
+                codes[i] = code
+                warnings[i] = messages or None
+                listing[i] = format_listing_line(line, code)
+                reencoded += 1
+            elif delta:
+                listing[i] = format_listing_line(line, codes[i])
+
+        self.reencoded = reencoded
+
+    def _needs_encoding(self, line, ref, code, delta, old_symbols, old_base, new_base):
+        """Whether an unchanged line's object code can differ after the edit"""
+        if ref is None:
+            return False
+        old_target = old_symbols.get(ref)
+        new_target = self.symbol_table.get(ref)
+        if old_target is None or new_target is None:
+            return old_target is not new_target
+        target_delta = new_target - old_target
+        if line.format == 4:
+            return target_delta != 0
+        if target_delta == 0 and delta == 0 and old_base == new_base:
+            return False
+        flags = int(code[2], 16) if len(code) == 6 else 0
+        if flags & 2:  # PC-relative: unchanged if the target moved with the instruction
+            return target_delta != delta
+        if flags & 4:  # base-relative: unchanged if neither target nor base moved and PC-relative still misses
+            if target_delta != 0 or old_base != new_base:
+                return True
+            return -2048 <= new_target - (line.address + 3) <= 2047
+        return True
+
+    def diagnostics(self):
+        """Diagnostics in the same order a full assembly reports them"""
+        pass1 = [(n, f"Error at line {n}: Invalid instruction '{name}'")
+                 for n, _, name in self.invalid_instructions]
+        pass1 += [(n, f"Error: Duplicate symbol '{label}'") for n, label in self.duplicates]
+        pass1 += [(n, f"Error at line {n}: {message}") for n, message in self.line_errors]
+        pass1.sort(key=lambda item: item[0])
+        messages = [message for _, message in pass1]
+        if self.invalid_instructions:
+            messages.append(f"\nFound {len(self.invalid_instructions)} invalid instructions:")
+            for n, text, name in self.invalid_instructions:
+                messages.append(f"Line {n}: '{name}' in '{text}'")
+        for line_warnings in self.warnings:
+            if line_warnings:
+                messages.extend(line_warnings)
+        return messages
+
+    def result(self):
+        if self.sections_result is not None:
+            return self.sections_result
+        diagnostics = self.diagnostics()
+        htme_records = generate_htme_records(self.lines, self.object_codes, diagnostics.append,
+                                             self.symbol_table)
+        return AssemblyResult(self.lines, self.symbol_table, self.object_codes, self.listing_lines,
+                              htme_records, self.invalid_instructions, diagnostics)
@@ -47,10 +47,61 @@ instruction_size = {
     'LITCMP': 4,
 
     # Directives
-    'START': 0, 'BASE': 0, 'END': 0,
+    'START': 0, 'BASE': 0, 'END': 0, 'LTORG': 0, 'EQU': 0, 'ORG': 0,
+    'CSECT': 0, 'EXTDEF': 0, 'EXTREF': 0,
     'RESW': 3, 'RESB': 1, 'BYTE': 1, 'WORD': 3
 }
 
 registers = {
     'A': 0, 'X': 1, 'L': 2, 'B': 3, 'S': 4, 'T': 5, 'F': 6
-}
\ No newline at end of file
+}
+
+# Instruction formats, as stored on each parsed source line
+FORMAT_DIRECTIVE = 0
+FORMAT_4L = 5  # LITLD/LITAD/LITSB/LITCMP: register plus an inline literal
+
+format1_instructions = ['FIX', 'FLOAT', 'HIO', 'NORM', 'SIO', 'TIO']
+format2_instructions = ['ADDR', 'CLEAR', 'COMPR', 'DIVR', 'MULR', 'RMO', 'SHIFTL', 'SHIFTR', 'SUBR', 'SVC', 'TIXR']
+format4L_instructions = ['LITLD', 'LITAD', 'LITSB', 'LITCMP']
+
+
+class Mnemonic:
+    """Precomputed table entry for one mnemonic (or directive)"""
+
+    __slots__ = ('name', 'opcode', 'format', 'size', 'encoder')
+
+    def __init__(self, name, opcode, format, size):
+        self.name = name
+        self.opcode = opcode  # integer opcode, None for directives
+        self.format = format
+        self.size = size  # None when the size depends on the operand
+        self.encoder = None  # filled in by assembler_pass2
+
+
+def get_instruction_format(name):
+    """Return the format of a plain (no '+') mnemonic"""
+    if name in format4L_instructions:
+        return FORMAT_4L
+    if name in format1_instructions:
+        return 1
+    if name in format2_instructions:
+        return 2
+    if name in op_codes:
+        return 3
+    return FORMAT_DIRECTIVE
+
+
+def build_mnemonic_table():
+    """Build the mnemonic -> Mnemonic table, including the '+' format 4 forms"""
+    table = {}
+    for name, size in instruction_size.items():
+        opcode = int(op_codes[name], 0) if name in op_codes else None
+        fmt = get_instruction_format(name)
+        if name in ['RESW', 'RESB', 'BYTE']:
+            size = None
+        table[name] = Mnemonic(name, opcode, fmt, size)
+        table['+' + name] = Mnemonic('+' + name, opcode, 4, 4)
+    return table
+
+
+mnemonic_table = build_mnemonic_table()
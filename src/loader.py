@@ -0,0 +1,193 @@
+"""
+Loader for the HTME object programs written by pass 2.
+
+parse_htme() reads H/T/M/E records into an ObjectProgram; load() copies
+its text records into a memory image and applies the M records, relocating
+the program when it is loaded somewhere other than its assembled start. It
+is link() of a single program.
+
+A program split into control sections has one H to E group of records per
+section, with D records for its EXTDEF names, R records for its EXTREF
+names and signed M records ("M^000004^05^+RDREC") adding or subtracting an
+external symbol. parse_programs() yields the sections one at a time and
+link() loads them one after another, in a single pass: each section's name
+and D symbols go into the external symbol table (ESTAB, a dict) as soon as
+the section is reached, and an M record naming a symbol not in ESTAB yet
+waits in a list that is resolved after the last section.
+"""
+
+
+class ObjectProgram:
+    """An object program read from HTME records"""
+
+    def __init__(self, name='', start=0, length=0):
+        self.name = name
+        self.start = start
+        self.length = length
+        self.text = []  # (address, bytes) per T record
+        self.modifications = []  # (address, half-bytes, sign, symbol) per M record
+        self.definitions = {}  # EXTDEF name -> address, from the D records
+        self.references = []  # EXTREF names, from the R records
+        self.entry = None  # execution start from the E record
+
+    def size(self):
+        """Bytes from start to the end of the last text record or the H length"""
+        end = self.start + self.length
+        for address, code in self.text:
+            end = max(end, address + len(code))
+        return end - self.start
+
+
+def parse_programs(records):
+    """Yield an ObjectProgram for each control section in HTME record lines, as each one ends"""
+    program = None
+    for line_num, record in enumerate(records, 1):
+        record = record.strip()
+        if not record:
+            continue
+        fields = record.split('^')
+        kind = fields[0]
+        if kind == 'H' and program is not None:
+            # The previous section had no E record
+            if program.entry is None:
+                program.entry = program.start
+            yield program
+            program = None
+        if program is None:
+            program = ObjectProgram()
+        try:
+            if kind == 'H':
+                program.name = fields[1]
+                program.start = int(fields[2], 16)
+                program.length = int(fields[3], 16)
+            elif kind == 'D':
+                if len(fields) % 2 == 0:
+                    raise ValueError("names and addresses do not pair up")
+                for i in range(1, len(fields), 2):
+                    program.definitions[fields[i]] = int(fields[i + 1], 16)
+            elif kind == 'R':
+                program.references.extend(name for name in fields[1:] if name)
+            elif kind == 'T':
+                code = bytes.fromhex(fields[3])
+                if len(code) != int(fields[2], 16):
+                    raise ValueError("length does not match its object code")
+                program.text.append((int(fields[1], 16), code))
+            elif kind == 'M':
+                sign, symbol = '+', None
+                if len(fields) > 3 and fields[3]:
+                    sign, symbol = fields[3][0], fields[3][1:]
+                program.modifications.append((int(fields[1], 16), int(fields[2], 16), sign, symbol))
+            elif kind == 'E':
+                program.entry = int(fields[1], 16) if len(fields) > 1 and fields[1] else program.start
+            else:
+                raise ValueError(f"unknown record type '{kind}'")
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"Invalid HTME record at line {line_num}: {e}") from None
+        if kind == 'E':
+            yield program
+            program = None
+    if program is not None:
+        if program.entry is None:
+            program.entry = program.start
+        yield program
+
+
+def parse_htme(records):
+    """Build an ObjectProgram from HTME record lines (a file or a list of strings) of one program"""
+    for program in parse_programs(records):
+        return program
+    program = ObjectProgram()
+    program.entry = program.start
+    return program
+
+
+def read_htme(path):
+    """Parse an HTME.txt file"""
+    with open(path, 'r') as f:
+        return parse_htme(f)
+
+
+def read_programs(paths):
+    """Yield the control sections of one or more HTME files, reading each file once"""
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        with open(path, 'r') as f:
+            yield from parse_programs(f)
+
+
+def as_programs(program):
+    """The control sections in an ObjectProgram, an iterable of them, HTME record lines or an HTME file path"""
+    if isinstance(program, str):
+        return list(read_programs(program))
+    if hasattr(program, 'text'):
+        return [program]
+    programs = list(program)
+    if programs and isinstance(programs[0], str):
+        return list(parse_programs(programs))
+    return programs
+
+
+def relocate(memory, address, half_bytes, offset):
+    """Add offset to the field of half_bytes nibbles held in the low bits of the bytes at address"""
+    n_bytes = (half_bytes + 1) // 2
+    mask = (1 << (4 * half_bytes)) - 1
+    value = int.from_bytes(memory[address:address + n_bytes], 'big')
+    value = (value & ~mask) | ((value + offset) & mask)
+    memory[address:address + n_bytes] = value.to_bytes(n_bytes, 'big')
+
+
+def load(program, memory, load_address=None):
+    """Copy one program into memory and return its relocated entry point; link() of just that program"""
+    return link([program], memory, load_address)[0]
+
+
+def define_external(estab, name, address):
+    if name in estab:
+        raise ValueError(f"Duplicate external symbol '{name}'")
+    estab[name] = address
+
+
+def link(programs, memory, load_address=None):
+    """Load control sections one after another and resolve their external references.
+
+    programs is any iterable of ObjectPrograms, such as parse_programs() or
+    read_programs() over several object files, and it is read once. The
+    first section goes to load_address (default: its assembled start) and
+    each later one right after the one before. Returns (entry point, ESTAB).
+    """
+    estab = {}  # section name or EXTDEF symbol -> loaded address
+    pending = []  # (address, half-bytes, sign, symbol) of M records naming symbols not in ESTAB yet
+    entry = None
+    address = load_address
+    for program in programs:
+        if address is None:
+            address = program.start
+        offset = address - program.start
+        if program.name:
+            define_external(estab, program.name, address)
+        for name, value in program.definitions.items():
+            define_external(estab, name, value + offset)
+        for text_address, code in program.text:
+            text_address += offset
+            if text_address < 0 or text_address + len(code) > len(memory):
+                raise ValueError(f"Text record at {text_address:06X} does not fit in memory")
+            memory[text_address:text_address + len(code)] = code
+        for m_address, half_bytes, sign, symbol in program.modifications:
+            m_address += offset
+            if symbol is None:
+                if offset:
+                    relocate(memory, m_address, half_bytes, offset if sign == '+' else -offset)
+            elif symbol in estab:
+                relocate(memory, m_address, half_bytes, estab[symbol] if sign == '+' else -estab[symbol])
+            else:
+                pending.append((m_address, half_bytes, sign, symbol))
+        if entry is None:
+            entry = program.entry + offset
+        address += program.size()
+
+    for m_address, half_bytes, sign, symbol in pending:
+        if symbol not in estab:
+            raise ValueError(f"Undefined external symbol '{symbol}'")
+        relocate(memory, m_address, half_bytes, estab[symbol] if sign == '+' else -estab[symbol])
+    return (0 if entry is None else entry), estab
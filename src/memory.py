@@ -0,0 +1,73 @@
+"""
+Execution memory for the emulator: a bytearray, or an mmap of a file.
+
+A file-backed memory holds the machine's memory in the page cache, so a
+large image can be loaded once and mapped by many worker processes without
+copying. Shared mappings write through to the file, so the file is the
+memory dump when the program ends. Private mappings are copy-on-write, so
+each worker gets its own changes on top of the same image.
+
+    build_image(htme_records, 'prog.mem')        # load once, returns the entry point
+    memory = map_memory('prog.mem', private=True)  # in each worker
+"""
+import mmap
+import os
+
+from src.loader import as_programs, link
+
+MEMORY_SIZE = 1 << 20  # the SIC/XE address space
+
+
+def new_memory(size=MEMORY_SIZE):
+    return bytearray(size)
+
+
+def map_memory(path, size=MEMORY_SIZE, private=False):
+    """Memory backed by the file at path, which is created or zero-extended to size bytes.
+
+    Writes reach the file (and every process sharing the mapping) unless
+    private is set, in which case they stay in this process.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size, access=mmap.ACCESS_COPY if private else mmap.ACCESS_WRITE)
+    finally:
+        os.close(fd)  # the mapping keeps its own reference to the file
+
+
+def load_image(memory, path, address=0):
+    """Read a raw image file (a memory dump or image.bin) into memory at address; return its size"""
+    size = os.path.getsize(path)
+    if address + size > len(memory):
+        raise ValueError(f"Image '{path}' does not fit in memory at {address:06X}")
+    with open(path, 'rb') as f, memoryview(memory) as view:
+        f.readinto(view[address:address + size])
+    return size
+
+
+def build_image(program, path, load_address=None, size=MEMORY_SIZE):
+    """Load an HTME program (records or a file path) into a memory image file; return the entry point"""
+    programs = as_programs(program)
+    memory = map_memory(path, size)
+    try:
+        entry = link(programs, memory, load_address)[0]
+        memory.flush()
+    finally:
+        memory.close()
+    return entry
+
+
+def dump_memory(memory, path=None):
+    """Write memory out at program end.
+
+    A shared mapping is flushed to its own file when path is None. Otherwise
+    the buffer is written to path in a single call.
+    """
+    if path is None:
+        if isinstance(memory, mmap.mmap):
+            memory.flush()
+        return
+    with open(path, 'wb') as f:
+        f.write(memory)
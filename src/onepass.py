@@ -0,0 +1,228 @@
+"""
+One-pass (load-and-go) assembly.
+
+OnePassAssembler reads the source once and encodes each statement as soon
+as pass 1 has given it an address; with a memory to load into, its bytes
+go straight there. A statement whose operand names a symbol or literal that
+is not defined yet is put on that symbol's fixup list instead. When the
+label (or the literal pool) is reached, each statement waiting for it that
+has nothing else outstanding is encoded and patched in place. A format 3
+statement out of PC-relative range also waits for a BASE symbol defined
+further down.
+
+There is no intermediate file and no second scan: at the end the object
+codes already in hand become the listing and HTME records, and statements
+still waiting for symbols that were never defined are encoded with the
+same warnings pass 2 gives. The output is the same as Assembler's.
+"""
+from bisect import bisect_right
+
+from src.assembler import Assembler, AssemblyResult
+from src.assembler_pass1 import literal_value, parse_lines, report_invalid_instructions
+from src.assembler_pass2 import encode_line, format_listing_line, generate_htme_records
+from src.expressions import ExpressionError, compile_expression, evaluate
+from src.relaxation import address_operand
+
+
+def operand_names(line):
+    """The symbols (or the literal) a format 3/4 or WORD operand needs before it can be encoded"""
+    operand = line.operand
+    if not operand:
+        return ()
+    if line.mnemonic != 'WORD':
+        if line.format != 3 and line.format != 4:
+            return ()
+        if ',' in operand:
+            operand = operand.split(',')[0].strip()
+        if operand[:1] in ('#', '@'):
+            operand = operand[1:]  # as address_operand(), without the call on every statement
+        if not operand:
+            return ()
+    if operand[0] == '=' or operand.isidentifier():
+        return (operand,)
+    if operand.isdigit():
+        return ()
+    try:
+        expression = compile_expression(operand)
+    except ExpressionError:
+        return ()  # encoded right away, with pass 2's warning
+    return list(expression.terms) + [name for name in expression.scaled if name != '*']
+
+
+def pc_reachable(line, symbols):
+    """Whether a format 3 statement with a known operand gets by without the base register"""
+    operand = address_operand(line)
+    try:
+        if operand in symbols:
+            value, relative = symbols[operand], operand not in getattr(symbols, 'absolute', ())
+        else:
+            value, relative = evaluate(operand, symbols, line.address)
+    except ExpressionError:
+        return True
+    return not relative or -2048 <= value - (line.address + 3) <= 2047
+
+
+class OnePassAssembler(Assembler):
+    """Assembler that encodes statements as it reads them, patching forward references through fixup lists"""
+
+    def __init__(self, echo=False, relax=False, memory=None, profiler=None, progress=None):
+        if relax:
+            raise ValueError("Relax mode needs two passes and can't be used with the one-pass assembler")
+        super().__init__(echo, profiler=profiler, progress=progress)
+        self.memory = memory  # bytearray or machine memory to load the code into, or None
+
+    def reset(self):
+        super().reset()
+        self.lines = []
+        self.object_codes = []
+        self.messages = {}  # statement index -> its pass 2 warnings, for statements that have some
+        self.message_buffer = []  # warnings of the statement being encoded
+        self.report_message = self.message_buffer.append
+        self.base_changes = []  # (statement index, BASE symbols in effect from there on, most recent first)
+        self.fixups = {}  # undefined symbol or literal bytes -> indices of statements waiting for it
+        self.waiting = {}  # statement index -> number of fixup lists it is on, for those on more than one
+        self.patched = 0  # statements encoded late, when a forward reference was resolved
+
+    def assemble_sections(self, sections):
+        if self.memory is not None:
+            raise ValueError("Load-and-go needs a program of one control section; link separate sections instead")
+        return super().assemble_sections(sections)
+
+    def assemble_lines(self, lines, first_line=1):
+        """Assemble one program or control section in a single scan of its lines"""
+        symbols = self.symbol_table
+        fixups = self.fixups
+        statements = self.lines
+        object_codes = self.object_codes
+        statement = self.statement
+        bases = ()
+        self.encode_line = encode_line if self.profiler is None else self.profiler.encoder(encode_line)
+        with self.phase('one pass'):
+            for line in parse_lines(lines, self, first_line):
+                index = len(statements)
+                statements.append(line)
+                object_codes.append('')
+                if line.mnemonic == 'BASE':
+                    # A BASE symbol not defined yet may never be; then the one before it stays in effect
+                    bases = (line.operand,) if line.operand in symbols else (line.operand,) + bases
+                    self.base_changes.append((index, bases))
+
+                statement(index, line)
+                label = line.label
+                if label:
+                    if label == '*':
+                        self.resolve(literal_value('=' + line.operand))
+                    elif label in fixups and label in symbols:
+                        self.resolve(label)
+        report_invalid_instructions(self.invalid_instructions, self.report)
+        if self.profiler is not None:
+            self.profiler.count('source lines', len(lines))
+            self.profiler.count('statements', len(self.lines))
+
+        # Whatever still waits names a symbol that was never defined
+        for index in sorted({index for indices in self.fixups.values() for index in indices}):
+            self.encode(index, final=True)
+        self.fixups.clear()
+        self.waiting.clear()
+        for text in self.literal_refs:
+            symbols.pop(text, None)
+        for index in sorted(self.messages):
+            for message in self.messages[index]:
+                self.report(message)
+
+        listing_lines = [format_listing_line(line, code) for line, code in zip(self.lines, self.object_codes)]
+        with self.phase('htme'):
+            htme_records = generate_htme_records(self.lines, self.object_codes, self.report, symbols)
+        return AssemblyResult(self.lines, symbols, self.object_codes, listing_lines, htme_records,
+                              self.invalid_instructions, self.diagnostics)
+
+    def statement(self, index, line):
+        """Encode a new statement, or put it on the fixup list of each symbol it is missing"""
+        names = operand_names(line)
+        if not names:
+            self.encode(index)
+            return
+        symbols = self.symbol_table
+        missing = []
+        for name in names:
+            if name[0] == '=':
+                # Every literal waits for the pool after it; a malformed one is encoded now, with pass 2's warning
+                name = self.literal_refs.get(name)
+                if name is None:
+                    continue
+            elif name in symbols:
+                continue
+            if name not in missing:
+                missing.append(name)
+        if not missing:
+            self.encode(index)
+            return
+        if len(missing) > 1:
+            self.waiting[index] = len(missing)
+        fixups = self.fixups
+        for name in missing:
+            if name in fixups:
+                fixups[name].append(index)
+            else:
+                fixups[name] = [index]
+
+    def bases(self, index):
+        """BASE symbols in effect at a statement, most recent first"""
+        changes = self.base_changes
+        i = bisect_right(changes, index, key=lambda change: change[0])
+        return changes[i - 1][1] if i else ()
+
+    def resolve(self, name):
+        """Encode the statements waiting for name that have nothing else outstanding"""
+        waiting = self.waiting
+        for index in self.fixups.pop(name, ()):
+            if index in waiting:
+                waiting[index] -= 1
+                if waiting[index]:
+                    continue
+                del waiting[index]
+            self.patched += 1
+            self.encode(index)
+
+    def encode(self, index, final=False):
+        """Encode a statement whose operand is known and load it, unless it must wait for its BASE symbol"""
+        symbols = self.symbol_table
+        line = self.lines[index]
+        literal_addresses = self.literal_addresses
+        if literal_addresses and line.line_number in literal_addresses:
+            text, address = literal_addresses[line.line_number]
+            symbols[text] = address  # the copy in this statement's pool
+        base = None
+        if line.format == 3 and self.base_changes:
+            for name in self.bases(index):
+                if name in symbols:
+                    base = symbols[name]
+                    break
+                if not final:
+                    if pc_reachable(line, symbols):
+                        break
+                    self.fixups.setdefault(name, []).append(index)
+                    return
+
+        code = self.encode_line(line, symbols, base, self.report_message)
+        self.object_codes[index] = code
+        buffer = self.message_buffer
+        if buffer:
+            self.messages[index] = buffer[:]
+            buffer.clear()
+        if self.memory is not None and code:
+            try:
+                data = bytes.fromhex(code)
+            except ValueError:
+                return  # an ERROR marker has no bytes to load
+            self.memory[line.address:line.address + len(data)] = data
+
+
+def load_and_go(source, machine, echo=False):
+    """Assemble source straight into machine's memory, point it at the entry point and return the result"""
+    result = OnePassAssembler(echo, memory=machine.memory).assemble(source)
+    if hasattr(machine, 'invalidate'):
+        machine.invalidate()  # cached decodes of whatever was in memory before
+    machine.pc = int(result.htme_records[-1].split('^')[1], 16) if result.htme_records else 0
+    machine.halted = False
+    return result
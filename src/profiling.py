@@ -0,0 +1,206 @@
+"""
+Per-phase profiling for the assembler.
+
+A Profiler given to an Assembler (or to OnePassAssembler or the streaming
+assembler through its context) records wall and CPU time for each phase of
+a run: reading the source, pass 1 with the tokenizing and symbol
+definition inside it, pass 2 with the time spent in each format's encoder,
+HTME packing and writing the output files. Phases nest, and each is keyed by its path, such as
+"assemble;pass 2;format3_object_code". It also counts source lines,
+statements and instructions per format, and the peak memory of the run.
+
+Without a profiler nothing is timed: the hot loops pick their plain
+functions once, before they start. Results come out as JSON or as folded
+stacks ("a;b;c microseconds" per line), which flamegraph.pl, speedscope
+and inferno read directly. hooks are called with (path, wall, cpu) as each
+phase ends, for feeding another metrics system.
+
+Progress is separate from profiling: an assembler given a progress callable
+calls it as progress(phase, lines done, total lines) every PROGRESS_EVERY
+lines of pass 1 and pass 2. The callable can raise Cancelled to stop the
+run, which is how the GUI cancels a job on its worker thread.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from src.instructions import mnemonic_table, FORMAT_4L
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENCODER_NAMES = {1: 'format1_object_code', 2: 'format2_object_code', 3: 'format3_object_code',
+                 4: 'format4_object_code', FORMAT_4L: 'format4L_object_code'}
+DIRECTIVE_ENCODER_NAMES = {'BYTE': 'process_byte_directive', 'WORD': 'process_word_directive'}
+FORMAT_NAMES = {1: 'format 1', 2: 'format 2', 3: 'format 3', 4: 'format 4', FORMAT_4L: 'format 4L'}
+PROGRESS_EVERY = 1000  # lines between progress calls
+
+
+class Cancelled(Exception):
+    """Raised by a progress callable to stop an assembly part way through"""
+
+
+def track(items, progress, phase):
+    """Yield items, calling progress(phase, done, total) every PROGRESS_EVERY items and at the end"""
+    total = len(items) if hasattr(items, '__len__') else None
+    done = 0
+    progress(phase, 0, total)
+    for item in items:
+        yield item
+        done += 1
+        if done % PROGRESS_EVERY == 0:
+            progress(phase, done, total)
+    progress(phase, done, total)
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where the platform doesn't say"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # bytes on macOS, KiB on Linux
+
+
+class Profiler:
+    """Wall and CPU time per phase, line and instruction counts, and peak memory"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory  # also measure Python allocations with tracemalloc (slower)
+        self.totals = {}  # phase path -> [calls, wall seconds, cpu seconds]
+        self.counts = {}
+        self.hooks = []  # callables(path, wall, cpu) run as each phase ends
+        self.stack = []
+        self.traced_peak = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def path(self, name):
+        return ';'.join(self.stack + [name])
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a phase nested in the phases already running"""
+        path = self.path(name)
+        total = self.totals.setdefault(path, [0, 0.0, 0.0])  # listed in the order phases start
+        self.stack.append(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.stack.pop()
+            total[0] += 1
+            total[1] += wall
+            total[2] += cpu
+            for hook in self.hooks:
+                hook(path, wall, cpu)
+
+    def wrap(self, name, function):
+        """function timed on every call, as a child of the phase running now"""
+        path = self.path(name)
+        totals = self.totals.setdefault(path, [0, 0.0, 0.0])
+        clock, cpu_clock = time.perf_counter, time.process_time
+
+        def timed(*args):
+            wall, cpu = clock(), cpu_clock()
+            result = function(*args)
+            totals[0] += 1
+            totals[1] += clock() - wall
+            totals[2] += cpu_clock() - cpu
+            return result
+        return timed
+
+    def encoder(self, encode_line):
+        """encode_line timed per format encoder, counting the instructions of each format"""
+        timers = {}
+        counts = self.counts
+
+        def encode(line, symbol_table, base_address=None, report=print):
+            entry = mnemonic_table.get(line.mnemonic)
+            if entry is None:
+                return encode_line(line, symbol_table, base_address, report)
+            kind = FORMAT_NAMES.get(entry.format, 'directive')
+            counts[kind] = counts.get(kind, 0) + 1
+            timed = timers.get(entry.encoder)
+            if timed is None:
+                name = DIRECTIVE_ENCODER_NAMES.get(entry.name) or ENCODER_NAMES.get(entry.format)
+                timed = timers[entry.encoder] = self.wrap(name, encode_line) if name else encode_line
+            return timed(line, symbol_table, base_address, report)
+        return encode
+
+    def peak_memory(self):
+        """Peak resident set size of the process and, when traced, of Python allocations, in bytes"""
+        peak = {}
+        rss = peak_rss()
+        if rss is not None:
+            peak['rss'] = rss
+        if self.trace_memory and tracemalloc.is_tracing():
+            peak['python'] = tracemalloc.get_traced_memory()[1]
+        elif self.traced_peak is not None:
+            peak['python'] = self.traced_peak
+        return peak
+
+    def self_times(self):
+        """Wall seconds spent in each phase outside the phases nested in it"""
+        own = {path: total[1] for path, total in self.totals.items()}
+        for path, total in self.totals.items():
+            parent = path.rpartition(';')[0]
+            if parent in own:
+                own[parent] -= total[1]
+        return own
+
+    def to_dict(self):
+        own = self.self_times()
+        phases = {path: {'calls': calls, 'wall': wall, 'cpu': cpu, 'self': max(own[path], 0.0)}
+                  for path, (calls, wall, cpu) in self.totals.items() if calls}
+        return {'phases': phases, 'counts': dict(self.counts), 'peak_memory': self.peak_memory()}
+
+    def folded(self):
+        """Folded stack lines of self wall time in microseconds, for flame graph tools"""
+        return [f"{path} {round(seconds * 1e6)}" for path, seconds in self.self_times().items()
+                if seconds > 0 and self.totals[path][0]]
+
+    def write(self, path, format='json'):
+        with open(path, 'w') as f:
+            if format == 'folded':
+                for line in self.folded():
+                    f.write(f"{line}\n")
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+                f.write("\n")
+
+    def stop(self):
+        """Stop tracing Python allocations, keeping the peak"""
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def print_profile(profiler):
+    """Print the phases as an indented table, then the counts and peak memory"""
+    data = profiler.to_dict()
+    first_seen = {path: i for i, path in enumerate(data['phases'])}
+
+    def tree_order(path):
+        parts = path.split(';')
+        return [first_seen.get(';'.join(parts[:n]), 0) for n in range(1, len(parts) + 1)]
+
+    print(f"{'phase':<44}{'calls':>9}{'wall ms':>11}{'cpu ms':>11}{'self ms':>11}")
+    for path in sorted(data['phases'], key=tree_order):
+        phase = data['phases'][path]
+        depth = path.count(';')
+        name = '  ' * depth + path.rpartition(';')[2]
+        print(f"{name:<44}{phase['calls']:>9}{phase['wall'] * 1000:>11.2f}{phase['cpu'] * 1000:>11.2f}"
+              f"{phase['self'] * 1000:>11.2f}")
+    if data['counts']:
+        print(', '.join(f"{name}: {n}" for name, n in data['counts'].items()))
+    memory = data['peak_memory']
+    if memory:
+        print("Peak memory: " + ', '.join(f"{name} {size / (1024 * 1024):.1f} MB" for name, size in memory.items()))
@@ -0,0 +1,276 @@
+"""
+Regression harness: assemble and run many programs in parallel, check what they did.
+
+A manifest is a JSON file holding a list of cases, or an object with
+"defaults" (merged into every case) and "cases". Each case names a program
+and what it should do:
+
+    {
+      "name": "copy",
+      "source": "copy.asm",            # or "htme": "copy/HTME.txt"
+      "devices": {"F1": "hello\\u0000"},  # input per device: text, {"hex": ...} or {"file": ...}
+      "expect": {
+        "devices": {"05": "hello"},    # everything the program wrote, same forms as input
+        "registers": {"A": 0, "X": "000005", "CC": "="},
+        "memory": {"TOTAL": "00000F"}, # symbol (moved with "load") or absolute hex address -> hex bytes
+        "halted": true                 # the default
+      },
+      "load": "2000",                  # optional hex load address
+      "max_steps": 100000,             # instruction budget
+      "timeout": 5.0                   # seconds of run time
+    }
+
+Paths are relative to the manifest. Sources are assembled in memory through
+pass 1 and pass 2, then loaded and run on a PredecodingMachine (or a
+TranslatingMachine with "translate": true), one case per task on a process
+pool. Budgets and timeouts are checked every CHECK_EVERY instructions, so a
+runaway program only ever costs its own limit.
+"""
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from src.assembler import Assembler
+from src.devices import MemoryDevice
+from src.emulator import PredecodingMachine, MachineError
+from src.translator import TranslatingMachine
+
+DEFAULT_MAX_STEPS = 1_000_000
+DEFAULT_TIMEOUT = 10.0
+CHECK_EVERY = 10_000  # instructions run between budget and timeout checks
+
+PASSED, FAILED, ERROR, TIMEOUT = 'passed', 'failed', 'error', 'timeout'
+
+
+class CaseResult:
+    """Outcome of running one manifest case"""
+
+    def __init__(self, name, status, message='', steps=0, lines=0, assemble_seconds=0.0, run_seconds=0.0):
+        self.name = name
+        self.status = status  # PASSED, FAILED, ERROR or TIMEOUT
+        self.message = message  # why the case did not pass
+        self.steps = steps  # instructions executed
+        self.lines = lines  # source statements assembled
+        self.assemble_seconds = assemble_seconds
+        self.run_seconds = run_seconds
+
+    def to_dict(self):
+        return {'name': self.name, 'status': self.status, 'message': self.message, 'steps': self.steps,
+                'lines': self.lines, 'assemble_seconds': self.assemble_seconds,
+                'run_seconds': self.run_seconds}
+
+
+def load_manifest(path):
+    """Read a manifest and return its cases, with defaults applied and paths made absolute"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {'cases': data}
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = data.get('defaults', {})
+
+    cases = []
+    for number, entry in enumerate(data.get('cases', []), 1):
+        case = dict(defaults)
+        case.update(entry)
+        program = case.get('source') or case.get('htme')
+        if not program:
+            raise ValueError(f"Case {number} in '{path}' has no source or htme file")
+        case.setdefault('name', os.path.splitext(os.path.basename(program))[0])
+        for key in ('source', 'htme'):
+            if case.get(key):
+                case[key] = os.path.join(base, case[key])
+        case['base'] = base
+        cases.append(case)
+    return cases
+
+
+def device_bytes(spec, base):
+    """Bytes for a device input or expected output: text, {"hex": ...} or {"file": ...}"""
+    if isinstance(spec, str):
+        return spec.encode('utf-8')
+    if 'hex' in spec:
+        return bytes.fromhex(spec['hex'])
+    with open(os.path.join(base, spec['file']), 'rb') as f:
+        return f.read()
+
+
+def register_value(value):
+    """Expected register value: an int or a hex string"""
+    return int(value, 16) if isinstance(value, str) else value
+
+
+def check_case(case, machine, symbol_table, offset=0):
+    """Compare the machine against case['expect']; return a list of mismatch messages.
+
+    offset is how far the program was loaded from its assembled start; it
+    is added to symbol addresses, while hex addresses are taken as they are.
+    """
+    expect = case.get('expect', {})
+    problems = []
+    if expect.get('halted', True) and not machine.halted:
+        problems.append(f"did not halt within {case.get('max_steps', DEFAULT_MAX_STEPS)} instructions")
+
+    state = machine.state()
+    for name, wanted in expect.get('registers', {}).items():
+        name = name.upper()
+        if name not in state:
+            problems.append(f"unknown register {name}")
+            continue
+        actual = state[name]
+        if name not in ('F', 'CC'):
+            wanted = register_value(wanted)
+        if actual != wanted:
+            shown = f"{actual:06X}" if isinstance(actual, int) else actual
+            problems.append(f"{name} is {shown}, expected {wanted:06X}" if isinstance(wanted, int)
+                            else f"{name} is {shown}, expected {wanted}")
+
+    for where, wanted in expect.get('memory', {}).items():
+        address = symbol_table[where] + offset if where in symbol_table else int(where, 16)
+        wanted = bytes.fromhex(wanted)
+        actual = bytes(machine.memory[address:address + len(wanted)])
+        if actual != wanted:
+            problems.append(f"memory at {where} is {actual.hex().upper()}, expected {wanted.hex().upper()}")
+
+    for number, wanted in expect.get('devices', {}).items():
+        device = machine.devices.get(int(number, 16))
+        actual = bytes(device.output) if device is not None else b''
+        wanted = device_bytes(wanted, case['base'])
+        if actual != wanted:
+            problems.append(f"device {number} wrote {actual[:40]!r}, expected {wanted[:40]!r}")
+    return problems
+
+
+def run_case(case):
+    """Assemble (if needed), run and check one case in this process; return a CaseResult"""
+    name = case['name']
+    start = time.perf_counter()
+    symbol_table = {}
+    lines = 0
+    if case.get('source'):
+        with open(case['source'], 'r', encoding='utf-8') as f:
+            result = Assembler().assemble(f.read())
+        lines = len(result.lines)
+        if result.invalid_instructions:
+            first = result.diagnostics[0] if result.diagnostics else ''
+            return CaseResult(name, ERROR, f"{len(result.invalid_instructions)} invalid instructions, "
+                                           f"first: {first}", lines=lines,
+                              assemble_seconds=time.perf_counter() - start)
+        program = result.htme_records
+        symbol_table = result.symbol_table
+    else:
+        program = case['htme']
+    assemble_seconds = time.perf_counter() - start
+
+    devices = {int(number, 16): MemoryDevice(device_bytes(spec, case['base']))
+               for number, spec in case.get('devices', {}).items()}
+    for number in case.get('expect', {}).get('devices', {}):
+        devices.setdefault(int(number, 16), MemoryDevice())
+    if case.get('translate'):
+        machine = TranslatingMachine(devices=devices)
+    else:
+        machine = PredecodingMachine(devices=devices)
+
+    max_steps = case.get('max_steps', DEFAULT_MAX_STEPS)
+    timeout = case.get('timeout', DEFAULT_TIMEOUT)
+    offset = 0  # load address - assembled start, for memory expectations named by symbol
+    start = time.perf_counter()
+    try:
+        load_address = case.get('load')  # hex string, like sicxe run --load
+        programs = machine.load(program, int(load_address, 16) if load_address else None)
+        if load_address and programs:
+            offset = int(load_address, 16) - programs[0].start
+        deadline = start + timeout
+        while not machine.halted and machine.steps < max_steps:
+            machine.run(min(CHECK_EVERY, max_steps - machine.steps))
+            if time.perf_counter() > deadline and not machine.halted:
+                return CaseResult(name, TIMEOUT, f"still running after {timeout}s at PC={machine.pc:06X}",
+                                  machine.steps, lines, assemble_seconds, time.perf_counter() - start)
+        machine.flush_devices()
+    except (OSError, ValueError, MachineError) as e:
+        return CaseResult(name, ERROR, str(e), machine.steps, lines, assemble_seconds,
+                          time.perf_counter() - start)
+    run_seconds = time.perf_counter() - start
+
+    problems = check_case(case, machine, symbol_table, offset)
+    return CaseResult(name, FAILED if problems else PASSED, '; '.join(problems), machine.steps, lines,
+                      assemble_seconds, run_seconds)
+
+
+def guarded_run_case(case):
+    # Anything unexpected (a bad manifest entry, a missing file) fails this case, not the whole suite
+    try:
+        return run_case(case)
+    except Exception as e:
+        return CaseResult(case.get('name', '?'), ERROR, f"{type(e).__name__}: {e}")
+
+
+def run_suite(cases, jobs=None):
+    """Run cases on a process pool and return (results in manifest order, wall time)"""
+    start = time.perf_counter()
+    if jobs == 1:
+        results = [guarded_run_case(case) for case in cases]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            workers = jobs or os.cpu_count() or 1
+            chunksize = max(1, len(cases) // (workers * 4))  # few round trips for thousands of small cases
+            results = list(pool.map(guarded_run_case, cases, chunksize=chunksize))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, wall_time):
+    counts = {status: 0 for status in (PASSED, FAILED, ERROR, TIMEOUT)}
+    for r in results:
+        counts[r.status] += 1
+    steps = sum(r.steps for r in results)
+    return {
+        'cases': len(results),
+        **counts,
+        'wall_seconds': wall_time,
+        'instructions': steps,
+        'lines_assembled': sum(r.lines for r in results),
+        'cases_per_second': len(results) / wall_time if wall_time else 0.0,
+        'instructions_per_second': steps / wall_time if wall_time else 0.0,
+    }
+
+
+def write_json_report(results, wall_time, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summarize(results, wall_time), 'cases': [r.to_dict() for r in results]}, f,
+                  indent=2)
+
+
+def write_junit_report(results, wall_time, path, suite_name='sicxe'):
+    summary = summarize(results, wall_time)
+    suite = ET.Element('testsuite', name=suite_name, tests=str(summary['cases']),
+                       failures=str(summary[FAILED] + summary[TIMEOUT]), errors=str(summary[ERROR]),
+                       time=f"{wall_time:.3f}")
+    for r in results:
+        case = ET.SubElement(suite, 'testcase', classname=suite_name, name=r.name,
+                             time=f"{r.assemble_seconds + r.run_seconds:.3f}")
+        if r.status == ERROR:
+            ET.SubElement(case, 'error', message=r.message)
+        elif r.status != PASSED:
+            ET.SubElement(case, 'failure', message=r.message, type=r.status)
+    properties = ET.Element('properties')
+    for key in ('instructions', 'instructions_per_second', 'cases_per_second'):
+        ET.SubElement(properties, 'property', name=key, value=f"{summary[key]:.0f}")
+    suite.insert(0, properties)
+    root = ET.Element('testsuites')
+    root.append(suite)
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def print_suite_report(results, wall_time, verbose=False):
+    for r in results:
+        if verbose or r.status != PASSED:
+            detail = f": {r.message}" if r.message else ""
+            print(f"{r.status.upper():8} {r.name} ({r.steps} instructions, "
+                  f"{r.assemble_seconds + r.run_seconds:.3f}s){detail}")
+    s = summarize(results, wall_time)
+    print(f"\n{s['cases']} cases: {s[PASSED]} passed, {s[FAILED]} failed, {s[TIMEOUT]} timed out, "
+          f"{s[ERROR]} errors in {wall_time:.3f}s")
+    print(f"Throughput: {s['cases_per_second']:.1f} cases/sec, "
+          f"{s['instructions_per_second']:,.0f} instructions/sec")
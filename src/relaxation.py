@@ -0,0 +1,216 @@
+"""
+Automatic format 3/4 selection ("relaxation") for the assembler's relax mode.
+
+Every format 3 instruction with an address operand starts short and is
+widened to format 4 only when neither PC-relative nor base-relative
+addressing reaches its target (or an absolute operand needs more than 12
+bits, or the operand names an EXTREF symbol). Widening moves everything
+after the instruction by one byte, which can push other references out of
+reach, so widening repeats until nothing changes. Instructions are never shrunk back, so this always converges.
+
+Each reference keeps a slack: how many bytes the code between it, its
+target and its base can grow before it stops fitting. A round only
+re-checks the references whose span took in more new widenings than their
+slack, counted by bisecting the sorted positions widened in the previous
+round, so a round costs O(references * log widenings) and programs settle
+in a few rounds. Addresses during the search are the pass 1 addresses plus
+the widenings before them, kept in a Fenwick tree.
+"""
+from bisect import bisect_left
+
+from src.expressions import ExpressionError, compile_expression, external_terms
+
+
+class WideningCounts:
+    """Fenwick tree over line indices counting the widened lines before an index"""
+
+    def __init__(self, size):
+        self.tree = [0] * (size + 1)
+
+    def add(self, index):
+        tree = self.tree
+        i = index + 1
+        while i < len(tree):
+            tree[i] += 1
+            i += i & -i
+
+    def before(self, index):
+        tree = self.tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+
+class ModelSymbols:
+    """Symbol values with the current widenings applied, for compiled expressions"""
+
+    def __init__(self, symbols, positions, counts):
+        self.symbols = symbols
+        self.positions = positions  # relative symbol -> index of the line defining it
+        self.counts = counts
+
+    def __getitem__(self, name):
+        value = self.symbols[name]
+        position = self.positions.get(name)
+        return value if position is None else value + self.counts.before(position)
+
+
+class Reference:
+    """A format 3 line whose operand is a relative address"""
+
+    __slots__ = ('index', 'line', 'literal', 'expression', 'base', 'lo', 'hi', 'slack')
+
+    def __init__(self, index, line, literal, expression, base, lo, hi):
+        self.index = index
+        self.line = line
+        self.literal = literal  # (address, line index) of the literal's pool copy, or None
+        self.expression = expression  # compiled operand expression, or None for a literal
+        self.base = base  # BASE symbol in effect, or None
+        self.lo = lo  # line index span whose widening moves the target, PC or base
+        self.hi = hi
+        self.slack = 0
+
+
+def address_operand(line):
+    """The address part of a format 3 operand, without #, @ or ,X"""
+    operand = line.operand.split(',')[0].strip()
+    return operand[1:] if operand[:1] in ('#', '@') else operand
+
+
+def symbol_positions(lines, symbols):
+    """Map each relative symbol to the index of the line that defines it"""
+    absolute = getattr(symbols, 'absolute', ())
+    positions = {}
+    for index, line in enumerate(lines):
+        if line.label and line.label != '*' and line.label in symbols and line.label not in absolute:
+            positions.setdefault(line.label, index)
+    return positions
+
+
+def find_references(lines, symbols, positions, literal_addresses=None):
+    """Return (references, indices of lines that need format 4 whatever the layout)"""
+    references = []
+    always_wide = []
+    pool_lines = {}  # pool address -> index of its '*' line
+    if literal_addresses:
+        for index, line in enumerate(lines):
+            if line.label == '*':
+                pool_lines.setdefault(line.address, index)
+    base = None
+    for index, line in enumerate(lines):
+        if line.mnemonic == 'BASE' and line.operand in symbols:
+            base = line.operand
+        if line.format != 3 or not line.operand:
+            continue
+        operand = address_operand(line)
+        if not operand:
+            continue
+        if operand[0] == '=':
+            pooled = literal_addresses.get(line.line_number) if literal_addresses else None
+            if pooled is None or pooled[1] not in pool_lines:
+                continue  # pass 2 reports it
+            address = pooled[1]
+            literal, expression, depends = (address, pool_lines[address]), None, []
+        else:
+            if external_terms(operand, symbols):
+                always_wide.append(index)  # the loader needs a 20-bit field to fill in
+                continue
+            try:
+                expression = compile_expression(operand)
+                relative = expression.is_relative(symbols)
+                value = expression.evaluate(symbols, line.address)
+            except ExpressionError:
+                continue  # pass 2 reports it
+            if not relative:
+                if not 0 <= value <= 4095:
+                    always_wide.append(index)
+                continue
+            literal = None
+            depends = [name for name, n in expression.terms.items() if n and name in positions]
+        if base is not None:
+            depends.append(base)
+        span = [index] + [positions[name] for name in depends if name in positions]
+        if literal is not None:
+            span.append(literal[1])
+        references.append(Reference(index, line, literal, expression, base, min(span), max(span)))
+    return references, always_wide
+
+
+def slack_of(reference, model, counts):
+    """Bytes of growth the reference can take and still fit in format 3, or None if it doesn't fit now"""
+    address = reference.line.address + counts.before(reference.index)
+    if reference.literal is not None:
+        pool_address, pool = reference.literal
+        target = pool_address + counts.before(pool)
+    else:
+        target = reference.expression.evaluate(model, address)
+    slack = None
+    disp = target - (address + 3)
+    if -2048 <= disp <= 2047:
+        slack = min(2047 - disp, disp + 2048)
+    if reference.base is not None:
+        disp = target - model[reference.base]
+        if 0 <= disp <= 4095:
+            slack = max(slack or 0, min(4095 - disp, disp))
+    return slack
+
+
+def choose_formats(lines, context):
+    """Find the format 3 lines of a pass 1 parse that must be widened to format 4.
+
+    Returns (source line numbers to widen, statistics).
+    """
+    symbols = context.symbol_table
+    positions = symbol_positions(lines, symbols)
+    references, always_wide = find_references(lines, symbols, positions, context.literal_addresses)
+    counts = WideningCounts(len(lines))
+    model = ModelSymbols(symbols, positions, counts)
+    widened = []
+
+    def widen(index):
+        counts.add(index)
+        widened.append(index)
+
+    # First round: every reference, widening the ones that don't fit as they stand
+    for index in always_wide:
+        widen(index)
+    short = []
+    for reference in references:
+        slack = slack_of(reference, model, counts)
+        if slack is None:
+            widen(reference.index)
+        else:
+            reference.slack = slack
+            short.append(reference)
+    fresh = widened[:]
+    rounds = 1
+
+    # Later rounds: only references whose span grew past their slack are looked at again
+    checked = len(references)
+    while fresh:
+        fresh.sort()
+        previous = fresh
+        fresh = []
+        remaining = []
+        for reference in short:
+            growth = bisect_left(previous, reference.hi) - bisect_left(previous, reference.lo)
+            if growth <= reference.slack:
+                reference.slack -= growth
+                remaining.append(reference)
+                continue
+            checked += 1
+            slack = slack_of(reference, model, counts)
+            if slack is None:
+                widen(reference.index)
+                fresh.append(reference.index)
+            else:
+                reference.slack = slack
+                remaining.append(reference)
+        short = remaining
+        rounds += 1
+
+    stats = {'references': len(references) + len(always_wide), 'short': len(short), 'rounds': rounds,
+             'checks': checked}
+    return {lines[index].line_number for index in widened}, stats
@@ -0,0 +1,113 @@
+"""
+Persistent assembler server.
+
+Listens on localhost TCP or a Unix socket and speaks newline-delimited
+JSON-RPC 2.0. Each request is one line:
+
+    {"jsonrpc": "2.0", "id": 1, "method": "assemble", "params": {"source": "..."}}
+
+and each response is one line holding the symbol table, listing, object
+codes, HTME records and diagnostics. Connections are served concurrently
+with asyncio, and every assembly runs on a thread pool with its own
+Assembler context, so one resident process replaces a Python start-up per job.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from src.assembler import Assembler
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+def assemble_request(params, cache=None):
+    """Run one 'assemble' call and return its JSON result"""
+    source = params.get('source') if isinstance(params, dict) else None
+    if not isinstance(source, str):
+        raise ValueError("params.source must be a string")
+    result = Assembler().assemble(source, cache=cache)
+    return result.to_dict(include_lines=False)
+
+
+def cache_stats_request(params, cache=None):
+    return cache.stats() if cache is not None else None
+
+
+methods = {
+    'assemble': assemble_request,
+    'cache_stats': cache_stats_request,
+    'ping': lambda params, cache=None: 'pong',
+}
+
+
+def error_response(request_id, code, message):
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+async def handle_request(raw, executor, cache=None):
+    """Decode one request line and return the response dict"""
+    try:
+        request = json.loads(raw)
+    except ValueError as e:
+        return error_response(None, PARSE_ERROR, f"Parse error: {e}")
+    if not isinstance(request, dict) or 'method' not in request:
+        return error_response(None, INVALID_REQUEST, "Invalid request")
+
+    request_id = request.get('id')
+    method = methods.get(request['method'])
+    if method is None:
+        return error_response(request_id, METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(executor, method, request.get('params', {}), cache)
+    except ValueError as e:
+        return error_response(request_id, INVALID_PARAMS, str(e))
+    except Exception as e:
+        return error_response(request_id, INTERNAL_ERROR, f"Assembly failed: {e}")
+    return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+
+async def serve(host='127.0.0.1', port=8765, socket_path=None, workers=None, cache=None):
+    """Run the server until cancelled, optionally backed by an AssemblyCache"""
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def handle_client(reader, writer):
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                if not raw.strip():
+                    continue
+                response = await handle_request(raw, executor, cache)
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Long sources arrive as a single line, so raise the default 64 KiB line limit
+    limit = 64 * 1024 * 1024
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(handle_client, path=socket_path, limit=limit)
+        print(f"Serving on unix socket {socket_path}", flush=True)
+    else:
+        server = await asyncio.start_server(handle_client, host, port, limit=limit)
+        print(f"Serving on {host}:{port}", flush=True)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
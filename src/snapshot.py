@@ -0,0 +1,114 @@
+"""
+Snapshots of the full emulated machine state.
+
+A snapshot holds the registers, F, CC, PC, step count, the memory image and
+each device's buffered state in one compact binary blob: a fixed struct
+header, the zlib-compressed memory (mostly zeros, so 1 MiB packs into a
+few KiB) and one length-prefixed record per device. Restoring one takes a
+few milliseconds, so a regression harness can warm a program up once and
+fork many runs from the same state:
+
+    data = capture(machine)
+    runs = [restore(data) for _ in range(100)]
+
+run_with_checkpoints() saves a snapshot every N instructions while a
+program runs, keeping the most recent ones on disk.
+"""
+import math
+import os
+import struct
+import zlib
+
+from src.devices import MemoryDevice
+from src.emulator import PredecodingMachine, MachineError
+
+MAGIC = b'SXSN'
+VERSION = 1
+# magic, version, A X L B S T, F, CC, PC, steps, halted, memory size, compressed memory size
+HEADER = struct.Struct('<4sH6IdbIQ?II')
+DEVICE_HEADER = struct.Struct('<BI')  # device number, state length
+
+
+def capture(machine):
+    """Return a snapshot of machine as bytes"""
+    memory = zlib.compress(machine.memory, 1)
+    parts = [HEADER.pack(MAGIC, VERSION, *machine.regs[:6], machine.f, machine.cc, machine.pc,
+                         machine.steps, machine.halted, len(machine.memory), len(memory)),
+             memory]
+    devices = [(number, device) for number, device in sorted(machine.devices.items())
+               if hasattr(device, 'get_state')]
+    parts.append(struct.pack('<H', len(devices)))
+    for number, device in devices:
+        state = device.get_state()
+        parts.append(DEVICE_HEADER.pack(number, len(state)))
+        parts.append(state)
+    return b''.join(parts)
+
+
+def restore(data, machine=None):
+    """Put a snapshot back into machine (a new PredecodingMachine by default) and return it"""
+    if machine is None:
+        machine = PredecodingMachine()
+    fields = HEADER.unpack_from(data)
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        raise MachineError("Not a machine snapshot, or one from another version")
+    regs = fields[2:8]
+    f, cc, pc, steps, halted, memory_size, compressed_size = fields[8:]
+    if memory_size != len(machine.memory):
+        raise MachineError(f"Snapshot memory is {memory_size} bytes, machine memory is {len(machine.memory)}")
+
+    offset = HEADER.size
+    machine.memory[:] = zlib.decompress(data[offset:offset + compressed_size])
+    offset += compressed_size
+    if hasattr(machine, 'invalidate'):
+        machine.invalidate()  # decoded instructions and translated blocks describe the old memory
+
+    machine.regs[:6] = regs
+    machine.f, machine.cc, machine.pc, machine.steps, machine.halted = f, cc, pc, steps, halted
+
+    (count,) = struct.unpack_from('<H', data, offset)
+    offset += 2
+    for _ in range(count):
+        number, length = DEVICE_HEADER.unpack_from(data, offset)
+        offset += DEVICE_HEADER.size
+        device = machine.devices.get(number)
+        if device is None:
+            device = machine.devices[number] = MemoryDevice()
+        device.set_state(data[offset:offset + length])
+        offset += length
+    return machine
+
+
+def save_snapshot(machine, path):
+    # Write then rename, so a crash never leaves half a checkpoint behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(capture(machine))
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, machine=None):
+    with open(path, 'rb') as f:
+        return restore(f.read(), machine)
+
+
+def run_with_checkpoints(machine, every, directory, max_steps=None, keep=None):
+    """Run machine, saving a snapshot to directory every `every` instructions.
+
+    Keeps the last `keep` checkpoints (all of them by default) and returns
+    their paths, oldest first.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    remaining = math.inf if max_steps is None else max_steps
+    while not machine.halted and remaining > 0:
+        ran = machine.run(min(every, remaining))
+        remaining -= ran
+        path = os.path.join(directory, f"checkpoint-{machine.steps:012d}.snap")
+        save_snapshot(machine, path)
+        paths.append(path)
+        if keep and len(paths) > keep:
+            os.unlink(paths.pop(0))
+        if ran == 0:
+            break
+    return paths
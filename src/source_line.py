@@ -0,0 +1,27 @@
+"""
+Parsed source line record shared by pass 1, pass 2 and HTME generation.
+"""
+
+
+class SourceLine:
+    """One source statement, parsed once in pass 1"""
+
+    __slots__ = ('label', 'mnemonic', 'operand', 'format', 'address', 'size', 'line_number')
+
+    def __init__(self, label, mnemonic, operand, format, address, size, line_number):
+        self.label = label
+        self.mnemonic = mnemonic  # upper-cased, keeps the '+' of format 4
+        self.operand = operand
+        self.format = format  # one of the FORMAT_* values or 1-4
+        self.address = address
+        self.size = size
+        self.line_number = line_number
+
+    def text(self):
+        """Return the line as written to intermediate.txt"""
+        return f'{self.label}\t{self.mnemonic}\t{self.operand}'.strip()
+
+    def __repr__(self):
+        return (f'SourceLine({self.label!r}, {self.mnemonic!r}, {self.operand!r}, '
+                f'format={self.format}, address={self.address:04X}, size={self.size}, '
+                f'line={self.line_number})')
@@ -0,0 +1,146 @@
+"""
+Streaming SIC/XE assembly for sources too large to hold in memory.
+
+Pass 1 reads the source one line at a time and spills each SourceLine to a
+compact binary intermediate file. Pass 2 then makes one forward scan over
+that file, writing object code, listing and HTME records as it goes. Peak
+memory is bounded by the symbol table rather than by the size of the source.
+"""
+import os
+import struct
+import tempfile
+
+from src.assembler_pass1 import parse_lines, report_invalid_instructions, write_symbols
+from src.assembler_pass2 import (iter_encoded, iter_htme_records, format_listing_line,
+                                 ProgramInfo, LISTING_HEADER)
+from src.assembler import Assembler
+from src.source_line import SourceLine
+
+# address, size, format, source line number, the byte lengths of label, mnemonic, operand,
+# then the address of the statement's literal in its pool (-1 for none)
+RECORD_HEADER = struct.Struct('<IiBIHHHi')
+LITERAL_FIELD = struct.Struct('<i')
+LITERAL_OFFSET = RECORD_HEADER.size - LITERAL_FIELD.size
+
+
+def write_records(lines, f, context=None):
+    """Write SourceLine records to a binary file, yielding each one as it is written.
+
+    With the Assembler running pass 1 as context, a statement using a literal
+    has its pool's address patched into its record once the pool is placed,
+    and the literal is dropped from context.literal_addresses and
+    literal_refs, so only the literals waiting for the next pool are held in
+    memory.
+    """
+    pack = RECORD_HEADER.pack
+    write = f.write
+    waiting = {}  # line number -> offset of the record of a statement whose literal has no pool yet
+    for line in lines:
+        label = line.label.encode('utf-8')
+        mnemonic = line.mnemonic.encode('utf-8')
+        operand = line.operand.encode('utf-8')
+        if context is not None and context.literal_uses and context.literal_uses[-1][0] == line.line_number:
+            waiting[line.line_number] = f.tell()
+        write(pack(line.address, line.size, line.format, line.line_number,
+                   len(label), len(mnemonic), len(operand), -1))
+        write(label + mnemonic + operand)
+        if context is not None and context.literal_addresses:
+            end = f.tell()
+            for line_number, (text, address) in context.literal_addresses.items():
+                context.literal_refs.pop(text, None)  # only a parsing cache by now
+                offset = waiting.pop(line_number, None)
+                if offset is not None:
+                    f.seek(offset + LITERAL_OFFSET)
+                    write(LITERAL_FIELD.pack(address))
+            f.seek(end)
+            context.literal_addresses.clear()
+        yield line
+
+
+def read_records(f, literal_addresses=None):
+    """Yield SourceLine records back from a binary intermediate file.
+
+    A record's literal address goes into literal_addresses, keyed by its line
+    number, just before the record is yielded, for pass 2 to use and drop.
+    """
+    header_size = RECORD_HEADER.size
+    unpack = RECORD_HEADER.unpack
+    read = f.read
+    while True:
+        header = read(header_size)
+        if len(header) < header_size:
+            return
+        address, size, fmt, line_number, label_len, mnemonic_len, operand_len, literal = unpack(header)
+        text = read(label_len + mnemonic_len + operand_len).decode('utf-8')
+        operand = text[label_len + mnemonic_len:]
+        if literal >= 0 and literal_addresses is not None:
+            literal_addresses[line_number] = (operand.split(',')[0], literal)
+        yield SourceLine(text[:label_len], text[label_len:label_len + mnemonic_len], operand, fmt, address,
+                         size, line_number)
+
+
+def stream_pass1(input_file, intermediate_file, context):
+    """Run pass 1 over input_file, spilling records to intermediate_file.
+
+    Returns (program_info, line_count).
+    """
+    info = ProgramInfo()
+    count = 0
+
+    with open(input_file, 'r', encoding='utf-8') as src, open(intermediate_file, 'wb') as out:
+        for line in write_records(parse_lines(src, context), out, context):
+            if line.mnemonic == 'CSECT' and count:
+                # Sections need a symbol table each; keep the first and stop
+                context.line_error(line.line_number, "CSECT is not supported when streaming, "
+                                                     "only the first control section was assembled")
+                break
+            info.update(line)
+            count += 1
+
+    report_invalid_instructions(context.invalid_instructions, context.report)
+    return info, count
+
+
+def stream_pass2(intermediate_file, context, info, directory='data'):
+    """Run pass 2 as one forward scan over a binary intermediate file"""
+    with open(intermediate_file, 'rb') as records, \
+            open(os.path.join(directory, 'out_pass2.txt'), 'w') as obj_out, \
+            open(os.path.join(directory, 'listing.txt'), 'w') as listing_out, \
+            open(os.path.join(directory, 'HTME.txt'), 'w') as htme_out, \
+            tempfile.TemporaryFile('w+') as modification_spill:
+        listing_out.write(LISTING_HEADER)
+
+        def encoded():
+            for line, object_code in iter_encoded(read_records(records, context.literal_addresses), context):
+                obj_out.write(f"{object_code}\n")
+                listing_out.write(format_listing_line(line, object_code) + "\n")
+                yield line, object_code
+
+        for record in iter_htme_records(info, encoded(), modification_spill, symbols=context.symbol_table):
+            htme_out.write(f"{record}\n")
+
+
+def assemble_streaming(input_file, directory='data', context=None):
+    """Assemble input_file in constant memory, writing outputs to directory.
+
+    Returns (context, line_count); context is the Assembler that ran the job,
+    a fresh printing one unless given.
+    """
+    if context is None:
+        context = Assembler(echo=True)
+    os.makedirs(directory, exist_ok=True)
+    intermediate_file = os.path.join(directory, 'intermediate.bin')
+
+    with context.phase('pass 1'):
+        info, count = stream_pass1(input_file, intermediate_file, context)
+
+    with open(os.path.join(directory, 'symbTable.txt'), 'w', encoding='utf-8') as f:
+        write_symbols(f, context.symbol_table)
+
+    if count == 0:
+        context.report("Error: Missing data for HTME record generation")
+        return context, count
+
+    with context.phase('pass 2'):  # encoding, HTME packing and the output files in one scan
+        stream_pass2(intermediate_file, context, info, directory)
+    return context, count
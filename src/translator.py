@@ -0,0 +1,366 @@
+"""
+Basic-block translator for the SIC/XE emulator.
+
+TranslatingMachine interprets a program like PredecodingMachine, counting
+how often each basic block is entered. Once a block reaches the threshold
+it is translated: the straight-line code up to the next J, JEQ, JGT, JLT,
+JSUB or RSUB becomes one generated Python function that keeps A, X, L, B,
+S, T and CC in locals. A block whose branch leads back to its own start
+loops inside the function, so a hot loop runs without returning to the
+dispatcher.
+
+Formats 2 and 4L and the format 3/4 arithmetic, compare, load, store and
+jump instructions are translated; anything else (I/O, floating point,
+privileged instructions) ends a block and is interpreted. A write into a
+translated block drops it, and a block that writes over compiled code
+returns right after the store, so self-modifying code stays correct.
+"""
+import math
+from sys import exc_info
+
+from src.emulator import (PredecodingMachine, MachineError, divide, ADDRESS_MASK, WORD_MASK,
+                          HALT_ADDRESS, IMMEDIATE, INDIRECT)
+from src.instructions import FORMAT_4L
+
+TRANSLATE_THRESHOLD = 16  # block entries before a block is translated
+MAX_BLOCK_LENGTH = 64  # instructions per translated block
+
+BLOCK_ENDS = {'J', 'JEQ', 'JGT', 'JLT', 'JSUB', 'RSUB'}
+CONDITIONS = {'J': None, 'JEQ': 'cc == 0', 'JGT': 'cc > 0', 'JLT': 'cc < 0'}
+WORD_REGISTERS = {'LDA': 0, 'LDX': 1, 'LDL': 2, 'LDB': 3, 'LDS': 4, 'LDT': 5,
+                  'STA': 0, 'STX': 1, 'STL': 2, 'STB': 3, 'STS': 4, 'STT': 5}
+ARITHMETIC = {
+    'ADD': 'r0 = (r0 + {v}) & WORD_MASK',
+    'SUB': 'r0 = (r0 - {v}) & WORD_MASK',
+    'MUL': 'r0 = (((r0 ^ 0x800000) - 0x800000) * (({v} ^ 0x800000) - 0x800000)) & WORD_MASK',
+    'DIV': 'r0 = divide(r0, {v}) & WORD_MASK',
+    'AND': 'r0 &= {v}',
+    'OR': 'r0 |= {v}',
+}
+REGISTER_ARITHMETIC = {
+    'ADDR': 'r{r2} = (r{r2} + r{r1}) & WORD_MASK',
+    'SUBR': 'r{r2} = (r{r2} - r{r1}) & WORD_MASK',
+    'MULR': 'r{r2} = (((r{r2} ^ 0x800000) - 0x800000) * ((r{r1} ^ 0x800000) - 0x800000)) & WORD_MASK',
+    'DIVR': 'r{r2} = divide(r{r2}, r{r1}) & WORD_MASK',
+    'CLEAR': 'r{r1} = 0',
+    'RMO': 'r{r2} = r{r1}',
+}
+LITERAL_ARITHMETIC = {
+    'LITLD': 'r{r} = {v}',
+    'LITAD': 'r{r} = (r{r} + {v}) & WORD_MASK',
+    'LITSB': 'r{r} = (r{r} - {v}) & WORD_MASK',
+}
+FORMAT_34 = (set(ARITHMETIC) | set(WORD_REGISTERS) | BLOCK_ENDS
+             | {'COMP', 'TIX', 'LDCH', 'STCH'})
+FORMAT_2 = set(REGISTER_ARITHMETIC) | {'COMPR', 'TIXR', 'SHIFTL', 'SHIFTR'}
+FORMAT_4L_NAMES = set(LITERAL_ARITHMETIC) | {'LITCMP'}
+
+namespace = {'exc_info': exc_info, 'divide': divide, 'WORD_MASK': WORD_MASK, 'ADDRESS_MASK': ADDRESS_MASK}
+
+
+class Block:
+    """A translated basic block covering addresses [start, end)"""
+
+    __slots__ = ('start', 'end', 'length', 'last', 'function')
+
+    def __init__(self, start, end, length, last, function):
+        self.start = start
+        self.end = end
+        self.length = length  # instructions per pass through the block
+        self.last = last  # address of the last instruction
+        self.function = function  # function(machine, budget) -> instructions executed; sets machine.fault on a fault
+
+
+def translatable(inst):
+    fmt = inst.format
+    if fmt == 3 or fmt == 4:
+        return inst.name in FORMAT_34
+    if fmt == 2:
+        return inst.name in FORMAT_2 and inst.r1 < 6 and inst.r2 < 6
+    if fmt == FORMAT_4L:
+        return inst.name in FORMAT_4L_NAMES and inst.r1 < 6
+    return False
+
+
+def target_code(inst):
+    """Statements computing a format 3/4 target address, and the expression holding it"""
+    if not inst.base and not inst.indexed and inst.mode != INDIRECT:
+        return [], str(inst.target & ADDRESS_MASK)
+    expr = str(inst.target)
+    if inst.base:
+        expr += ' + r3'
+    if inst.indexed:
+        expr += ' + r1'
+    lines = [f't = ({expr}) & ADDRESS_MASK']
+    if inst.mode == INDIRECT:
+        lines.append('t = ((mem[t] << 16) | (mem[t + 1] << 8) | mem[t + 2]) & ADDRESS_MASK')
+    return lines, 't'
+
+
+def word_at(ta):
+    if ta == 't':
+        return '((mem[t] << 16) | (mem[t + 1] << 8) | mem[t + 2])'
+    ta = int(ta)
+    return f'((mem[{ta}] << 16) | (mem[{ta + 1}] << 8) | mem[{ta + 2}])'
+
+
+def compare_code(a, b):
+    """Statements setting cc from two 24-bit words compared as signed integers"""
+    return [f'u = ({a} ^ 0x800000) - 0x800000',
+            f'v = ({b} ^ 0x800000) - 0x800000',
+            'cc = (u > v) - (u < v)']
+
+
+def exit_code(pc, count):
+    """Statements that write the locals back and leave the block"""
+    return ['regs[:6] = r0, r1, r2, r3, r4, r5', 'm.cc = cc', f'm.pc = {pc}', f'return {count}']
+
+
+def instruction_code(inst, count):
+    """Statements for one non-branching instruction; count is the instructions done after it"""
+    name = inst.name
+    fmt = inst.format
+    if fmt == 2:
+        r1, r2 = inst.r1, inst.r2
+        if name in REGISTER_ARITHMETIC:
+            return [REGISTER_ARITHMETIC[name].format(r1=r1, r2=r2)]
+        if name == 'COMPR':
+            return compare_code(f'r{r1}', f'r{r2}')
+        if name == 'TIXR':
+            return ['r1 = (r1 + 1) & WORD_MASK'] + compare_code('r1', f'r{r1}')
+        n = (r2 + 1) % 24
+        if name == 'SHIFTL':
+            return [f'r{r1} = ((r{r1} << {n}) | (r{r1} >> {24 - n})) & WORD_MASK']
+        return [f'r{r1} = (((r{r1} ^ 0x800000) - 0x800000) >> {r2 + 1}) & WORD_MASK']
+
+    if fmt == FORMAT_4L:
+        if name == 'LITCMP':
+            return [f'u = (r{inst.r1} ^ 0x800000) - 0x800000', f'cc = (u > {inst.target}) - (u < {inst.target})']
+        return [LITERAL_ARITHMETIC[name].format(r=inst.r1, v=inst.target)]
+
+    lines, ta = target_code(inst)
+    value = ta if inst.mode == IMMEDIATE else word_at(ta)
+    if name in ARITHMETIC:
+        return lines + [ARITHMETIC[name].format(v=value)]
+    if name == 'COMP':
+        return lines + compare_code('r0', value)
+    if name == 'TIX':
+        return lines + ['r1 = (r1 + 1) & WORD_MASK'] + compare_code('r1', value)
+    if name == 'LDCH':
+        byte = f'({ta} & 0xFF)' if inst.mode == IMMEDIATE else f'mem[{ta}]'
+        return lines + [f'r0 = (r0 & 0xFFFF00) | {byte}']
+    if name.startswith('LD'):
+        return lines + [f'r{WORD_REGISTERS[name]} = {value}']
+
+    # Stores go through the machine so its caches see the write
+    if name == 'STCH':
+        lines.append(f'm.write({ta}, bytes((r0 & 0xFF,)))')
+    else:
+        lines.append(f'm.write_word({ta}, r{WORD_REGISTERS[name]})')
+    leave = exit_code(inst.address + inst.size, f'n + {count}')
+    return lines + ['if m.code_written:'] + ['    ' + line for line in leave]
+
+
+def branch_code(inst, start, length, loops):
+    """Statements for the branch that ends a block"""
+    name = inst.name
+    next_pc = inst.address + inst.size
+    if name == 'RSUB':
+        return exit_code('r2', f'n + {length}')
+    lines, ta = target_code(inst)
+    if name == 'JSUB':
+        return lines + [f'r2 = {next_pc}'] + exit_code(ta, f'n + {length}')
+
+    if loops and ta == str(start):
+        taken = [f'n += {length}', f'if n + {length} <= budget:', '    continue'] + exit_code(ta, 'n')
+    else:
+        taken = exit_code(ta, f'n + {length}')
+    condition = CONDITIONS[name]
+    if condition is None:
+        return lines + taken
+    return lines + [f'if {condition}:'] + ['    ' + line for line in taken] + exit_code(next_pc, f'n + {length}')
+
+
+def translate_block(instruction_at, start):
+    """Translate the basic block at start into a Block, or return None if its first instruction can't be.
+
+    instruction_at(address) returns the decoded Instruction at an address.
+    """
+    instructions = []
+    address = start
+    while len(instructions) < MAX_BLOCK_LENGTH:
+        try:
+            inst = instruction_at(address)
+        except (MachineError, IndexError):
+            break
+        if not translatable(inst):
+            break
+        instructions.append(inst)
+        address += inst.size
+        if inst.name in BLOCK_ENDS:
+            break
+    if not instructions:
+        return None
+
+    length = len(instructions)
+    last = instructions[-1]
+    ends_in_branch = last.name in BLOCK_ENDS
+    # A lone jump back to itself is a halt, not a loop
+    loops = ends_in_branch and length > 1
+
+    # Each instruction's statements, with what a fault in them leaves behind:
+    # (address, next PC, instructions done before it), as Machine would have it
+    code = [(inst, instruction_code(inst, count), count - 1)
+            for count, inst in enumerate(instructions[:-1] if ends_in_branch else instructions, 1)]
+    if ends_in_branch:
+        code.append((last, branch_code(last, start, length, loops), length - 1))
+    else:
+        code[-1][1].extend(exit_code(address, f'n + {length}'))
+
+    indent = '            ' if loops else '        '
+    source = ['def block(m, budget):',
+              '    regs = m.regs',
+              '    mem = m.memory',
+              '    r0, r1, r2, r3, r4, r5 = regs[:6]',
+              '    cc = m.cc',
+              '    n = 0',
+              '    try:']
+    if loops:
+        source.append('        while True:')
+    faults = {}
+    for inst, lines, done in code:
+        for line in lines:
+            source.append(indent + line)
+            faults[len(source)] = (inst.address, inst.address + inst.size, done)
+    # A fault leaves the registers, CC, PC and step count as the interpreter would
+    source += ['    except Exception:',
+               '        regs[:6] = r0, r1, r2, r3, r4, r5',
+               '        m.cc = cc',
+               '        address, m.pc, done = faults[exc_info()[2].tb_lineno]',
+               '        m.fault = (address, n + done)',
+               '        raise']
+
+    scope = dict(namespace, faults=faults)
+    exec(compile('\n'.join(source), f'<block {start:06X}>', 'exec'), scope)
+    return Block(start, address, length, last.address, scope['block'])
+
+
+class TranslatingMachine(PredecodingMachine):
+    """PredecodingMachine that translates hot basic blocks into Python functions"""
+
+    def __init__(self, memory=None, devices=None, threshold=TRANSLATE_THRESHOLD):
+        super().__init__(memory, devices)
+        self.threshold = threshold
+        self.blocks = {}  # start address -> Block
+        self.block_pages = {}  # 256-byte page -> start addresses of blocks touching it
+        self.entries = {}  # block start -> entries while interpreted
+        self.instructions = {}  # address -> decoded Instruction, current while its icache entry is
+        self.untranslatable = set()  # block starts whose first instruction can't be translated
+        self.block_ends = set()  # addresses of decoded branch instructions
+        self.code_written = False  # set when a write drops a translated block
+        self.fault = None  # (address, instructions done) of the last instruction that faulted in a block
+        self.translated = 0
+
+    def invalidate(self):
+        super().invalidate()
+        self.blocks.clear()
+        self.block_pages.clear()
+        self.entries.clear()
+        self.instructions.clear()
+        self.untranslatable.clear()
+        self.block_ends.clear()
+
+    def cache_instruction(self, inst):
+        self.instructions[inst.address] = inst
+        if inst.name in BLOCK_ENDS:
+            self.block_ends.add(inst.address)
+        return super().cache_instruction(inst)
+
+    def instruction_at(self, address):
+        """The Instruction at address, decoded only if the icache holds no current entry for it"""
+        if address not in self.icache:
+            self.predecode(address)
+        return self.instructions[address]
+
+    def translate(self, start):
+        block = translate_block(self.instruction_at, start)
+        if block is None:
+            self.untranslatable.add(start)
+            return None
+        self.blocks[start] = block
+        for page in range(start >> 8, ((block.end - 1) >> 8) + 1):
+            self.block_pages.setdefault(page, set()).add(start)
+        self.translated += 1
+        return block
+
+    def drop_block(self, start):
+        block = self.blocks.pop(start)
+        for page in range(start >> 8, ((block.end - 1) >> 8) + 1):
+            self.block_pages[page].discard(start)
+        self.entries.pop(start, None)
+
+    def write(self, address, data):
+        super().write(address, data)
+        end = address + len(data)
+        if not self.blocks:
+            return
+        for page in {address >> 8, (end - 1) >> 8}:
+            for start in list(self.block_pages.get(page, ())):
+                block = self.blocks[start]
+                if start < end and address < block.end:
+                    self.drop_block(start)
+                    self.code_written = True
+
+    def run(self, max_steps=None):
+        first = steps = self.steps
+        limit = math.inf if max_steps is None else first + max_steps
+        icache = self.icache
+        blocks = self.blocks
+        entries = self.entries
+        block_ends = self.block_ends
+        untranslatable = self.untranslatable
+        threshold = self.threshold
+        predecode = self.predecode
+        address = self.pc
+        at_block_start = True
+        try:
+            while not self.halted and steps < limit:
+                address = self.pc
+                if at_block_start:
+                    block = blocks.get(address)
+                    if block is None and address not in untranslatable:
+                        count = entries.get(address, 0) + 1
+                        entries[address] = count
+                        if count >= threshold:
+                            block = self.translate(address)
+                    if block is not None and steps + block.length <= limit:
+                        self.code_written = False
+                        try:
+                            steps += block.function(self, limit - steps)
+                        except Exception:
+                            address, done = self.fault
+                            steps += done
+                            raise
+                        pc = self.pc
+                        # A block cut short by a write to code stops before its last instruction
+                        if pc == HALT_ADDRESS or (pc == block.last and not self.code_written):
+                            self.halted = True
+                        continue
+
+                entry = icache.get(address)
+                if entry is None:
+                    entry = predecode(address)
+                operation, self.pc, a, b = entry
+                operation(self, a, b)
+                steps += 1
+                pc = self.pc
+                if pc == address or pc == HALT_ADDRESS:
+                    self.halted = True
+                at_block_start = address in block_ends
+        except IndexError:
+            raise MachineError(f"Memory access outside memory at {address:06X}") from None
+        finally:
+            self.steps = steps
+        if self.halted:
+            self.flush_devices()
+        return steps - first
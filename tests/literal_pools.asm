@@ -0,0 +1,11 @@
+LITPOOL START 0
+FIRST LDA =X'000005'
+ +J NEXT
+ LTORG
+GAP RESB 4000
+NEXT ADD =X'000005'
+ STA TOTAL
+HALT J HALT
+ LTORG
+TOTAL RESW 1
+ END FIRST
@@ -0,0 +1,67 @@
+"""
+A fault inside a translated block leaves the machine as the interpreters do.
+
+Each program loops long enough for TranslatingMachine to translate its loop,
+then faults part way through the block: Machine, PredecodingMachine and
+TranslatingMachine must stop with the same registers, CC, PC and step count.
+"""
+import pytest
+
+from src.assembler import Assembler
+from src.emulator import Machine, PredecodingMachine, MachineError
+from src.translator import TranslatingMachine
+
+# DIV by zero once COUNT has counted down from 25
+DIVIDE_BY_ZERO = """\
+DIVZ START 0
+FIRST LDA #1000
+LOOP LDA #1000
+ DIV COUNT
+ STA RESULT
+ LDA COUNT
+ SUB #1
+ STA COUNT
+ COMP #3
+ J LOOP
+COUNT WORD 25
+RESULT RESW 1
+ END FIRST
+"""
+
+# Indirect load through a pointer that walks off the end of memory
+OUTSIDE_MEMORY = """\
+FAR START 0
+FIRST LDX #0
+LOOP LDA POINTER
+ ADD STEP
+ STA POINTER
+ LDA @POINTER
+ TIXR T
+ J LOOP
+POINTER WORD 1048485
+STEP WORD 3
+ END FIRST
+"""
+
+
+def run_until_fault(machine_class, source):
+    result = Assembler().assemble(source)
+    assert not result.diagnostics
+    machine = machine_class()
+    machine.load(result.htme_records)
+    with pytest.raises(MachineError):
+        machine.run(10_000)
+    return machine
+
+
+def outcome(machine):
+    return machine.state(), machine.steps
+
+
+@pytest.mark.parametrize('source', [DIVIDE_BY_ZERO, OUTSIDE_MEMORY], ids=['divide-by-zero', 'outside-memory'])
+def test_fault_in_translated_block(source):
+    expected = outcome(run_until_fault(Machine, source))
+    assert outcome(run_until_fault(PredecodingMachine, source)) == expected
+    translating = run_until_fault(TranslatingMachine, source)
+    assert translating.translated
+    assert outcome(translating) == expected